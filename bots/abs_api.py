@@ -6,23 +6,76 @@ import os
 import random
 
 from abc import ABC, abstractmethod
+from collections import defaultdict
+from textwrap import dedent
 from asgiref.sync import sync_to_async
 from django.utils import timezone
-from courses.models import Course, Office, Client, Task
-from typing import Tuple, List, Dict, Union
+from courses.models import Course, Office, Client, Task, CourseClient
+from typing import Any, Awaitable, Callable, Tuple, List, Dict, Union
 from asyncio.subprocess import create_subprocess_exec
 from django.conf import settings
+from .scheduler import TaskScheduler, ScheduledJob
+from .delay_queue import RedisTaskScheduler
+from .change_feed import AdminEventConsumer
+from . import change_feed
+from .rate_limit import RateLimiter, RetryAfter
+from .state_store import UserStateStore
+from .registration import RegistrationBuffer
 
 
 class AbstractAPI(ABC):
 
+    platform = None
+    user_id_field = None
+    # Параметры RateLimiter: лимиты исходящих запросов платформы
+    rate_limits = {'rate': 20}
+    max_retries = 5
+
     @abstractmethod
     def __init__(self, redis_db: redis.Redis, session: aiohttp.ClientSession = None, loop=None, hour_offset=5):
         self.session = session
         self.redis_db = redis_db
         self.loop = loop
-        self.sending_tasks = None
+        if redis_db:
+            self.sending_tasks = RedisTaskScheduler(
+                self.run_scheduled_job, redis_db, f'delay_queue_{self.platform}', loop=loop
+            )
+            self.admin_events = AdminEventConsumer(redis_db, self.platform)
+            self.user_states = UserStateStore(redis_db, self.platform)
+            self.registrations = RegistrationBuffer(self.user_id_field, self.user_states)
+        else:
+            self.sending_tasks = TaskScheduler(self.run_scheduled_job, loop=loop)
         self.hour_offset = hour_offset
+        self.rate_limiter = RateLimiter(**self.rate_limits)
+
+    async def limited_request(self, send: Callable[[], Awaitable[Any]], chat_id=None) -> Any:
+        """
+        Выполнение запроса к API в пределах лимитов платформы.
+        При ограничении частоты со стороны сервера (RetryAfter) запрос
+        повторяется после паузы с разбросом, не более max_retries раз.
+        """
+
+        for attempt in range(self.max_retries + 1):
+            await self.rate_limiter.acquire(chat_id)
+            try:
+                return await send()
+            except RetryAfter as err:
+                if attempt == self.max_retries:
+                    self.rate_limiter.failed += 1
+                    raise
+                self.rate_limiter.retries += 1
+                if err.scope == 'global':
+                    self.rate_limiter.pause(err.retry_after)
+                elif chat_id is not None:
+                    self.rate_limiter.pause(err.retry_after, chat_id)
+                await asyncio.sleep(err.retry_after + random.uniform(0, 1))
+            except aiohttp.ClientConnectorError:
+                # запрос не был отправлен - повтор не приведет к дублю сообщения
+                if attempt == self.max_retries:
+                    self.rate_limiter.failed += 1
+                    raise
+                self.rate_limiter.retries += 1
+                await asyncio.sleep(min(2 ** attempt, 30) * random.uniform(0.5, 1.5))
 
     @staticmethod
     @abstractmethod
@@ -51,7 +104,7 @@ class AbstractAPI(ABC):
         pass
 
     @abstractmethod
-    async def update_message_sending_tasks(self, *args, **kwargs):
+    async def get_reminder_message_kwargs(self) -> Dict[str, str]:
         pass
 
     @abstractmethod
@@ -66,7 +119,9 @@ class AbstractAPI(ABC):
         """
 
         group_task_name, timer = task_name.split(':')
-        instance_task = await Task.objects.aget(task_name=group_task_name)
+        instance_task = await Task.objects.filter(task_name=group_task_name).afirst()
+        if not instance_task:
+            return False
         instance_task.call_counter += 1
         if instance_task.call_counter > len(instance_task.timers):
             return False
@@ -77,6 +132,98 @@ class AbstractAPI(ABC):
         await sync_to_async(instance_task.save)()
         return True
 
+    async def restore_sending_tasks(self) -> None:
+        """
+        Восстановление отложенных задач при запуске бота.
+        Задачи из очереди Redis переживают перезапуск, поэтому полный обход
+        курсов выполняется только при потере данных очереди или по истечении seed_ttl
+        """
+
+        if self.sending_tasks.should_rebuild():
+            await self.update_message_sending_tasks()
+
+    async def get_reminder_jobs(
+            self,
+            course_filter: Dict = None,
+            client_pk: int = None,
+            time_offset: int = 5 * 3600,
+            reminder_text: str = None
+    ) -> List[Tuple[str, float, str, tuple, dict]]:
+        """
+        Задачи напоминаний о предстоящих курсах для sending_tasks.add_many.
+        Все записи клиентов на курсы и таймеры этих курсов загружаются двумя запросами
+        """
+
+        now = timezone.now()
+        future_courses_filter = {'course__scheduled_at__gt': now, 'course__published_in_bot': True}
+        future_courses_filter.update(course_filter or {})
+        course_clients = CourseClient.objects.filter(
+            **future_courses_filter, **{f'client__{self.user_id_field}__isnull': False}
+        )
+        if client_pk:
+            course_clients = course_clients.filter(client_id=client_pk)
+        course_clients = await sync_to_async(list)(course_clients.select_related('course', 'client'))
+        if not course_clients:
+            return []
+        course_timers = await sync_to_async(list)(
+            Course.reminder_intervals.through.objects
+            .filter(**future_courses_filter)
+            .select_related('timer')
+        )
+        office = await Office.objects.async_first()
+        message_kwargs = await self.get_reminder_message_kwargs()
+        reminder_intervals = defaultdict(list)
+        for course_timer in course_timers:
+            reminder_intervals[course_timer.course_id].append(course_timer.timer.reminder_interval)
+
+        jobs = []
+        for course_client in course_clients:
+            course, client = course_client.course, course_client.client
+            time_to_start = (course.scheduled_at - now).total_seconds() - time_offset
+            intervals = [
+                (remind_before, time_to_start - remind_before * 3600)
+                for remind_before in reminder_intervals[course.pk]
+                if time_to_start - remind_before * 3600 >= 0
+            ]
+            if not intervals:
+                continue
+            user_id = getattr(client, self.user_id_field)
+            msg = dedent(reminder_text or await self.create_reminder_text(client.first_name, course, office))
+            for remind_before, interval in intervals:
+                task_name = await self.create_key_task(user_id, course.pk, remind_before)
+                jobs.append((task_name, interval, 'send_message', (user_id, msg), message_kwargs))
+        return jobs
+
+    async def update_message_sending_tasks(
+            self,
+            time_offset: int = 5 * 3600,
+            reminder_text: str = None
+    ) -> TaskScheduler:
+        """
+        Создание отложенных задач по отправке сообщений пользователям по данным базы данных.
+        Задачи регистрируются в планировщике одной пачкой по именам, устаревшие напоминания
+        удаляются. Остальные задачи очереди (рассылки) не затрагиваются
+        """
+
+        jobs = await self.get_reminder_jobs(time_offset=time_offset, reminder_text=reminder_text)
+        self.sending_tasks.replace(jobs, change_feed.get_remind_task_prefix(self.platform))
+        return self.sending_tasks
+
+    async def run_scheduled_job(self, job: ScheduledJob) -> None:
+        """Выполнение задачи, срок которой наступил в планировщике sending_tasks"""
+
+        await getattr(self, job.coro)(*job.args, **job.kwargs)
+
+    async def run_db_task(self, task_name: str, schedule_func: str, /, *args, **kwargs) -> None:
+        """
+        Выполнение задачи из таблицы Task с пометкой в базе данных.
+        task_name должна иметь формат {Task.task_name}:{Task.timers[i]}
+        """
+
+        if not await self.__mark_task_in_db(task_name):
+            return
+        await getattr(self, schedule_func)(*args, **kwargs)
+
     async def schedule_task(
             self,
             task_name: str,
@@ -85,21 +232,18 @@ class AbstractAPI(ABC):
             mark_to_db: bool,
             /,
             *args, **kwargs,
-    ) -> asyncio.Task:
+    ) -> str:
         """
-        Создание отложенной задачи из schedule_func.
+        Создание отложенной задачи из schedule_func в планировщике sending_tasks.
         Если mark_to_db=True, то task_name должна иметь формат {Task.task_name}:{Task.timers[i]} и
         в этом случае делается пометка в базе данных о выполнении задачи
         """
 
-        async def coro() -> None:
-            await asyncio.sleep(current_timer)
-            mark_task_flag = await self.__mark_task_in_db(task_name)
-            if mark_to_db and not mark_task_flag:
-                return
-            await getattr(self, schedule_func)(*args, **kwargs)
-            del self.sending_tasks[task_name]
-        return asyncio.ensure_future(coro(), loop=self.loop)
+        if mark_to_db:
+            self.sending_tasks.add(task_name, current_timer, 'run_db_task', task_name, schedule_func, *args, **kwargs)
+        else:
+            self.sending_tasks.add(task_name, current_timer, schedule_func, *args, **kwargs)
+        return task_name
 
     async def __get_database_bypass_timer(
             self,
@@ -159,7 +303,7 @@ class AbstractAPI(ABC):
                         continue
                     for timer in task.timers:
                         task_name = f'{task.task_name}:{timer}'
-                        if self.sending_tasks.get(task_name):
+                        if task_name in self.sending_tasks:
                             continue
                         if timer in task.completed_timers:
                             continue
@@ -186,14 +330,13 @@ class AbstractAPI(ABC):
                             task.call_counter += 1
                             await sync_to_async(task.save)()
                             continue
-                        real_task = await self.schedule_task(
+                        await self.schedule_task(
                             task_name,
                             task.coro,
                             int(current_timer),
                             True,
                             *args, **kwargs,
                         )
-                        self.sending_tasks.update({task_name: real_task})
                 if force:
                     break
         asyncio.ensure_future(coro(), loop=self.loop)
@@ -263,9 +406,7 @@ class AbstractAPI(ABC):
                                 for msg in msg_steps['No_courses']
                             )
                             for real_task_name in real_tasks:
-                                if self.sending_tasks.get(real_task_name):
-                                    self.sending_tasks[real_task_name].cancel()
-                                    del self.sending_tasks[real_task_name]
+                                self.sending_tasks.cancel(real_task_name)
                             await sync_to_async(db_task.delete)()
                         for course in past_courses_prefetch_clients:
                             if user in await sync_to_async(course.clients.all)():
@@ -297,19 +438,35 @@ class AbstractAPI(ABC):
                 }]]
                 keyboard = {'inline': True, 'buttons': button}
                 kwargs.update(keyboard=json.dumps(keyboard, ensure_ascii=False))
-            await Task.objects.async_get_or_create(
-                task_name=f'{task_name_start}_{msg["timer"]}',
-                defaults={
-                    'coro': 'send_message',
-                    'timers': [timer],
-                    'completed_timers': list(),
-                    'args': args,
-                    'kwargs': kwargs
-                }
+            task_defaults = {
+                'coro': 'send_message',
+                'timers': [timer],
+                'completed_timers': list(),
+                'args': args,
+                'kwargs': kwargs
+            }
+            if user.pk is None:
+                # пользователь в буфере регистрации: задача будет записана вместе с ним
+                self.registrations.add_task(Task(task_name=f'{task_name_start}_{msg["timer"]}', **task_defaults))
+            else:
+                __, created = await Task.objects.async_get_or_create(
+                    task_name=f'{task_name_start}_{msg["timer"]}',
+                    defaults=task_defaults
+                )
+                if not created:
+                    continue
+            # Сразу ставим задачу в очередь, не дожидаясь обхода таблицы Task
+            await self.schedule_task(
+                f'{task_name_start}_{msg["timer"]}:{timer}',
+                'send_message',
+                msg['timer'] + start_timer,
+                True,
+                *args, **kwargs,
             )
         if task_name_start not in user.completed_tasks:
             user.completed_tasks.append(task_name_start)
-            await sync_to_async(user.save)()
+            if user.pk is not None:
+                await sync_to_async(user.save)()
 
     @staticmethod
     async def get_or_create_task_to_db(
@@ -332,59 +489,32 @@ class AbstractAPI(ABC):
             }
         )
 
-    async def update_tasks_triggered_admin(self, key_trigger):
-        """Обновление отложенных задач отправки, если были изменения в админ-панели"""
+    async def flush_user_states(self) -> int:
+        """Перенос новых пользователей и изменившихся состояний диалогов в базу данных"""
 
-        if self.redis_db.get(key_trigger) and int(self.redis_db.get(key_trigger)):
-            if self.sending_tasks:
-                for __, task in self.sending_tasks.items():
-                    task.cancel()
-                self.sending_tasks.clear()
-            await self.update_message_sending_tasks()
-            self.redis_db.delete(key_trigger)
+        await self.registrations.flush()
+        return await sync_to_async(self.user_states.flush)()
 
-    @abstractmethod
-    async def update_message_single_sending_task(
-            self,
-            course: Course,
-            client: Client,
-            office: Office,
-            interval,
-            remind_before
-    ):
-        pass
+    async def apply_admin_events(self):
+        """
+        Применение изменений из админ-панели к отложенным задачам напоминаний.
+        События читаются из потока Redis платформы, изменяются только задачи затронутых курсов и клиентов
+        """
 
-    async def update_course_tasks_triggered_admin(self, key_trigger: str):
-        if not self.redis_db.get(key_trigger):
-            return
-        data_update_tasks = json.loads(self.redis_db.get(key_trigger))
-        self.redis_db.delete(key_trigger)
-        if data_update_tasks['deleted_tasks']:
-            for task_name in data_update_tasks['deleted_tasks']:
-                if self.sending_tasks.get(task_name):
-                    self.sending_tasks[task_name].cancel()
-                    del self.sending_tasks[task_name]
-        for course_pk in data_update_tasks['course_pks']:
-            course = await sync_to_async(Course.objects.filter)(pk=course_pk)
-            courses_prefetch = await sync_to_async(course.prefetch_related)('clients', 'reminder_intervals')
-            course_of_tasks = await sync_to_async(courses_prefetch.first)()
-            if not course_of_tasks:
-                continue
-            clients = await sync_to_async(course_of_tasks.clients.all)()
-            if not clients:
-                return
-            reminder_intervals = await sync_to_async(course_of_tasks.reminder_intervals.all)()
-            office = await Office.objects.async_first()
-            time_to_start = (course_of_tasks.scheduled_at - timezone.now()).total_seconds()
-            time_offset = 5 * 3600
-            for remind_before in reminder_intervals:
-                interval = time_to_start - time_offset - remind_before.reminder_interval * 3600
-                if interval < 0:
-                    continue
-                for client in clients:
-                    await self.update_message_single_sending_task(
-                        course_of_tasks, client, office, interval, remind_before
-                    )
+        events = self.admin_events.read()
+        for event in events:
+            for task_name in event.task_names:
+                self.sending_tasks.cancel(task_name)
+            if event.type in (change_feed.COURSE_RESCHEDULED, change_feed.TIMER_CHANGED):
+                jobs = await self.get_reminder_jobs(course_filter={'course_id': event.course_pk})
+            elif event.type == change_feed.CLIENT_ENROLLED:
+                jobs = await self.get_reminder_jobs(
+                    course_filter={'course_id': event.course_pk}, client_pk=event.client_pk
+                )
+            else:
+                jobs = []
+            self.sending_tasks.add_many(jobs)
+            self.admin_events.ack([event.id])
 
     async def create_message_tasks(self, key_trigger):
         if not self.redis_db.get(key_trigger):
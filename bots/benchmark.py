@@ -0,0 +1,338 @@
+import asyncio
+import concurrent.futures
+import contextvars
+import json
+import random
+import time
+import weakref
+
+from aiohttp import web
+from collections import Counter, defaultdict, deque
+from typing import Any, Dict, List
+from django.db import connections
+from django.db.backends.signals import connection_created
+from django.db.models import QuerySet
+from django_async_orm.query import QuerySetAsync
+from .general import LongPollServer
+from .transport import transport
+
+# Шаг сценария, к которому относятся SQL-запросы и вызовы API текущего обработчика
+current_step = contextvars.ContextVar('benchmark_step', default=None)
+
+# Соединения всех потоков, на которых ставился счетчик запросов: connections.all()
+# возвращает только соединения текущего потока
+instrumented_connections = weakref.WeakSet()
+
+
+def fetch_all_with_context(queryset: QuerySetAsync) -> None:
+    """
+    QuerySetAsync._fetch_all, передающий в поток выборки контекст вызывающего кода.
+    django_async_orm выполняет выборку в новом потоке, где current_step не виден
+    """
+
+    context = contextvars.copy_context()
+    with concurrent.futures.ThreadPoolExecutor(max_workers=1) as executor:
+        executor.submit(context.run, QuerySet._fetch_all, queryset)
+
+PHONE = '+7 916 123-45-67'
+TG_STEPS = ('start', 'menu', 'future_courses', 'course_info', 'enroll', 'phone')
+VK_STEPS = TG_STEPS
+
+
+class MockServer:
+    """
+    Локальная заглушка API мессенджера для нагрузочных замеров.
+    Отдает боту подготовленные события и считает его исходящие вызовы по методам
+    """
+
+    def __init__(self, poll_timeout: float = 0.05):
+        self.app = web.Application()
+        self.poll_timeout = poll_timeout
+        self.updates: deque[dict] = deque()
+        self.calls: Counter[str] = Counter()
+        self.runner: web.AppRunner | None = None
+        self.url: str | None = None
+
+    async def start(self, host: str = '127.0.0.1') -> str:
+        self.runner = web.AppRunner(self.app, access_log=None)
+        await self.runner.setup()
+        await web.TCPSite(self.runner, host, 0).start()
+        self.url = f'http://{host}:{self.runner.addresses[0][1]}'
+        return self.url
+
+    async def stop(self) -> None:
+        if self.runner:
+            await self.runner.cleanup()
+
+    def feed(self, updates: List[dict]) -> None:
+        self.updates.extend(updates)
+
+    async def take_updates(self, limit: int) -> List[dict]:
+        if not self.updates:
+            # пустой ответ Long Poll приходит после ожидания, как и у настоящего сервера
+            await asyncio.sleep(self.poll_timeout)
+        return [self.updates.popleft() for __ in range(min(limit, len(self.updates)))]
+
+
+class MockTgServer(MockServer):
+    """Заглушка Bot API: getUpdates и методы отправки"""
+
+    def __init__(self, **kwargs):
+        super().__init__(**kwargs)
+        self.update_id = 0
+        self.message_id = 0
+        self.app.router.add_post('/bot{token}/{method}', self.handle)
+
+    def feed(self, updates: List[dict]) -> None:
+        for update in updates:
+            self.update_id += 1
+            update['update_id'] = self.update_id
+        super().feed(updates)
+
+    async def handle(self, request: web.Request) -> web.Response:
+        method = request.match_info['method'].lower()
+        payload = await request.json() if request.can_read_body else {}
+        if method == 'getupdates':
+            updates = await self.take_updates(payload.get('limit', 100))
+            return web.json_response({'ok': True, 'result': updates})
+        self.calls[method] += 1
+        self.message_id += 1
+        chat_id = payload.get('chat_id', 0)
+        result = {
+            'message_id': self.message_id,
+            'date': int(time.time()),
+            'chat': {'id': chat_id, 'type': 'private'},
+        }
+        return web.json_response({'ok': True, 'result': result})
+
+
+class MockVkServer(MockServer):
+    """Заглушка API VK: методы сообщества и сервер Long Poll"""
+
+    def __init__(self, **kwargs):
+        super().__init__(**kwargs)
+        self.ts = 1
+        self.app.router.add_post('/method/{method}', self.handle)
+        self.app.router.add_get('/longpoll', self.handle_longpoll)
+
+    async def handle(self, request: web.Request) -> web.Response:
+        method = request.match_info['method']
+        data = await request.post()
+        if method == 'groups.getLongPollServer':
+            response = {'key': 'benchmark', 'server': f'{self.url}/longpoll', 'ts': str(self.ts)}
+            return web.json_response({'response': response})
+        self.calls[method] += 1
+        if method == 'users.get':
+            response = [
+                {'id': int(user_id), 'first_name': 'Тест', 'last_name': user_id}
+                for user_id in data.get('user_ids', '').split(',') if user_id
+            ]
+            return web.json_response({'response': response})
+        return web.json_response({'response': 1})
+
+    async def handle_longpoll(self, request: web.Request) -> web.Response:
+        updates = await self.take_updates(100)
+        self.ts += 1
+        return web.json_response({'ts': str(self.ts), 'updates': updates})
+
+
+def get_tg_user_updates(user_id: int, course_pk: int) -> List[dict]:
+    """Сценарий пользователя TG: меню, список курсов, карточка курса, запись, ввод телефона"""
+
+    chat = {'id': user_id, 'type': 'private', 'first_name': 'Тест', 'last_name': str(user_id), 'username': f'u{user_id}'}
+
+    def message(text: str) -> dict:
+        return {'message': {'message_id': 1, 'date': int(time.time()), 'chat': chat, 'text': text}}
+
+    def callback(data: str) -> dict:
+        return {
+            'callback_query': {
+                'id': str(user_id),
+                'data': data,
+                'from': {'id': user_id, 'is_bot': False, 'first_name': 'Тест'},
+                'message': {'message_id': 2, 'date': int(time.time()), 'chat': chat},
+            }
+        }
+
+    return [
+        message('/start'),
+        callback('start'),
+        callback('future_courses'),
+        callback(f'c:{course_pk}:future_courses'),
+        callback(f'en_{course_pk}_e'),
+        message(PHONE),
+    ]
+
+
+def get_vk_user_updates(user_id: int, course_pk: int, group_id: int = 1) -> List[dict]:
+    """Сценарий пользователя VK, повторяющий сценарий TG"""
+
+    def message(text: str, payload: dict = None) -> dict:
+        message_data = {
+            'id': random.randint(1, 10 ** 9),
+            'from_id': user_id,
+            'peer_id': user_id,
+            'date': int(time.time()),
+            'text': text,
+        }
+        if payload:
+            message_data['payload'] = json.dumps(payload)
+        return {
+            'type': 'message_new',
+            'v': '5.131',
+            'event_id': f'{user_id}_{message_data["id"]}',
+            'group_id': group_id,
+            'object': {'message': message_data, 'client_info': {}},
+        }
+
+    return [
+        message('start'),
+        message('☰ MENU', {'button': 'start'}),
+        message('Предстоящие курсы', {'button': 'future_courses'}),
+        message('Курс', {'course_pk': course_pk, 'button': 'future_courses'}),
+        message('ЗАПИСАТЬСЯ НА КУРС', {'entry': course_pk}),
+        message(PHONE),
+    ]
+
+
+def mix_traffic(users_updates: List[List[dict]]) -> List[dict]:
+    """
+    Поток событий волнами: на каждом шаге сценария пользователи идут в случайном порядке,
+    порядок событий одного пользователя сохраняется
+    """
+
+    traffic = []
+    for step_updates in zip(*users_updates):
+        step_updates = list(step_updates)
+        random.shuffle(step_updates)
+        traffic.extend(step_updates)
+    return traffic
+
+
+def get_percentiles(samples: List[float]) -> Dict[str, float]:
+    if not samples:
+        return {'p50': 0.0, 'p90': 0.0, 'p99': 0.0, 'max': 0.0}
+    ordered = sorted(samples)
+
+    def pick(percent):
+        return round(ordered[min(int(len(ordered) * percent), len(ordered) - 1)] * 1000, 3)
+
+    return {'p50': pick(0.5), 'p90': pick(0.9), 'p99': pick(0.99), 'max': round(ordered[-1] * 1000, 3)}
+
+
+class BotBenchmark:
+    """
+    Прогон синтетического трафика через LongPollServer и заглушку API.
+
+    Получение событий идет обычным get_events, обработка - диспетчером сервера.
+    Для каждого шага сценария считаются время обработчика, SQL-запросы
+    (через execute_wrappers соединений всех потоков) и исходящие вызовы API
+    """
+
+    def __init__(self, connect: LongPollServer, mock: MockServer, steps: tuple = TG_STEPS):
+        self.connect = connect
+        self.mock = mock
+        self.steps = steps
+        self.handled: Counter = Counter()
+        self.latencies: Dict[str, List[float]] = defaultdict(list)
+        self.queries: Counter[str] = Counter()
+        self.calls: Counter[str] = Counter()
+        self.duration = 0.0
+
+    def count_query(self, execute, sql, params, many, context):
+        step = current_step.get()
+        if step:
+            self.queries[step] += 1
+        return execute(sql, params, many, context)
+
+    def add_query_counter(self, connection, **kwargs) -> None:
+        instrumented_connections.add(connection)
+        if self.count_query not in connection.execute_wrappers:
+            connection.execute_wrappers.append(self.count_query)
+
+    def remove_query_counter(self) -> None:
+        connection_created.disconnect(self.add_query_counter)
+        QuerySetAsync._fetch_all = self.fetch_all
+        for connection in [*connections.all(), *instrumented_connections]:
+            if self.count_query in connection.execute_wrappers:
+                connection.execute_wrappers.remove(self.count_query)
+
+    def instrument(self) -> None:
+        api = self.connect.api
+        post = api.post
+
+        async def counted_post(*args, **kwargs):
+            step = current_step.get()
+            if step:
+                self.calls[step] += 1
+            return await post(*args, **kwargs)
+
+        api.post = counted_post
+        dispatch_event = self.connect.dispatcher.handler
+
+        async def timed_dispatch_event(event):
+            chat_id = self.connect.get_chat_id(event)
+            # события чата приходят по порядку, поэтому номер события определяет шаг сценария
+            step = self.steps[self.handled[chat_id] % len(self.steps)]
+            self.handled[chat_id] += 1
+            token = current_step.set(step)
+            started_at = time.perf_counter()
+            try:
+                await dispatch_event(event)
+            finally:
+                self.latencies[step].append(time.perf_counter() - started_at)
+                current_step.reset(token)
+
+        self.connect.dispatcher.handler = timed_dispatch_event
+        # ORM выполняет запросы в отдельных потоках со своими соединениями: счетчик ставится
+        # и на соединения, открытые в других потоках при прошлых прогонах, и на новые
+        self.fetch_all = QuerySetAsync.__dict__['_fetch_all']
+        QuerySetAsync._fetch_all = fetch_all_with_context
+        connection_created.connect(self.add_query_counter, weak=False)
+        for connection in [*connections.all(), *instrumented_connections]:
+            self.add_query_counter(connection)
+
+    async def run(self, traffic: List[dict]) -> Dict[str, Any]:
+        await self.mock.start()
+        self.mock.feed(traffic)
+        self.connect.api.api_url = self.mock.url
+        self.connect.api.session = await transport.acquire()
+        self.instrument()
+        started_at = time.perf_counter()
+        try:
+            while self.mock.updates:
+                for event in await self.connect.get_events():
+                    await self.connect.dispatcher.put(event)
+            await self.connect.dispatcher.stop(drain=True)
+            self.duration = time.perf_counter() - started_at
+        finally:
+            self.remove_query_counter()
+            await transport.release()
+            await self.mock.stop()
+        return self.report()
+
+    def report(self) -> Dict[str, Any]:
+        events = sum(len(latencies) for latencies in self.latencies.values())
+        dispatcher_stats = self.connect.dispatcher.stats()
+        return {
+            'platform': self.connect.api.platform,
+            'users': len(self.handled),
+            'events': events,
+            'failed': dispatcher_stats['failed'],
+            'duration_s': round(self.duration, 3),
+            'events_per_sec': round(events / self.duration, 1) if self.duration else 0.0,
+            'latency_ms': get_percentiles([value for values in self.latencies.values() for value in values]),
+            'queue_wait_ms': {key: round(value * 1000, 3) for key, value in dispatcher_stats['queue_wait'].items()},
+            'queries_per_event': round(sum(self.queries.values()) / events, 2) if events else 0.0,
+            'outbound_calls_per_event': round(sum(self.calls.values()) / events, 2) if events else 0.0,
+            'outbound_calls': dict(self.mock.calls),
+            'steps': {
+                step: {
+                    'events': len(self.latencies[step]),
+                    'latency_ms': get_percentiles(self.latencies[step]),
+                    'queries_per_event': round(self.queries[step] / len(self.latencies[step]), 2),
+                    'outbound_calls_per_event': round(self.calls[step] / len(self.latencies[step]), 2),
+                } for step in self.steps if self.latencies[step]
+            },
+            'rate_limiter': self.connect.api.rate_limiter.stats(),
+        }
@@ -0,0 +1,138 @@
+import json
+import socket
+
+import redis
+
+from typing import Dict, Iterable, List, Tuple
+
+COURSE_RESCHEDULED = 'course_rescheduled'
+TIMER_CHANGED = 'timer_changed'
+COURSE_DELETED = 'course_deleted'
+CLIENT_ENROLLED = 'client_enrolled'
+CLIENT_REMOVED = 'client_removed'
+
+PLATFORMS = ('tg', 'vk')
+
+
+def get_stream_name(platform: str) -> str:
+    return f'admin_events_{platform}'
+
+
+def get_remind_task_prefix(platform: str) -> str:
+    return f'remind_record_{platform}_'
+
+
+def get_remind_task_name(platform: str, user_id: int, course_pk: int, reminder_interval: int) -> str:
+    """Имя задачи напоминания в формате TgApi.create_key_task/VkApi.create_key_task"""
+    return f'{get_remind_task_prefix(platform)}{user_id}_{course_pk}_{reminder_interval}'
+
+
+def get_client_platform(client) -> Tuple[str, int] | None:
+    if client.vk_id:
+        return 'vk', client.vk_id
+    if client.telegram_id:
+        return 'tg', client.telegram_id
+
+
+def publish_admin_event(
+        redis_db: redis.Redis,
+        event_type: str,
+        course_pk: int,
+        client_pk: int = None,
+        task_names: Dict[str, List[str]] = None,
+        platforms: Iterable[str] = PLATFORMS,
+        maxlen: int = 10000,
+):
+    """
+    Добавление события админ-панели в поток каждой платформы.
+    task_names - задачи напоминаний по платформам, которые боты должны отменить
+    """
+
+    task_names = task_names or {}
+    for platform in platforms:
+        redis_db.xadd(
+            get_stream_name(platform),
+            {
+                'type': event_type,
+                'course_pk': course_pk,
+                'client_pk': client_pk or '',
+                'task_names': json.dumps(task_names.get(platform, [])),
+            },
+            maxlen=maxlen,
+            approximate=True
+        )
+
+
+class AdminEvent:
+    __slots__ = ('id', 'type', 'course_pk', 'client_pk', 'task_names')
+
+    def __init__(self, event_id: str, fields: Dict[bytes, bytes]):
+        self.id = event_id
+        self.type = fields[b'type'].decode('utf-8')
+        self.course_pk = int(fields[b'course_pk'])
+        self.client_pk = int(fields[b'client_pk']) if fields.get(b'client_pk') else None
+        self.task_names = json.loads(fields.get(b'task_names', b'[]'))
+
+    def __repr__(self):
+        return f'AdminEvent({self.type!r}, course_pk={self.course_pk}, client_pk={self.client_pk})'
+
+
+class AdminEventConsumer:
+    """
+    Чтение потока событий админ-панели через группу потребителей Redis Streams.
+    Смещение хранится в Redis, поэтому после перезапуска бот продолжает
+    с первого неподтвержденного события. Если событие прошлой пачки так и не
+    подтверждено (обработка завершилась ошибкой), неподтвержденные события
+    читаются заново.
+    """
+
+    def __init__(self, redis_db: redis.Redis, platform: str, group: str = 'bots', consumer: str = None):
+        self.redis_db = redis_db
+        self.stream = get_stream_name(platform)
+        self.group = group
+        self.consumer = consumer or socket.gethostname()
+        self.pending_checked = False
+        self.group_created = False
+        self.unacked = set()
+
+    def ensure_group(self):
+        if self.group_created:
+            return
+        try:
+            self.redis_db.xgroup_create(self.stream, self.group, id='0', mkstream=True)
+        except redis.ResponseError as err:
+            if 'BUSYGROUP' not in str(err):
+                raise
+        self.group_created = True
+
+    def read(self, count: int = 100) -> List[AdminEvent]:
+        """
+        Новые события потока. При первом вызове сначала возвращаются события,
+        полученные этим потребителем ранее, но не подтвержденные
+        """
+
+        self.ensure_group()
+        if self.unacked:
+            self.pending_checked = False
+            self.unacked.clear()
+        stream_id = '>' if self.pending_checked else '0'
+        response = self.redis_db.xreadgroup(self.group, self.consumer, {self.stream: stream_id}, count=count)
+        events, trimmed = [], []
+        for __, messages in response:
+            for event_id, fields in messages:
+                # события, вытесненные из потока по maxlen, приходят без полей
+                if fields:
+                    events.append(AdminEvent(event_id.decode('utf-8'), fields))
+                else:
+                    trimmed.append(event_id)
+        self.ack(trimmed)
+        if not events and not self.pending_checked:
+            self.pending_checked = True
+            return self.read(count)
+        self.unacked.update(event.id for event in events)
+        return events
+
+    def ack(self, event_ids: List[str]) -> None:
+        if event_ids:
+            self.redis_db.xack(self.stream, self.group, *event_ids)
+            self.unacked.difference_update(event_ids)
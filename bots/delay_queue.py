@@ -0,0 +1,339 @@
+import json
+import os
+import socket
+import time
+
+import redis
+
+from typing import Any, Dict, Iterator, List, Tuple
+from .scheduler import TaskScheduler, ScheduledJob
+
+
+class RedisDelayQueue:
+    """
+    Очередь отложенных задач в Redis.
+
+    {name}:due - sorted set: имя задачи -> время выполнения (unix timestamp);
+    {name}:processing - sorted set: имя задачи -> срок аренды обработчиком;
+    {name}:jobs - hash: имя задачи -> json с именем корутины и аргументами;
+    {name}:attempts - hash: имя задачи -> число попыток выполнения.
+
+    Забор задач (claim) атомарен, поэтому очередь могут разбирать
+    одновременно несколько процессов ботов без повторной отправки.
+    Незавершенные задачи с истекшей арендой возвращаются в очередь.
+    """
+
+    CLAIM_SCRIPT = '''
+        local names = redis.call('ZRANGEBYSCORE', KEYS[1], '-inf', ARGV[1], 'LIMIT', 0, ARGV[2])
+        local result = {}
+        for __, name in ipairs(names) do
+            redis.call('ZREM', KEYS[1], name)
+            local job = redis.call('HGET', KEYS[3], name)
+            if job then
+                redis.call('ZADD', KEYS[2], ARGV[3], name)
+                local attempts = redis.call('HINCRBY', KEYS[4], name, 1)
+                table.insert(result, name)
+                table.insert(result, job)
+                table.insert(result, attempts)
+            end
+        end
+        return result
+    '''
+    ACK_SCRIPT = '''
+        if redis.call('ZREM', KEYS[1], ARGV[1]) == 1 then
+            redis.call('HDEL', KEYS[2], ARGV[1])
+            redis.call('HDEL', KEYS[3], ARGV[1])
+            return 1
+        end
+        return 0
+    '''
+    REQUEUE_SCRIPT = '''
+        local names = redis.call('ZRANGEBYSCORE', KEYS[1], '-inf', ARGV[1])
+        for __, name in ipairs(names) do
+            redis.call('ZREM', KEYS[1], name)
+            redis.call('ZADD', KEYS[2], ARGV[1], name)
+        end
+        return #names
+    '''
+
+    def __init__(self, redis_db: redis.Redis, name: str, lease: int = 120):
+        self.redis_db = redis_db
+        self.name = name
+        self.lease = lease
+        self.due_key = f'{name}:due'
+        self.processing_key = f'{name}:processing'
+        self.jobs_key = f'{name}:jobs'
+        self.attempts_key = f'{name}:attempts'
+        self.seeded_key = f'{name}:seeded'
+        self._claim = redis_db.register_script(self.CLAIM_SCRIPT)
+        self._ack = redis_db.register_script(self.ACK_SCRIPT)
+        self._requeue = redis_db.register_script(self.REQUEUE_SCRIPT)
+
+    def add(self, task_name: str, due: float, coro: str, args: tuple, kwargs: dict, only_new: bool = False) -> bool:
+        """
+        Добавление задачи в очередь.
+        При only_new=True существующая задача с тем же именем не изменяется.
+        """
+
+        job = json.dumps({'coro': coro, 'args': list(args), 'kwargs': kwargs}, ensure_ascii=False)
+        if only_new:
+            if not self.redis_db.hsetnx(self.jobs_key, task_name, job):
+                return False
+            self.redis_db.zadd(self.due_key, {task_name: due})
+            return True
+        pipe = self.redis_db.pipeline()
+        pipe.hset(self.jobs_key, task_name, job)
+        pipe.hdel(self.attempts_key, task_name)
+        pipe.zrem(self.processing_key, task_name)
+        pipe.zadd(self.due_key, {task_name: due})
+        pipe.execute()
+        return True
+
+    def add_many(self, jobs: List[Tuple[str, float, str, tuple, dict]], chunk_size: int = 1000) -> int:
+        """Пакетное добавление задач: (task_name, due, coro, args, kwargs)"""
+
+        for start in range(0, len(jobs), chunk_size):
+            chunk = jobs[start:start + chunk_size]
+            pipe = self.redis_db.pipeline(transaction=False)
+            pipe.hset(self.jobs_key, mapping={
+                task_name: json.dumps({'coro': coro, 'args': list(args), 'kwargs': kwargs}, ensure_ascii=False)
+                for task_name, __, coro, args, kwargs in chunk
+            })
+            pipe.hdel(self.attempts_key, *[task_name for task_name, *__ in chunk])
+            pipe.zrem(self.processing_key, *[task_name for task_name, *__ in chunk])
+            pipe.zadd(self.due_key, {task_name: due for task_name, due, *__ in chunk})
+            pipe.execute()
+        return len(jobs)
+
+    def reschedule(self, task_name: str, due: float) -> bool:
+        return bool(self.redis_db.zadd(self.due_key, {task_name: due}, xx=True, ch=True))
+
+    def remove(self, task_name: str) -> bool:
+        pipe = self.redis_db.pipeline()
+        pipe.zrem(self.due_key, task_name)
+        pipe.zrem(self.processing_key, task_name)
+        pipe.hdel(self.jobs_key, task_name)
+        pipe.hdel(self.attempts_key, task_name)
+        return any(pipe.execute()[:3])
+
+    def remove_many(self, task_names: List[str], chunk_size: int = 1000) -> int:
+        for start in range(0, len(task_names), chunk_size):
+            chunk = task_names[start:start + chunk_size]
+            pipe = self.redis_db.pipeline(transaction=False)
+            pipe.zrem(self.due_key, *chunk)
+            pipe.zrem(self.processing_key, *chunk)
+            pipe.hdel(self.jobs_key, *chunk)
+            pipe.hdel(self.attempts_key, *chunk)
+            pipe.execute()
+        return len(task_names)
+
+    def claim(self, now: float, limit: int) -> List[Tuple[str, Dict[str, Any], int]]:
+        """Атомарно забирает в обработку задачи, срок которых наступил"""
+
+        result = self._claim(
+            keys=[self.due_key, self.processing_key, self.jobs_key, self.attempts_key],
+            args=[now, limit, now + self.lease]
+        )
+        return [
+            (name.decode('utf-8'), json.loads(job), int(attempts))
+            for name, job, attempts in zip(result[::3], result[1::3], result[2::3])
+        ]
+
+    def ack(self, task_name: str) -> bool:
+        """Подтверждение выполнения задачи, взятой в обработку"""
+
+        return bool(self._ack(keys=[self.processing_key, self.jobs_key, self.attempts_key], args=[task_name]))
+
+    def extend_lease(self, task_names: List[str]) -> None:
+        if not task_names:
+            return
+        deadline = time.time() + self.lease
+        self.redis_db.zadd(self.processing_key, {name: deadline for name in task_names}, xx=True)
+
+    def requeue_expired(self, now: float) -> int:
+        """Возвращает в очередь задачи, аренда которых истекла (обработчик упал или завис)"""
+
+        return self._requeue(keys=[self.processing_key, self.due_key], args=[now])
+
+    def next_due(self) -> float | None:
+        head = self.redis_db.zrange(self.due_key, 0, 0, withscores=True)
+        return head[0][1] if head else None
+
+    def get(self, task_name: str) -> Dict[str, Any] | None:
+        job = self.redis_db.hget(self.jobs_key, task_name)
+        return json.loads(job) if job else None
+
+    def score(self, task_name: str) -> float | None:
+        return self.redis_db.zscore(self.due_key, task_name)
+
+    def __contains__(self, task_name: str) -> bool:
+        return self.redis_db.hexists(self.jobs_key, task_name)
+
+    def __len__(self) -> int:
+        return self.redis_db.zcard(self.due_key)
+
+    def names(self) -> List[str]:
+        return [name.decode('utf-8') for name in self.redis_db.zrange(self.due_key, 0, -1)]
+
+    def task_names(self, prefix: str) -> List[str]:
+        """Имена ожидающих и выполняющихся задач, начинающиеся с prefix"""
+
+        return [name.decode('utf-8') for name, __ in self.redis_db.hscan_iter(self.jobs_key, match=f'{prefix}*')]
+
+    def processing_names(self) -> List[str]:
+        return [name.decode('utf-8') for name in self.redis_db.zrange(self.processing_key, 0, -1)]
+
+    def clear(self) -> None:
+        self.redis_db.delete(self.due_key, self.processing_key, self.jobs_key, self.attempts_key)
+
+    def mark_seeded(self, ttl: int) -> bool:
+        """
+        Отметка о заполнении очереди по данным базы, действует ttl секунд.
+        Возвращает True, если очередь нужно перестроить: отметки нет (первый запуск,
+        сброс Redis или переключение на реплику без нее) или срок отметки истек
+        """
+
+        if not self.redis_db.exists(self.jobs_key):
+            # задач в Redis нет - отметка, пережившая их, ничего не подтверждает
+            self.redis_db.delete(self.seeded_key)
+        return bool(self.redis_db.set(self.seeded_key, int(time.time()), nx=True, ex=ttl))
+
+    def stats(self) -> Dict[str, int]:
+        pipe = self.redis_db.pipeline()
+        pipe.zcard(self.due_key)
+        pipe.zcard(self.processing_key)
+        due, processing = pipe.execute()
+        return {'scheduled': due, 'processing': processing}
+
+
+class RedisTaskScheduler(TaskScheduler):
+    """
+    Планировщик sending_tasks, хранящий задачи в RedisDelayQueue.
+    Задачи переживают перезапуск ботов, а несколько процессов одной
+    платформы могут разбирать общую очередь.
+    """
+
+    durable = True
+
+    def __init__(
+            self,
+            dispatch,
+            redis_db: redis.Redis,
+            name: str,
+            loop=None,
+            batch_size: int = 100,
+            poll_interval: int = 5,
+            max_attempts: int = 3,
+            seed_ttl: int = 24 * 3600,
+    ):
+        super().__init__(dispatch, loop=loop, batch_size=batch_size, max_sleep=poll_interval)
+        self.queue = RedisDelayQueue(redis_db, name)
+        self.max_attempts = max_attempts
+        self.seed_ttl = seed_ttl
+        self.worker_name = f'{socket.gethostname()}:{os.getpid()}'
+
+    def __contains__(self, task_name: str) -> bool:
+        return task_name in self.queue or task_name in self._running
+
+    def __len__(self) -> int:
+        return len(self.queue)
+
+    def __iter__(self) -> Iterator[str]:
+        return iter(self.queue.names())
+
+    def get(self, task_name: str) -> ScheduledJob | None:
+        job = self.queue.get(task_name)
+        if not job:
+            return
+        return ScheduledJob(task_name, self.queue.score(task_name) or 0, job['coro'], job['args'], job['kwargs'], 0)
+
+    def add(self, task_name: str, timer: float, coro: str, /, *args, **kwargs) -> ScheduledJob:
+        self._cancel_running(task_name)
+        job = ScheduledJob(task_name, time.time() + max(timer, 0), coro, args, kwargs, 0)
+        self.queue.add(task_name, job.due, coro, args, kwargs)
+        self._ensure_started()
+        if job.due < self._sleep_until:
+            self._wakeup.set()
+        return job
+
+    def add_many(self, jobs: List[Tuple[str, float, str, tuple, dict]]) -> int:
+        if not jobs:
+            return 0
+        now = time.time()
+        self.queue.add_many([
+            (task_name, now + max(timer, 0), coro, args, kwargs)
+            for task_name, timer, coro, args, kwargs in jobs
+        ])
+        self._ensure_started()
+        self._wakeup.set()
+        return len(jobs)
+
+    def add_once(self, task_name: str, timer: float, coro: str, /, *args, **kwargs) -> bool:
+        """Добавляет задачу, только если задачи с таким именем еще нет в очереди"""
+
+        added = self.queue.add(task_name, time.time() + max(timer, 0), coro, args, kwargs, only_new=True)
+        if added:
+            self._ensure_started()
+            self._wakeup.set()
+        return added
+
+    def reschedule(self, task_name: str, timer: float) -> bool:
+        rescheduled = self.queue.reschedule(task_name, time.time() + max(timer, 0))
+        if rescheduled and self._wakeup:
+            self._wakeup.set()
+        return rescheduled
+
+    def cancel(self, task_name: str) -> bool:
+        removed = self.queue.remove(task_name)
+        running = self._cancel_running(task_name)
+        return removed or running
+
+    def replace(self, jobs: List[Tuple[str, float, str, tuple, dict]], prefix: str) -> int:
+        names = {task_name for task_name, *__ in jobs}
+        # задачи, которые сейчас выполняет другой процесс, не удаляются и не перезапускаются:
+        # после выполнения их удалит ack
+        processing = set(self.queue.processing_names())
+        self.queue.remove_many([
+            task_name for task_name in self.queue.task_names(prefix)
+            if task_name not in names and task_name not in processing
+        ])
+        return self.add_many([job for job in jobs if job[0] not in processing])
+
+    def clear(self) -> None:
+        self.queue.clear()
+        for task_name in list(self._running):
+            self._cancel_running(task_name)
+
+    def next_due(self) -> float | None:
+        return self.queue.next_due()
+
+    def pop_due(self, now: float = None) -> List[ScheduledJob]:
+        now = now or time.time()
+        due_jobs = []
+        for task_name, job, attempts in self.queue.claim(now, self.batch_size):
+            if attempts > self.max_attempts:
+                self.queue.ack(task_name)
+                continue
+            # в seq для задач из Redis хранится номер попытки выполнения
+            due_jobs.append(ScheduledJob(task_name, now, job['coro'], tuple(job['args']), job['kwargs'], attempts))
+        return due_jobs
+
+    def _on_done(self, job: ScheduledJob, success: bool) -> None:
+        # При ошибке задача остается в обработке и вернется в очередь после истечения аренды
+        if success or job.seq >= self.max_attempts:
+            self.queue.ack(job.name)
+
+    def _tick(self) -> None:
+        self.queue.extend_lease(list(self._running))
+        self.queue.requeue_expired(time.time())
+
+    def should_rebuild(self) -> bool:
+        # Задачи уже лежат в Redis - перестраивать их нужно, только если данные очереди
+        # потеряны или не сверялись с базой дольше seed_ttl
+        return self.queue.mark_seeded(self.seed_ttl)
+
+    def items(self) -> List[Tuple[str, ScheduledJob]]:
+        return [(task_name, self.get(task_name)) for task_name in self.queue.names()]
+
+    def stats(self) -> Dict[str, Any]:
+        return {**self.queue.stats(), 'running': len(self._running), 'worker': self.worker_name}
@@ -0,0 +1,131 @@
+import asyncio
+import logging
+import time
+
+from collections import deque
+from typing import Any, Awaitable, Callable, Deque, Dict, Hashable, Tuple
+
+logger = logging.getLogger('telegram')
+
+
+class EventDispatcher:
+    """
+    Диспетчер событий бота.
+
+    События раскладываются по FIFO-очередям чатов (ключ - get_key(event)),
+    очереди разбирает ограниченный пул обработчиков. События одного чата
+    обрабатываются строго по очереди, разные чаты - параллельно.
+    При max_pending необработанных событий put ожидает освобождения места,
+    поэтому получение новых событий от сервера притормаживает.
+    """
+
+    def __init__(
+            self,
+            handler: Callable[[Any], Awaitable[None]],
+            get_key: Callable[[Any], Hashable],
+            workers: int = 16,
+            max_pending: int = 1000,
+            loop: asyncio.AbstractEventLoop = None,
+            latency_samples: int = 1000,
+    ):
+        self.handler = handler
+        self.get_key = get_key
+        self.workers = workers
+        self.max_pending = max_pending
+        self.loop = loop
+        self._queues: Dict[Hashable, Deque[Tuple[Any, float]]] = {}
+        self._ready: asyncio.Queue | None = None
+        self._slots: asyncio.Semaphore | None = None
+        self._workers: list[asyncio.Task] = []
+        self._pending = 0
+        self._processed = 0
+        self._failed = 0
+        self._waited = 0
+        self._wait_times: Deque[float] = deque(maxlen=latency_samples)
+        self._handle_times: Deque[float] = deque(maxlen=latency_samples)
+
+    def start(self) -> None:
+        if self._workers:
+            return
+        self._ready = asyncio.Queue()
+        self._slots = asyncio.Semaphore(self.max_pending)
+        self._workers = [
+            asyncio.ensure_future(self._worker(), loop=self.loop)
+            for __ in range(self.workers)
+        ]
+
+    async def stop(self, drain: bool = True) -> None:
+        """Остановка обработчиков. При drain=True сначала дожидается обработки принятых событий"""
+
+        if drain:
+            while self._pending:
+                await asyncio.sleep(0.1)
+        for worker in self._workers:
+            worker.cancel()
+        await asyncio.gather(*self._workers, return_exceptions=True)
+        self._workers = []
+
+    async def put(self, event) -> None:
+        """Постановка события в очередь его чата"""
+
+        self.start()
+        if self._slots.locked():
+            self._waited += 1
+        await self._slots.acquire()
+        self._pending += 1
+        key = self.get_key(event)
+        queue = self._queues.get(key)
+        if queue is None:
+            # чат не обрабатывается и не ждет обработчика - отдаем его пулу
+            queue = self._queues[key] = deque()
+            self._ready.put_nowait(key)
+        queue.append((event, time.monotonic()))
+
+    async def _worker(self) -> None:
+        while True:
+            key = await self._ready.get()
+            queue = self._queues[key]
+            event, enqueued_at = queue.popleft()
+            started_at = time.monotonic()
+            self._wait_times.append(started_at - enqueued_at)
+            try:
+                await self.handler(event)
+            except asyncio.CancelledError:
+                raise
+            except Exception as exc:
+                self._failed += 1
+                logger.exception(exc)
+            finally:
+                self._handle_times.append(time.monotonic() - started_at)
+                self._processed += 1
+                self._pending -= 1
+                self._slots.release()
+                # следующее событие чата встает в конец общей очереди, чтобы не задерживать другие чаты
+                if queue:
+                    self._ready.put_nowait(key)
+                else:
+                    del self._queues[key]
+
+    @staticmethod
+    def _percentiles(samples: Deque[float]) -> Dict[str, float]:
+        if not samples:
+            return {'p50': 0.0, 'p99': 0.0, 'max': 0.0}
+        ordered = sorted(samples)
+        return {
+            'p50': ordered[len(ordered) // 2],
+            'p99': ordered[min(int(len(ordered) * 0.99), len(ordered) - 1)],
+            'max': ordered[-1],
+        }
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            'pending': self._pending,
+            'chats': len(self._queues),
+            'max_chat_depth': max(map(len, self._queues.values()), default=0),
+            'ready': self._ready.qsize() if self._ready else 0,
+            'processed': self._processed,
+            'failed': self._failed,
+            'backpressure_waits': self._waited,
+            'queue_wait': self._percentiles(self._wait_times),
+            'handle_time': self._percentiles(self._handle_times),
+        }
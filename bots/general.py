@@ -1,10 +1,11 @@
-import aiohttp
 import asyncio
 import logging
 
 from aiohttp import client_exceptions
 from abc import ABC, abstractmethod
-from typing import Callable, Awaitable
+from typing import Callable, Awaitable, Hashable
+from .dispatcher import EventDispatcher
+from .transport import transport
 from .vk_bot import VkApi, vk_types
 from .tg_bot import TgApi, tg_types
 
@@ -18,11 +19,20 @@ class LongPollServer(ABC):
             self,
             api: TgApi | VkApi,
             handle_event: Callable[[VkApi | TgApi, vk_types.Message | tg_types.Update], Awaitable[None]],
+            workers: int = 16,
+            max_pending: int = 1000,
     ):
         self.api = api
         self.handle_event = handle_event
         self.first_connect = True
         self.start = True
+        self.dispatcher = EventDispatcher(
+            self.dispatch_event,
+            self.get_chat_id,
+            workers=workers,
+            max_pending=max_pending,
+            loop=api.loop,
+        )
 
     async def init_tasks(self):
         pass
@@ -31,18 +41,26 @@ class LongPollServer(ABC):
         pass
 
     @abstractmethod
-    async def get_event(self) -> Awaitable[tg_types.Update | vk_types.NewMessageUpdate | None]:
+    async def get_events(self) -> Awaitable[list[tg_types.Update | vk_types.Message]]:
+        """Все события, полученные за один запрос к серверу"""
         pass
 
+    @abstractmethod
+    def get_chat_id(self, event: tg_types.Update | vk_types.Message) -> Hashable:
+        """Ключ чата события: события одного чата обрабатываются последовательно"""
+        pass
+
+    async def dispatch_event(self, event: tg_types.Update | vk_types.Message) -> Awaitable[None]:
+        await self.handle_event(self.api, event)
+
     async def listen_server(self) -> Awaitable[None]:
         async with AsyncSession(self):
             while True:
                 async with UpdateEvent(self):
-                    event = await self.get_event()
+                    events = await self.get_events()
                     await self.update_tasks()
-                    if not event:
-                        continue
-                    asyncio.ensure_future(self.handle_event(self.api, event), loop=self.api.loop)
+                    for event in events:
+                        await self.dispatcher.put(event)
 
 
 class UpdateEvent:
@@ -81,11 +99,14 @@ class AsyncSession:
         self.instance = instance
 
     async def __aenter__(self):
-        self.instance.api.session = aiohttp.ClientSession()
-        # Обновляем список отложенных задач по отправке оповещений
-        await self.instance.api.update_message_sending_tasks()
+        self.instance.api.session = await transport.acquire()
+        # Восстанавливаем список отложенных задач по отправке оповещений
+        await self.instance.api.restore_sending_tasks()
         await self.instance.init_tasks()
         return self
 
     async def __aexit__(self, exc_type, exc_val, exc_tb):
-        await self.instance.api.session.close()
+        try:
+            await self.instance.api.flush_user_states()
+        finally:
+            await transport.release()
@@ -0,0 +1,32 @@
+from collections import OrderedDict
+from typing import Callable, Hashable
+from courses.general_functions import get_page_data_generation
+
+
+class KeyboardCache:
+    """
+    Готовые JSON клавиатур в памяти процесса.
+    Ключ клавиатуры со списком курсов включает версию списка курсов (get_courses_version),
+    поэтому после изменения курсов в админ-панели старые записи просто перестают использоваться
+    и вытесняются как самые давние
+    """
+
+    def __init__(self, maxsize: int = 1024):
+        self.maxsize = maxsize
+        self._keyboards: OrderedDict[Hashable, str] = OrderedDict()
+
+    def get_or_build(self, key: Hashable, build: Callable[[], str]) -> str:
+        keyboard = self._keyboards.get(key)
+        if keyboard is None:
+            keyboard = self._keyboards[key] = build()
+            if len(self._keyboards) > self.maxsize:
+                self._keyboards.popitem(last=False)
+        else:
+            self._keyboards.move_to_end(key)
+        return keyboard
+
+
+def get_courses_version() -> int:
+    """Версия списка курсов: поколение данных страниц all_courses, которое сбрасывается при изменении курсов"""
+
+    return get_page_data_generation('all_courses')
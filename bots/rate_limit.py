@@ -0,0 +1,137 @@
+import asyncio
+import time
+
+from collections import OrderedDict, deque
+from typing import Any, Dict, Hashable
+
+
+class RetryAfter(Exception):
+    """
+    Сервер API ограничил частоту запросов.
+    scope: 'chat' - ограничение для одного чата, 'global' - для всего бота
+    """
+
+    def __init__(self, retry_after: float, scope: str = 'global', description: str = ''):
+        super().__init__(f'Retry after {retry_after}s ({scope}): {description}')
+        self.retry_after = retry_after
+        self.scope = scope
+
+
+class TokenBucket:
+    """
+    Маркерная корзина: rate запросов в секунду с запасом capacity.
+    Ожидающие получают маркеры в порядке очереди.
+    """
+
+    def __init__(self, rate: float, capacity: float = None):
+        self.rate = rate
+        self.capacity = capacity or rate
+        self.tokens = self.capacity
+        self.updated = time.monotonic()
+        self.paused_until = 0.0
+        self._lock = asyncio.Lock()
+
+    def _refill(self, now: float) -> None:
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    async def acquire(self) -> float:
+        """Ожидание маркера. Возвращает время ожидания в секундах"""
+
+        started_at = time.monotonic()
+        async with self._lock:
+            while True:
+                now = time.monotonic()
+                self._refill(now)
+                wait = self.paused_until - now
+                if wait <= 0 and self.tokens >= 1:
+                    self.tokens -= 1
+                    return now - started_at
+                await asyncio.sleep(wait if wait > 0 else (1 - self.tokens) / self.rate)
+
+    def pause(self, seconds: float) -> None:
+        """Приостановка выдачи маркеров, например по retry_after от сервера"""
+
+        self.paused_until = max(self.paused_until, time.monotonic() + seconds)
+        self.tokens = 0
+
+    @property
+    def idle(self) -> bool:
+        return not self._lock.locked() and self.paused_until <= time.monotonic()
+
+
+class RateLimiter:
+    """
+    Ограничение частоты исходящих запросов к API мессенджера:
+    общая корзина бота и отдельные корзины чатов (если задан chat_rate).
+    Корзины чатов хранятся для max_chats последних чатов.
+    """
+
+    def __init__(
+            self,
+            rate: float,
+            capacity: float = None,
+            chat_rate: float = None,
+            chat_capacity: float = None,
+            max_chats: int = 10000,
+            window: int = 60,
+    ):
+        self.bucket = TokenBucket(rate, capacity)
+        self.chat_rate = chat_rate
+        self.chat_capacity = chat_capacity
+        self.max_chats = max_chats
+        self.window = window
+        self.chat_buckets: OrderedDict[Hashable, TokenBucket] = OrderedDict()
+        self.sent = 0
+        self.throttled = 0
+        self.retries = 0
+        self.failed = 0
+        self.wait_time = 0.0
+        self._sent_at: deque[float] = deque()
+
+    def get_chat_bucket(self, chat_id: Hashable) -> TokenBucket:
+        bucket = self.chat_buckets.get(chat_id)
+        if bucket is None:
+            bucket = self.chat_buckets[chat_id] = TokenBucket(self.chat_rate, self.chat_capacity)
+            if len(self.chat_buckets) > self.max_chats:
+                for old_chat_id, old_bucket in list(self.chat_buckets.items())[:len(self.chat_buckets) - self.max_chats]:
+                    if old_bucket.idle:
+                        del self.chat_buckets[old_chat_id]
+        else:
+            self.chat_buckets.move_to_end(chat_id)
+        return bucket
+
+    async def acquire(self, chat_id: Hashable = None) -> None:
+        waited = 0.0
+        if chat_id is not None and self.chat_rate:
+            waited += await self.get_chat_bucket(chat_id).acquire()
+        waited += await self.bucket.acquire()
+        if waited > 0.001:
+            self.throttled += 1
+            self.wait_time += waited
+        now = time.monotonic()
+        self.sent += 1
+        self._sent_at.append(now)
+        while self._sent_at and self._sent_at[0] < now - self.window:
+            self._sent_at.popleft()
+
+    def pause(self, seconds: float, chat_id: Hashable = None) -> None:
+        """Пауза для чата, если передан chat_id, иначе для всего бота"""
+
+        if chat_id is None:
+            self.bucket.pause(seconds)
+        elif self.chat_rate:
+            self.get_chat_bucket(chat_id).pause(seconds)
+
+    def stats(self) -> Dict[str, Any]:
+        now = time.monotonic()
+        recent = sum(1 for sent_at in self._sent_at if sent_at >= now - self.window)
+        return {
+            'sent': self.sent,
+            'throttled': self.throttled,
+            'retries': self.retries,
+            'failed': self.failed,
+            'wait_time': round(self.wait_time, 3),
+            'rate': round(recent / self.window, 2),
+            'chats': len(self.chat_buckets),
+        }
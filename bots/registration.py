@@ -0,0 +1,98 @@
+import asyncio
+import logging
+
+from asgiref.sync import sync_to_async
+from django.db import transaction
+from typing import Any, Dict, List, Tuple
+from courses.models import Client, Task
+from .state_store import UserStateStore
+
+logger = logging.getLogger('telegram')
+
+
+class RegistrationBuffer:
+    """
+    Отложенная запись новых пользователей бота.
+
+    Для нового пользователя обработчик сразу получает несохраненный объект Client,
+    а записи Client и задачи Task его приветственной рассылки накапливаются
+    и пишутся в базу пачкой bulk_create(ignore_conflicts=True).
+    Повторы отсекаются уникальными ограничениями на telegram_id/vk_id и Task.task_name.
+    Буфер сбрасывается по размеру, периодически из update_tasks, перед обработкой
+    следующего события пользователя, запись которого еще не сохранена,
+    и когда обработчику нужна запись Client такого пользователя (get)
+    """
+
+    def __init__(self, user_id_field: str, user_states: UserStateStore, max_size: int = 500):
+        self.user_id_field = user_id_field
+        self.user_states = user_states
+        self.max_size = max_size
+        self.clients: Dict[int, Client] = {}
+        self.tasks: List[Task] = []
+        self._flushing: Dict[int, Client] = {}
+        self._lock = asyncio.Lock()
+
+    def __contains__(self, user_id: int) -> bool:
+        return user_id in self.clients or user_id in self._flushing
+
+    async def get_or_create(self, user_id: int, defaults: Dict[str, Any]) -> Tuple[Client, bool]:
+        client = self.clients.get(user_id) or self._flushing.get(user_id)
+        if client:
+            return client, False
+        client = await Client.objects.filter(**{self.user_id_field: user_id}).afirst()
+        if client:
+            return client, False
+        client = self.clients[user_id] = Client(**{self.user_id_field: user_id}, **defaults)
+        if len(self.clients) >= self.max_size:
+            await self.flush()
+        return client, True
+
+    async def get(self, user_id: int) -> Client:
+        """Сохраненная запись Client пользователя. Если пользователь еще в буфере, буфер сначала сбрасывается"""
+
+        if user_id in self:
+            await self.flush()
+        return await Client.objects.filter(**{self.user_id_field: user_id}).aget()
+
+    def add_task(self, task: Task) -> None:
+        self.tasks.append(task)
+
+    async def flush(self) -> int:
+        """
+        Запись накопленных пользователей и задач. Возвращает число записанных пользователей.
+        При ошибке записи пользователи и задачи возвращаются в буфер и пишутся при следующем сбросе:
+        повторная запись безопасна благодаря ignore_conflicts
+        """
+
+        async with self._lock:
+            if not self.clients and not self.tasks:
+                return 0
+            self._flushing, self.clients = self.clients, {}
+            tasks, self.tasks = self.tasks, []
+            try:
+                await sync_to_async(self.write)(self._flushing, tasks)
+            except Exception as err:
+                self.clients = {**self._flushing, **self.clients}
+                self.tasks = tasks + self.tasks
+                logger.error(f'Новые пользователи ({len(self.clients)}) не записаны, повтор при следующем сбросе: {err}')
+                return 0
+            finally:
+                flushed, self._flushing = len(self._flushing), {}
+            return flushed
+
+    def write(self, clients: Dict[int, Client], tasks: List[Task]) -> None:
+        # состояние диалога могло измениться, пока запись ждала в буфере
+        for user_id, bot_state in self.user_states.get_bot_states(clients).items():
+            clients[user_id].bot_state = bot_state
+        with transaction.atomic():
+            Client.objects.bulk_create(clients.values(), ignore_conflicts=True)
+            Task.objects.bulk_create(tasks, ignore_conflicts=True)
+        client_pks = dict(
+            Client.objects
+            .filter(**{f'{self.user_id_field}__in': list(clients)})
+            .values_list(self.user_id_field, 'pk')
+        )
+        for user_id, client_pk in client_pks.items():
+            clients[user_id].pk = client_pk
+            clients[user_id]._state.adding = False
+        self.user_states.set_client_pks(client_pks)
@@ -0,0 +1,251 @@
+import asyncio
+import heapq
+import itertools
+import logging
+import time
+
+from typing import Any, Awaitable, Callable, Dict, Iterator, List, Tuple
+
+logger = logging.getLogger('telegram')
+
+
+class ScheduledJob:
+    """
+    Отложенная задача планировщика.
+    Хранит только данные для вызова: имя корутины API и её аргументы,
+    поэтому ожидающая задача не держит в памяти корутину.
+    """
+
+    __slots__ = ('name', 'due', 'coro', 'args', 'kwargs', 'seq')
+
+    def __init__(self, name: str, due: float, coro: str, args: tuple, kwargs: dict, seq: int):
+        self.name = name
+        self.due = due
+        self.coro = coro
+        self.args = args
+        self.kwargs = kwargs
+        self.seq = seq
+
+    def __repr__(self):
+        return f'ScheduledJob({self.name!r}, due={self.due:.0f}, coro={self.coro!r})'
+
+
+class TaskScheduler:
+    """
+    Планировщик отложенных задач на основе кучи сроков выполнения.
+
+    Вместо отдельной спящей asyncio.Task на каждое напоминание держит одну
+    фоновую корутину, которая просыпается к ближайшему сроку и запускает
+    пачку наступивших задач через dispatch.
+    Задачи адресуются по имени: add/cancel/reschedule.
+    """
+
+    durable = False
+
+    def __init__(
+            self,
+            dispatch: Callable[[ScheduledJob], Awaitable[None]],
+            loop: asyncio.AbstractEventLoop = None,
+            batch_size: int = 100,
+            max_sleep: int = 3600,
+    ):
+        self.dispatch = dispatch
+        self.loop = loop
+        self.batch_size = batch_size
+        self.max_sleep = max_sleep
+        self._heap: List[Tuple[float, int, str]] = []
+        self._jobs: Dict[str, ScheduledJob] = {}
+        self._running: Dict[str, asyncio.Task] = {}
+        self._counter = itertools.count()
+        self._wakeup: asyncio.Event | None = None
+        self._runner: asyncio.Task | None = None
+        self._sleep_until = 0.0
+
+    def __contains__(self, task_name: str) -> bool:
+        return task_name in self._jobs or task_name in self._running
+
+    def __len__(self) -> int:
+        return len(self._jobs)
+
+    def __iter__(self) -> Iterator[str]:
+        return iter(list(self._jobs))
+
+    def get(self, task_name: str) -> ScheduledJob | None:
+        return self._jobs.get(task_name)
+
+    def add(self, task_name: str, timer: float, coro: str, /, *args, **kwargs) -> ScheduledJob:
+        """
+        Добавляет задачу, которая выполнится через timer секунд.
+        Задача с тем же именем заменяется.
+        """
+
+        self._cancel_running(task_name)
+        job = ScheduledJob(task_name, time.time() + max(timer, 0), coro, args, kwargs, next(self._counter))
+        self._jobs[task_name] = job
+        heapq.heappush(self._heap, (job.due, job.seq, task_name))
+        if len(self._heap) > 2 * len(self._jobs) + 1000:
+            self._compact()
+        self._ensure_started()
+        if job.due < self._sleep_until:
+            self._wakeup.set()
+        return job
+
+    def add_many(self, jobs: List[Tuple[str, float, str, tuple, dict]]) -> int:
+        """Пакетное добавление задач: (task_name, timer, coro, args, kwargs)"""
+
+        for task_name, timer, coro, args, kwargs in jobs:
+            self.add(task_name, timer, coro, *args, **kwargs)
+        return len(jobs)
+
+    def add_once(self, task_name: str, timer: float, coro: str, /, *args, **kwargs) -> bool:
+        """Добавляет задачу, только если задачи с таким именем еще нет"""
+
+        if task_name in self:
+            return False
+        self.add(task_name, timer, coro, *args, **kwargs)
+        return True
+
+    def reschedule(self, task_name: str, timer: float) -> bool:
+        """Переносит существующую задачу на timer секунд от текущего момента"""
+
+        job = self._jobs.get(task_name)
+        if not job:
+            return False
+        self.add(task_name, timer, job.coro, *job.args, **job.kwargs)
+        return True
+
+    def cancel(self, task_name: str) -> bool:
+        """Отменяет ожидающую или уже выполняющуюся задачу"""
+
+        job = self._jobs.pop(task_name, None)
+        running = self._cancel_running(task_name)
+        return bool(job) or running
+
+    def clear(self) -> None:
+        self._jobs.clear()
+        self._heap.clear()
+        for task_name in list(self._running):
+            self._cancel_running(task_name)
+
+    def replace(self, jobs: List[Tuple[str, float, str, tuple, dict]], prefix: str) -> int:
+        """
+        Замена задач, имена которых начинаются с prefix, пачкой jobs.
+        Задачи с теми же именами обновляются, отсутствующие в jobs отменяются,
+        задачи с другими именами не затрагиваются
+        """
+
+        names = {task_name for task_name, *__ in jobs}
+        for task_name in list(self._jobs):
+            if task_name.startswith(prefix) and task_name not in names:
+                self.cancel(task_name)
+        return self.add_many(jobs)
+
+    def should_rebuild(self) -> bool:
+        """Нужно ли при запуске заново строить задачи по данным базы данных"""
+        return True
+
+    def next_due(self) -> float | None:
+        """Время ближайшей задачи (unix timestamp)"""
+
+        self._drop_stale_head()
+        return self._heap[0][0] if self._heap else None
+
+    def pop_due(self, now: float = None) -> List[ScheduledJob]:
+        """Извлекает из кучи пачку задач, срок которых наступил"""
+
+        now = now or time.time()
+        due_jobs = []
+        while self._heap and len(due_jobs) < self.batch_size:
+            due, seq, task_name = self._heap[0]
+            if due > now:
+                break
+            heapq.heappop(self._heap)
+            job = self._jobs.get(task_name)
+            if not job or job.seq != seq:
+                continue
+            del self._jobs[task_name]
+            due_jobs.append(job)
+        return due_jobs
+
+    def _drop_stale_head(self) -> None:
+        """Ленивое удаление отмененных и замененных записей с вершины кучи"""
+
+        while self._heap:
+            __, seq, task_name = self._heap[0]
+            job = self._jobs.get(task_name)
+            if job and job.seq == seq:
+                return
+            heapq.heappop(self._heap)
+
+    def _compact(self) -> None:
+        """Пересборка кучи без устаревших записей"""
+
+        self._heap = [(job.due, job.seq, task_name) for task_name, job in self._jobs.items()]
+        heapq.heapify(self._heap)
+
+    def _cancel_running(self, task_name: str) -> bool:
+        task = self._running.pop(task_name, None)
+        if task and not task.done():
+            task.cancel()
+            return True
+        return False
+
+    def _ensure_started(self) -> None:
+        if self._runner and not self._runner.done():
+            return
+        if self._wakeup is None:
+            self._wakeup = asyncio.Event()
+        self._runner = asyncio.ensure_future(self._run(), loop=self.loop)
+
+    def _fire(self, job: ScheduledJob) -> None:
+        task = asyncio.ensure_future(self._execute(job), loop=self.loop)
+        self._running[job.name] = task
+
+        def forget(finished: asyncio.Task, task_name: str = job.name) -> None:
+            if self._running.get(task_name) is finished:
+                del self._running[task_name]
+        task.add_done_callback(forget)
+
+    async def _execute(self, job: ScheduledJob) -> None:
+        try:
+            await self.dispatch(job)
+        except asyncio.CancelledError:
+            raise
+        except Exception as exc:
+            logger.exception(exc)
+            self._on_done(job, success=False)
+        else:
+            self._on_done(job, success=True)
+
+    def _on_done(self, job: ScheduledJob, success: bool) -> None:
+        """Вызывается после выполнения задачи"""
+        pass
+
+    def _tick(self) -> None:
+        """Вызывается на каждой итерации фонового цикла"""
+        pass
+
+    async def _run(self) -> None:
+        while True:
+            self._wakeup.clear()
+            self._tick()
+            due_jobs = self.pop_due()
+            for job in due_jobs:
+                self._fire(job)
+            if len(due_jobs) == self.batch_size:
+                await asyncio.sleep(0)
+                continue
+            next_due = self.next_due()
+            timeout = self.max_sleep if next_due is None else min(max(next_due - time.time(), 0), self.max_sleep)
+            self._sleep_until = time.time() + timeout
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), timeout)
+            except asyncio.TimeoutError:
+                pass
+            self._sleep_until = 0.0
+
+    def items(self) -> List[Tuple[str, ScheduledJob]]:
+        return list(self._jobs.items())
+
+    def stats(self) -> Dict[str, Any]:
+        return {'scheduled': len(self._jobs), 'running': len(self._running), 'heap_size': len(self._heap)}
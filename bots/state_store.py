@@ -0,0 +1,118 @@
+import redis
+
+from collections import defaultdict
+from typing import Dict, Iterable
+from courses.models import Client
+
+
+class UserStateStore:
+    """
+    Состояние диалога пользователя бота в хэше Redis.
+
+    Поля: client_pk - запись Client, bot_state - шаг стейт-машины,
+    current_course - курс, на который пользователь записывается,
+    phone - номер, введенный при записи.
+    Обработчик события читает состояние одним HGETALL вместо запроса к Client.
+    Новое значение bot_state переносится в Client отложенно (flush) одним UPDATE
+    на каждое состояние, а не сохранением записи после каждого сообщения.
+    """
+
+    def __init__(self, redis_db: redis.Redis, platform: str, ttl: int = 30 * 24 * 3600):
+        self.redis_db = redis_db
+        self.platform = platform
+        self.ttl = ttl
+        self.dirty_key = f'user_state_{platform}_dirty'
+
+    def get_key(self, user_id: int) -> str:
+        return f'user_state_{self.platform}_{user_id}'
+
+    def get(self, user_id: int) -> Dict[str, str]:
+        return {
+            field.decode('utf-8'): value.decode('utf-8')
+            for field, value in self.redis_db.hgetall(self.get_key(user_id)).items()
+        }
+
+    def get_field(self, user_id: int, field: str) -> str | None:
+        value = self.redis_db.hget(self.get_key(user_id), field)
+        return value.decode('utf-8') if value is not None else None
+
+    def update(self, user_id: int, **fields) -> None:
+        """Запись полей состояния. Поля со значением None удаляются"""
+
+        key = self.get_key(user_id)
+        mapping = {field: value for field, value in fields.items() if value is not None}
+        removed = [field for field, value in fields.items() if value is None]
+        pipe = self.redis_db.pipeline()
+        if mapping:
+            pipe.hset(key, mapping=mapping)
+        if removed:
+            pipe.hdel(key, *removed)
+        pipe.expire(key, self.ttl)
+        if 'bot_state' in mapping:
+            pipe.sadd(self.dirty_key, user_id)
+        pipe.execute()
+
+    def delete(self, user_id: int) -> None:
+        self.redis_db.delete(self.get_key(user_id))
+        self.redis_db.srem(self.dirty_key, user_id)
+
+    def load(self, user_id: int, client: Client) -> Dict[str, str]:
+        """Заполнение состояния из записи Client, если его нет в Redis"""
+
+        state = {'bot_state': client.bot_state}
+        if client.pk:
+            # у нового пользователя из буфера регистрации pk появится после записи в базу
+            state['client_pk'] = str(client.pk)
+        key = self.get_key(user_id)
+        pipe = self.redis_db.pipeline()
+        pipe.hset(key, mapping=state)
+        pipe.expire(key, self.ttl)
+        pipe.execute()
+        return state
+
+    def get_bot_states(self, user_ids: Iterable[int]) -> Dict[int, str]:
+        user_ids = list(user_ids)
+        pipe = self.redis_db.pipeline()
+        for user_id in user_ids:
+            pipe.hget(self.get_key(user_id), 'bot_state')
+        return {
+            user_id: bot_state.decode('utf-8')
+            for user_id, bot_state in zip(user_ids, pipe.execute()) if bot_state
+        }
+
+    def set_client_pks(self, client_pks: Dict[int, int]) -> None:
+        """Привязка состояний к записям Client, созданным буфером регистрации"""
+
+        pipe = self.redis_db.pipeline()
+        for user_id, client_pk in client_pks.items():
+            pipe.hset(self.get_key(user_id), 'client_pk', client_pk)
+        pipe.execute()
+
+    def flush(self, batch_size: int = 1000) -> int:
+        """
+        Перенос изменившихся bot_state в Client.
+        Идентификаторы забираются из множества SPOP, поэтому несколько процессов
+        бота не пишут одно изменение дважды. Возвращает число обновленных клиентов
+        """
+
+        updated = 0
+        # пользователи, чьи записи Client еще в буфере регистрации, остаются в множестве до следующего раза
+        unregistered = []
+        while True:
+            user_ids = self.redis_db.spop(self.dirty_key, batch_size)
+            if not user_ids:
+                break
+            pipe = self.redis_db.pipeline()
+            for user_id in user_ids:
+                pipe.hmget(self.get_key(user_id.decode('utf-8')), 'client_pk', 'bot_state')
+            client_pks_by_state = defaultdict(list)
+            for user_id, (client_pk, bot_state) in zip(user_ids, pipe.execute()):
+                if client_pk and bot_state:
+                    client_pks_by_state[bot_state.decode('utf-8')].append(int(client_pk))
+                elif bot_state:
+                    unregistered.append(user_id)
+            for bot_state, client_pks in client_pks_by_state.items():
+                updated += Client.objects.filter(pk__in=client_pks).update(bot_state=bot_state)
+        if unregistered:
+            self.redis_db.sadd(self.dirty_key, *unregistered)
+        return updated
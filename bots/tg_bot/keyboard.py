@@ -1,7 +1,11 @@
 import json
+
+from functools import lru_cache
 from courses.models import CourseClient
-from asgiref.sync import sync_to_async
 from django.utils import timezone
+from bots.keyboard_cache import KeyboardCache, get_courses_version
+
+course_keyboards = KeyboardCache()
 
 
 async def get_start_inline_keyboard():
@@ -67,7 +71,8 @@ async def get_main_keyboard(column: int):
     return json.dumps({'inline_keyboard': buttons})
 
 
-async def get_callback_keyboard(buttons: list[tuple[str, str]], column: int, inline: bool = True, menu: bool = True):
+@lru_cache(maxsize=256)
+def build_callback_keyboard(buttons: tuple[tuple[str, str], ...], column: int, inline: bool = True, menu: bool = True):
     keyboard, row = [], []
     i = 0
     for label, payload in buttons:
@@ -86,50 +91,71 @@ async def get_callback_keyboard(buttons: list[tuple[str, str]], column: int, inl
     return json.dumps({'keyboard': keyboard, 'resize_keyboard': True})
 
 
+async def get_callback_keyboard(buttons: list[tuple[str, str]], column: int, inline: bool = True, menu: bool = True):
+    return build_callback_keyboard(tuple(buttons), column, inline, menu)
+
+
 async def get_course_buttons(course_instances, back):
-    buttons = []
+    course_instances = list(course_instances)
     months = {
         1: 'января', 2: 'февраля', 3: 'марта', 4: 'апреля',
         5: 'мая', 6: 'июня', 7: 'июля', 8: 'августа',
         9: 'сентября', 10: 'октября', 11: 'ноября', 12: 'декабря'
     }
-    for course in course_instances:
-        if course.name == 'Фотогалерея':
-            buttons.append(('ГАЛЕРЕЯ', f'c:{course.pk}:{back}'))
-            continue
-        buttons.append(
-            (f'{course.name} - {course.scheduled_at.day} {months[course.scheduled_at.month]}', f'c:{course.pk}:{back}')
-        )
-    return await get_callback_keyboard(buttons, column=1)
 
+    def build():
+        buttons = []
+        for course in course_instances:
+            if course.name == 'Фотогалерея':
+                buttons.append(('ГАЛЕРЕЯ', f'c:{course.pk}:{back}'))
+                continue
+            buttons.append(
+                (f'{course.name} - {course.scheduled_at.day} {months[course.scheduled_at.month]}', f'c:{course.pk}:{back}')
+            )
+        return build_callback_keyboard(tuple(buttons), column=1)
 
-async def get_course_menu_buttons(back, course, chat_id):
-    course_clients = await CourseClient.objects.async_filter(course=course)
-    course_client_ids = [await sync_to_async(lambda: user.client.telegram_id)() for user in course_clients]
+    key = (get_courses_version(), back, tuple(course.pk for course in course_instances))
+    return course_keyboards.get_or_build(key, build)
+
+
+@lru_cache(maxsize=1024)
+def build_course_menu_buttons(course_pk: int, back: str, action: str | None):
     buttons = []
-    if back != 'client_courses' and back != 'past_courses' and chat_id not in course_client_ids:
-        buttons.append(('ЗАПИСАТЬСЯ НА КУРС', f'en_{course.pk}_e'))
-    elif chat_id in course_client_ids and course.scheduled_at > timezone.now():
-        buttons.append(('ОТМЕНИТЬ ЗАПИСЬ', f'en_{course.pk}_c'))
-    buttons.extend([('НАЗАД', back)])
-    return await get_callback_keyboard(buttons, column=2)
+    if action == 'entry':
+        buttons.append(('ЗАПИСАТЬСЯ НА КУРС', f'en_{course_pk}_e'))
+    elif action == 'cancel':
+        buttons.append(('ОТМЕНИТЬ ЗАПИСЬ', f'en_{course_pk}_c'))
+    buttons.append(('НАЗАД', back))
+    return build_callback_keyboard(tuple(buttons), column=2)
 
 
-async def check_phone_button():
+async def get_course_menu_buttons(back, course, chat_id):
+    is_client = await CourseClient.objects.filter(course=course, client__telegram_id=chat_id).aexists()
+    action = None
+    if back != 'client_courses' and back != 'past_courses' and not is_client:
+        action = 'entry'
+    elif is_client and course.scheduled_at > timezone.now():
+        action = 'cancel'
+    return build_course_menu_buttons(course.pk, back, action)
+
+
+CHECK_PHONE_KEYBOARD = json.dumps(
+    {
+        'inline_keyboard': [
+            [
+                {
+                    'text': 'НОМЕР ВЕРНЫЙ',
+                    'callback_data': 'phone_true'
+                },
+                {
+                    'text': 'УКАЖУ ДРУГОЙ',
+                    'callback_data': 'phone_false'
+                }
+            ],
+        ]
+    }
+)
 
-    return json.dumps(
-        {
-            'inline_keyboard': [
-                [
-                    {
-                        'text': 'НОМЕР ВЕРНЫЙ',
-                        'callback_data': 'phone_true'
-                    },
-                    {
-                        'text': 'УКАЖУ ДРУГОЙ',
-                        'callback_data': 'phone_false'
-                    }
-                ],
-            ]
-        }
-    )
+
+async def check_phone_button():
+    return CHECK_PHONE_KEYBOARD
@@ -4,34 +4,80 @@ import aiohttp
 import redis
 
 from bots.abs_api import AbstractAPI
+from bots.rate_limit import RetryAfter
 from asgiref.sync import sync_to_async
 from django.utils import timezone
-from courses.models import Course, Office, Timer, Client
+from courses.models import Course, Office, Timer
 from typing import Dict, Union, Tuple, List
 from textwrap import dedent
 
 
 class TgApi(AbstractAPI):
     """Класс API методов Tg"""
-    def __init__(self, tg_token: str, redis_db: redis.Redis, session: aiohttp.ClientSession = None, loop=None):
+
+    user_id_field = 'telegram_id'
+    platform = 'tg'
+    rate_limits = {'rate': 30, 'chat_rate': 1, 'chat_capacity': 5}
+
+    api_url = 'https://api.telegram.org'
+
+    def __init__(
+            self,
+            tg_token: str,
+            redis_db: redis.Redis,
+            session: aiohttp.ClientSession = None,
+            loop=None,
+            api_url: str = None,
+    ):
         super().__init__(redis_db, session, loop)
         self.token = tg_token
+        if api_url:
+            self.api_url = api_url.rstrip('/')
+
+    def get_method_url(self, method: str) -> str:
+        return f'{self.api_url}/bot{self.token}/{method}'
+
+    async def request(self, method: str, params: dict):
+        """
+        Вызов метода Bot API: POST с телом в JSON, параметры со значением None не передаются.
+        Запросы к чатам проходят через ограничитель частоты: 30 сообщений в секунду
+        на бота и около одного в секунду на чат
+        """
+
+        payload = {}
+        for param, value in params.items():
+            if value is None:
+                continue
+            # клавиатуры в модуле keyboard сериализуются в строку, в теле JSON передаем объект
+            if param == 'reply_markup' and isinstance(value, str):
+                value = json.loads(value)
+            payload[param] = value
+        chat_id = payload.get('chat_id')
+        if chat_id is None:
+            return await self.post(method, payload)
+        return await self.limited_request(lambda: self.post(method, payload, chat_id), chat_id)
+
+    async def post(self, method: str, payload: dict, chat_id=None):
+        async with self.session.post(self.get_method_url(method), json=payload) as res:
+            if res.status == 429:
+                response = await res.json(content_type=None)
+                raise RetryAfter(
+                    response.get('parameters', {}).get('retry_after', 1),
+                    'chat' if chat_id is not None else 'global',
+                    response.get('description', '')
+                )
+            res.raise_for_status()
+            return await res.json(content_type=None)
 
     async def send_message(self, chat_id, msg, *, reply_markup=None, parse_mode=None):
         """Отправка сообщения через api TG"""
-        url = f"https://api.telegram.org/bot{self.token}/sendmessage"
         params = {
             'chat_id': chat_id,
             'text': msg,
             'reply_markup': reply_markup,
             'parse_mode': parse_mode
         }
-        for param, value in params.copy().items():
-            if value is None:
-                del params[param]
-        async with self.session.get(url, params=params) as res:
-            res.raise_for_status()
-            return json.loads(await res.text())
+        return await self.request('sendmessage', params)
 
     async def loop_send_message(self, chat_id, msg, *, reply_markup=None, parse_mode=None, interval: int):
 
@@ -49,7 +95,6 @@ class TgApi(AbstractAPI):
 
     ) -> None:
         """Отправка сообщения через api TG"""
-        url = f"https://api.telegram.org/bot{self.token}/sendmessage"
 
         iterate_data = zip(
             messages,
@@ -65,11 +110,7 @@ class TgApi(AbstractAPI):
                 'parse_mode': parse_mode
             }
             await asyncio.sleep(timer)
-            for param, value in params.copy().items():
-                if value is None:
-                    del params[param]
-            async with self.session.get(url, params=params) as res:
-                res.raise_for_status()
+            await self.request('sendmessage', params)
 
     @staticmethod
     async def create_reminder_text(first_name: str, course: Course, office: Office) -> str:
@@ -96,7 +137,7 @@ class TgApi(AbstractAPI):
             remind_before: int = None,
             reply_markup=None,
             parse_mode=None,
-    ) -> asyncio.Task | None:
+    ) -> str | None:
         """
         Отложенная отправка сообщения с использованием schedule_task
         !!! Функция не используется и требует доработки
@@ -109,6 +150,7 @@ class TgApi(AbstractAPI):
             task_name,
             'send_message',
             timer,
+            False,
             chat_id,
             msg,
             reply_markup=reply_markup,
@@ -127,81 +169,20 @@ class TgApi(AbstractAPI):
             remind_before: int = None,
             reply_markup=None,
             parse_mode=None,
-    ) -> Union[asyncio.Task, None]:
-        """Отложенная отправка сообщения"""
+    ) -> Union[str, None]:
+        """Отложенная отправка сообщения через планировщик sending_tasks"""
         timer = interval if interval else time_to_start - time_offset - remind_before
         if timer < 0:
             return
-
-        async def coro():
-            await asyncio.sleep(timer)
-            await self.send_message(chat_id, msg, reply_markup=reply_markup, parse_mode=parse_mode)
-            del self.sending_tasks[task_name]
-        return asyncio.ensure_future(coro(), loop=self.loop)
-
-    async def update_message_single_sending_task(
-            self,
-            course: Course,
-            client: Client,
-            office: Office,
-            interval: int,
-            remind_before: Timer
-    ):
-        if not client.telegram_id:
-            return
-        task_name = await self.create_key_task(client.telegram_id, course.pk, remind_before)
-        text = await self.create_reminder_text(client.first_name, course, office)
-        task = await self.send_message_later(
-            client.telegram_id,
-            dedent(text),
-            interval=interval,
-            parse_mode='Markdown',
-            task_name=task_name
+        self.sending_tasks.add(
+            task_name, timer, 'send_message', chat_id, msg,
+            reply_markup=reply_markup, parse_mode=parse_mode
         )
-        if self.sending_tasks.get(task_name):
-            self.sending_tasks[task_name].cancel()
-            del self.sending_tasks[task_name]
-        self.sending_tasks.update({task_name: task})
+        return task_name
 
-    async def update_message_sending_tasks(
-            self,
-            time_offset: int = 5 * 3600,
-            reminder_text: str = None
-    ) -> Dict[str, asyncio.Task]:
-
-        """Создание отложенных задач по отправке сообщений пользователям по данным базы данных"""
-
-        future_courses = await Course.objects.async_filter(scheduled_at__gt=timezone.now(), published_in_bot=True)
-        future_courses_prefetch = await sync_to_async(future_courses.prefetch_related)('clients', 'reminder_intervals')
-        office = await Office.objects.async_first()
-        if self.sending_tasks:
-            self.sending_tasks.clear()
-        self.sending_tasks = {}
-        for course in future_courses_prefetch:
-            reminder_intervals = await sync_to_async(course.reminder_intervals.all)()
-            time_to_start = (course.scheduled_at - timezone.now()).total_seconds()
-            clients = await sync_to_async(course.clients.all)()
-            if not clients:
-                return self.sending_tasks
-            for remind_before in reminder_intervals:
-                interval = time_to_start - time_offset - remind_before.reminder_interval * 3600
-                if interval < 0:
-                    continue
-                for client in clients:
-                    if not client.telegram_id:
-                        continue
-                    text = await self.create_reminder_text(client.first_name, course, office)
-                    msg = reminder_text if reminder_text else text
-                    task_name = await self.create_key_task(client.telegram_id, course.pk, remind_before)
-                    task = await self.send_message_later(
-                        client.telegram_id,
-                        dedent(msg),
-                        interval=interval,
-                        parse_mode='Markdown',
-                        task_name=task_name
-                    )
-                    self.sending_tasks.update({task_name: task})
-        return self.sending_tasks
+    async def get_reminder_message_kwargs(self) -> Dict[str, str]:
+        """Дополнительные параметры send_message для напоминаний о курсе"""
+        return {'parse_mode': 'Markdown'}
 
     async def delete_message_sending_tasks(self, course_pk, chat_id):
         """Удаляет отложенные задачи оповещения для заданного course_pk и chat_id"""
@@ -212,9 +193,7 @@ class TgApi(AbstractAPI):
         reminder_intervals = await sync_to_async(course_of_deletion_tasks.reminder_intervals.all)()
         for remind_before in reminder_intervals:
             task_name = await self.create_key_task(chat_id, course_pk, remind_before)
-            if self.sending_tasks.get(task_name):
-                self.sending_tasks[task_name].cancel()
-                del self.sending_tasks[task_name]
+            self.sending_tasks.cancel(task_name)
 
     async def create_message_sending_tasks(self, course_pk, chat_id, *, reminder_text: str):
         """Создает отложенные задачи оповещения для заданного course_pk и chat_id"""
@@ -230,16 +209,13 @@ class TgApi(AbstractAPI):
             if interval < 0:
                 continue
             task_name = await self.create_key_task(chat_id, course_pk, remind_before)
-            task = await self.send_message_later(
+            await self.send_message_later(
                 chat_id,
                 dedent(reminder_text),
                 interval=interval,
                 parse_mode='Markdown',
                 task_name=task_name
             )
-            if self.sending_tasks.get(task_name):
-                self.sending_tasks[task_name].cancel()
-            self.sending_tasks[task_name] = task
 
     @staticmethod
     async def create_key_task(chat_id, course_pk, remind_before: Timer | int) -> str:
@@ -251,23 +227,16 @@ class TgApi(AbstractAPI):
 
     async def send_location(self, chat_id, *, lat, long, reply_markup=None):
         """Отправка локации через api TG"""
-        url = f"https://api.telegram.org/bot{self.token}/sendlocation"
         params = {
             'chat_id': chat_id,
             'latitude': lat,
             'longitude': long,
             'reply_markup': reply_markup
         }
-        for param, value in params.copy().items():
-            if value is None:
-                del params[param]
-        async with self.session.get(url, params=params) as res:
-            res.raise_for_status()
-            return json.loads(await res.text())
+        return await self.request('sendlocation', params)
 
     async def send_photo(self, chat_id, *, photo, caption=None, reply_markup=None, parse_mode=None):
         """Отправка фото через api TG"""
-        url = f"https://api.telegram.org/bot{self.token}/sendphoto"
         params = {
             'chat_id': chat_id,
             'caption': caption,
@@ -275,16 +244,10 @@ class TgApi(AbstractAPI):
             'photo': photo,
             'parse_mode': parse_mode
         }
-        for param, value in params.copy().items():
-            if value is None:
-                del params[param]
-        async with self.session.get(url, params=params) as res:
-            res.raise_for_status()
-            return json.loads(await res.text())
+        return await self.request('sendphoto', params)
 
     async def send_venue(self, chat_id, *, lat, long, title, address, reply_markup=None):
         """Отправка события через api TG"""
-        url = f"https://api.telegram.org/bot{self.token}/sendvenue"
         params = {
             'chat_id': chat_id,
             'latitude': lat,
@@ -293,58 +256,51 @@ class TgApi(AbstractAPI):
             'address': address,
             'reply_markup': reply_markup
         }
-        for param, value in params.copy().items():
-            if value is None:
-                del params[param]
-        async with self.session.get(url, params=params) as res:
-            res.raise_for_status()
-            return json.loads(await res.text())
+        return await self.request('sendvenue', params)
 
     async def send_media_group(self, chat_id, *, media: list):
         """Отправка нескольких медиа через api TG"""
-        url = f"https://api.telegram.org/bot{self.token}/sendmediagroup"
         params = {
             'chat_id': chat_id,
-            'media': json.dumps(media)
+            'media': media
         }
-        async with self.session.get(url, params=params) as res:
-            res.raise_for_status()
-            return json.loads(await res.text())
+        return await self.request('sendmediagroup', params)
 
     async def answer_callback_query(self, callback_query_id: str, text: str):
         """Отправка уведомления в виде всплывающего сообщения"""
-        url = f"https://api.telegram.org/bot{self.token}/answercallbackquery"
         params = {
             'callback_query_id': callback_query_id,
             'text': text,
-            'show_alert': 1
+            'show_alert': True
         }
-        async with self.session.get(url, params=params) as res:
-            res.raise_for_status()
-            return json.loads(await res.text())
+        return await self.request('answercallbackquery', params)
 
     async def edit_message_reply_markup(self, chat_id, message_id, reply_markup):
         """Изменение существующей клавиатуры"""
-        url = f"https://api.telegram.org/bot{self.token}/editmessagereplymarkup"
         params = {
             'chat_id': chat_id,
             'message_id': message_id,
             'reply_markup': reply_markup
         }
-        async with self.session.get(url, params=params) as res:
-            res.raise_for_status()
-            return json.loads(await res.text())
+        return await self.request('editmessagereplymarkup', params)
 
     async def delete_message(self, chat_id, message_id):
         """Удаление существующей клавиатуры"""
-        url = f"https://api.telegram.org/bot{self.token}/deletemessage"
         params = {
             'chat_id': chat_id,
             'message_id': message_id
         }
-        async with self.session.get(url, params=params) as res:
-            res.raise_for_status()
-            return json.loads(await res.text())
+        return await self.request('deletemessage', params)
+
+    async def set_webhook(self, webhook_url: str, secret_token: str = None, max_connections: int = 40):
+        """Подключение webhook. Пустой webhook_url отключает webhook и возвращает бота к getUpdates"""
+        params = {
+            'url': webhook_url,
+            'secret_token': secret_token,
+            'max_connections': max_connections,
+            'allowed_updates': ['message', 'callback_query']
+        }
+        return await self.request('setwebhook', params)
 
 
 class TgEvent:
@@ -19,7 +19,7 @@ logger = logging.getLogger('telegram')
 
 async def send_main_menu_answer(api: TgApi, event: Update):
     message, user_reply = await get_message_user_replay(event)
-    user_instance = await Client.objects.async_get(telegram_id=message.chat.id)
+    user_instance = await api.registrations.get(message.chat.id)
     # отправка курсов пользователя
     if user_reply == 'client_courses':
         client_courses = await sync_to_async(user_instance.courses.filter)(published_in_bot=True)
@@ -101,7 +101,7 @@ async def send_main_menu_answer(api: TgApi, event: Update):
                 '''
             logger.warning(dedent(logger_msg))
         else:
-            api.redis_db.set(f'tg_{message.chat.id}_current_course', course_pk)
+            api.user_states.update(message.chat.id, current_course=course_pk)
             if user_instance.phone_number:
                 text = f'''
                     _Чтобы записаться проверьте ваш номер телефона:_
@@ -166,8 +166,7 @@ async def entry_user_to_course(api: TgApi, event: Update, user, course):
     await api.create_message_sending_tasks(course.pk, message.chat.id, reminder_text=reminder_text)
     await sync_to_async(course.clients.add)(user)
     await sync_to_async(course.save)()
-    redis_phone = api.redis_db.get(f'tg_{message.chat.id}_phone')
-    phone = redis_phone.decode('utf-8') if redis_phone else user.phone_number
+    phone = api.user_states.get_field(message.chat.id, 'phone') or user.phone_number
     logger_msg = f'''
         Клиент t.me/{message.chat.username}
         Тел: {phone}
@@ -266,7 +265,9 @@ async def handle_course_info(api: TgApi, event: Update):
     if event.callback_query and event.callback_query.data.split(':')[0] == 'c':
         course_pk = int(user_reply.split(':')[1])
         back = user_reply.split(':')[2]
-        course = await Course.objects.async_get(pk=course_pk)
+        course = await (
+            Course.objects.select_related('program', 'lecture').prefetch_related('images').aget(pk=course_pk)
+        )
         course_date = await sync_to_async(course.scheduled_at.strftime)("%d.%m.%Y")
         course_time = await sync_to_async(course.scheduled_at.strftime)("%H:%M")
         course_images = await sync_to_async(course.images.all)()
@@ -321,15 +322,15 @@ async def handle_course_info(api: TgApi, event: Update):
 
 async def enter_phone(api: TgApi, event: Update):
     message, user_reply = await get_message_user_replay(event)
-    user_instance = await Client.objects.async_get(telegram_id=message.chat.id)
-    course_pk = api.redis_db.get(f'tg_{message.chat.id}_current_course')
+    user_instance = await api.registrations.get(message.chat.id)
+    course_pk = api.user_states.get_field(message.chat.id, 'current_course')
     course = await Course.objects.async_get(pk=course_pk)
 
     # если номер существует
     if event.callback_query and user_reply.split('_')[0] == 'phone':
         if user_reply.split('_')[1] == 'true':
             await entry_user_to_course(api, event, user_instance, course)
-            api.redis_db.delete(f'tg_{message.chat.id}_current_course')
+            api.user_states.update(message.chat.id, current_course=None)
             return 'MAIN_MENU'
         # если клиент захотел указать другой номер
         else:
@@ -355,9 +356,11 @@ async def enter_phone(api: TgApi, event: Update):
         phone = user_reply
         pattern = re.compile(r'^(\+7|7|8)?[\s\-]?\(?[489][0-9]{2}\)?[\s\-]?[0-9]{3}[\s\-]?[0-9]{2}[\s\-]?[0-9]{2}$')
         if pattern.findall(phone):
-            api.redis_db.delete(f'tg_{message.chat.id}_current_course')
             norm_phone = ''.join(['+7'] + [i for i in phone if i.isdigit()][-10:])
-            api.redis_db.set(f'tg_{message.chat.id}_phone', norm_phone)
+            api.user_states.update(message.chat.id, current_course=None, phone=norm_phone)
+            if str(user_instance.phone_number) != norm_phone:
+                user_instance.phone_number = norm_phone
+                await sync_to_async(Client.objects.filter(pk=user_instance.pk).update)(phone_number=norm_phone)
             await entry_user_to_course(api, event, user_instance, course)
             return 'MAIN_MENU'
         else:
@@ -384,23 +387,30 @@ async def handle_event(api: TgApi, event: Update):
             message_id=message.message_id
         )
     start_buttons = ['start', '/start', '/admin', 'начать', 'старт', '+', '☰ menu', '/menu']
-    user, create = await Client.objects.async_get_or_create(
-        telegram_id=message.chat.id,
-        defaults={
-            'first_name': message.chat.first_name,
-            'last_name': message.chat.last_name,
-            'registered_at': timezone.now() + timezone.timedelta(hours=api.hour_offset)
-        }
-    )
-    if create:
-        with open(os.path.join(os.getcwd(), 'bots', 'step_messages.json')) as file:
-            msg_steps = json.load(file)
-        task_name_start = f'tg_register_{message.chat.id}'
-        await api.create_single_step_task(user, task_name_start, msg_steps['register'])
+    # состояние диалога хранится в Redis, запись Client читается только для нового пользователя
+    if message.chat.id in api.registrations:
+        # обработчикам следующих событий нужна сохраненная запись Client
+        await api.registrations.flush()
+    state = api.user_states.get(message.chat.id)
+    if 'bot_state' not in state:
+        user, create = await api.registrations.get_or_create(
+            message.chat.id,
+            defaults={
+                'first_name': message.chat.first_name,
+                'last_name': message.chat.last_name,
+                'registered_at': timezone.now() + timezone.timedelta(hours=api.hour_offset)
+            }
+        )
+        if create:
+            with open(os.path.join(os.getcwd(), 'bots', 'step_messages.json')) as file:
+                msg_steps = json.load(file)
+            task_name_start = f'tg_register_{message.chat.id}'
+            await api.create_single_step_task(user, task_name_start, msg_steps['register'])
+        state = api.user_states.load(message.chat.id, user)
     if user_reply.lower() in start_buttons:
         user_state = 'START'
     else:
-        user_state = user.bot_state
+        user_state = state['bot_state']
 
     states_functions = {
         'START': start,
@@ -409,10 +419,9 @@ async def handle_event(api: TgApi, event: Update):
         'PHONE': enter_phone,
     }
     state_handler = states_functions[user_state]
-    user.bot_state = await state_handler(api, event)
-    exist_phone = api.redis_db.get(f'tg_{message.chat.id}_phone')
-    user.phone_number = exist_phone.decode('utf-8') if exist_phone else user.phone_number
-    await sync_to_async(user.save)()
+    bot_state = await state_handler(api, event)
+    if bot_state != state['bot_state']:
+        api.user_states.update(message.chat.id, bot_state=bot_state)
 
 
 async def get_message_user_replay(event: Update):
@@ -15,27 +15,46 @@ class TgLongPollServer(LongPollServer):
             self,
             api: TgApi,
             handle_event: Callable[[TgApi, tg_types.Update], Awaitable[None]],
+            **kwargs
     ):
-        super().__init__(api, handle_event)
-        self.url = f'https://api.telegram.org/bot{api.token}/getUpdates'
-        self.params = {'timeout': 25, 'limit': 1}
+        super().__init__(api, handle_event, **kwargs)
+        self.params = {'timeout': 25, 'limit': 100}
 
     async def init_tasks(self):
         await self.api.create_tasks_from_db(hour_interval=2)
         await self.api.bypass_users_to_create_tasks(hour_interval=8)
 
     async def update_tasks(self):
-        await self.api.update_course_tasks_triggered_admin('update_tg_tasks')
+        await self.api.apply_admin_events()
+        await self.api.flush_user_states()
         await self.api.create_message_tasks('tg_create_message')
 
-    async def get_event(self) -> Awaitable[tg_types.Update | None]:
-        response = await self.api.session.get(self.url, params=self.params)
-        response.raise_for_status()
-        updates = tg_types.Response.parse_raw(await response.text())
-        if not updates.result or not updates.ok:
-            return
-        update = updates.result[-1]
-        self.params['offset'] = update.update_id + 1
-        if not update.message and not update.callback_query:
-            return
-        return tg_types.Update.parse_obj(update)
+    def get_chat_id(self, event: tg_types.Update) -> int:
+        if event.message:
+            return event.message.chat.id
+        callback_query = event.callback_query
+        if callback_query.message:
+            return callback_query.message.chat.id
+        return callback_query.from_.id
+
+    async def get_updates(self) -> Awaitable[list[tg_types.Update]]:
+        updates = tg_types.Response.parse_obj(await self.api.request('getUpdates', self.params))
+        if not updates.ok:
+            return []
+        result = [update for update in updates.result if update]
+        if result:
+            # подтверждаем серверу получение всей пачки
+            self.params['offset'] = max(update.update_id for update in result) + 1
+        return result
+
+    @staticmethod
+    def filter_updates(updates: list[tg_types.Update]) -> list[tg_types.Update]:
+        """Обновления, которые обрабатывает бот: сообщения и нажатия inline-кнопок"""
+        return [update for update in updates if update.message or update.callback_query]
+
+    def parse_update(self, update_data: dict) -> list[tg_types.Update]:
+        """Разбор обновления, полученного через webhook"""
+        return self.filter_updates([tg_types.Update.parse_obj(update_data)])
+
+    async def get_events(self) -> Awaitable[list[tg_types.Update]]:
+        return self.filter_updates(await self.get_updates())
@@ -0,0 +1,67 @@
+import asyncio
+import json
+
+import aiohttp
+
+
+class HttpTransport:
+    """
+    Общая HTTP-сессия для TgApi и VkApi.
+
+    Один пул соединений с явными ограничениями: общее число соединений,
+    число соединений на хост, кэш DNS и keep-alive.
+    Сессия создается при первом acquire и закрывается после release
+    последним пользователем, поэтому боты одного процесса делят пул.
+    aiohttp работает по HTTP/1.1, поэтому параллельность запросов к одному
+    API ограничивается limit_per_host, а не мультиплексированием HTTP/2.
+    """
+
+    def __init__(
+            self,
+            limit: int = 100,
+            limit_per_host: int = 30,
+            ttl_dns_cache: int = 300,
+            keepalive_timeout: int = 30,
+            total_timeout: int = 60,
+            connect_timeout: int = 10,
+    ):
+        self.limit = limit
+        self.limit_per_host = limit_per_host
+        self.ttl_dns_cache = ttl_dns_cache
+        self.keepalive_timeout = keepalive_timeout
+        self.timeout = aiohttp.ClientTimeout(total=total_timeout, connect=connect_timeout)
+        self.session: aiohttp.ClientSession | None = None
+        self.users = 0
+        self._lock = asyncio.Lock()
+
+    def create_session(self) -> aiohttp.ClientSession:
+        connector = aiohttp.TCPConnector(
+            limit=self.limit,
+            limit_per_host=self.limit_per_host,
+            ttl_dns_cache=self.ttl_dns_cache,
+            keepalive_timeout=self.keepalive_timeout,
+            enable_cleanup_closed=True,
+        )
+        return aiohttp.ClientSession(
+            connector=connector,
+            timeout=self.timeout,
+            json_serialize=lambda obj: json.dumps(obj, ensure_ascii=False),
+            headers={'Accept-Encoding': 'gzip, deflate'},
+        )
+
+    async def acquire(self) -> aiohttp.ClientSession:
+        async with self._lock:
+            if self.session is None or self.session.closed:
+                self.session = self.create_session()
+            self.users += 1
+            return self.session
+
+    async def release(self) -> None:
+        async with self._lock:
+            self.users = max(self.users - 1, 0)
+            if not self.users and self.session and not self.session.closed:
+                await self.session.close()
+                self.session = None
+
+
+transport = HttpTransport()
@@ -1,10 +1,19 @@
 import json
+
+from functools import lru_cache
 from courses.models import CourseClient
-from asgiref.sync import sync_to_async
 from django.utils import timezone
+from bots.keyboard_cache import KeyboardCache, get_courses_version
+
+course_keyboards = KeyboardCache()
 
 
 async def get_start_buttons():
+    return build_start_buttons()
+
+
+@lru_cache(maxsize=None)
+def build_start_buttons():
     start_buttons = [
         ('Предстоящие курсы', 'future_courses'),
         ('Ваши курсы', 'client_courses'),
@@ -27,6 +36,11 @@ async def get_start_buttons():
 
 
 async def get_menu_button(color, inline):
+    return build_menu_button(color, inline)
+
+
+@lru_cache(maxsize=None)
+def build_menu_button(color, inline):
     button = [
         [
             {
@@ -40,6 +54,12 @@ async def get_menu_button(color, inline):
 
 
 async def get_course_buttons(course_instances, back):
+    course_instances = list(course_instances)
+    key = (get_courses_version(), back, tuple(course.pk for course in course_instances))
+    return course_keyboards.get_or_build(key, lambda: build_course_buttons(course_instances, back))
+
+
+def build_course_buttons(course_instances, back):
     buttons = []
     months = {
         1: 'января', 2: 'февраля', 3: 'марта', 4: 'апреля',
@@ -91,6 +111,11 @@ async def get_course_buttons(course_instances, back):
 
 
 async def check_phone_button():
+    return build_check_phone_button()
+
+
+@lru_cache(maxsize=None)
+def build_check_phone_button():
     buttons = [
         [
             {
@@ -128,16 +153,25 @@ async def check_phone_button():
 
 
 async def get_course_menu_buttons(back, course, user_id):
-    course_clients = await CourseClient.objects.async_filter(course=course)
-    course_client_ids = [await sync_to_async(lambda: user.client.vk_id)() for user in course_clients]
+    is_client = await CourseClient.objects.filter(course=course, client__vk_id=user_id).aexists()
+    action = None
+    if back != 'client_courses' and back != 'past_courses' and not is_client:
+        action = 'entry'
+    elif is_client and course.scheduled_at > timezone.now():
+        action = 'cancel'
+    return build_course_menu_buttons(course.pk, back, action)
+
+
+@lru_cache(maxsize=1024)
+def build_course_menu_buttons(course_pk, back, action):
     buttons = []
-    if back != 'client_courses' and back != 'past_courses' and user_id not in course_client_ids:
+    if action == 'entry':
         buttons.append(
             [
                 {
                     'action': {
                         'type': 'text',
-                        'payload': {'entry': course.pk},
+                        'payload': {'entry': course_pk},
                         'label': 'ЗАПИСАТЬСЯ НА КУРС'
                     },
                     'color': 'secondary'
@@ -145,13 +179,13 @@ async def get_course_menu_buttons(back, course, user_id):
             ]
         )
 
-    elif user_id in course_client_ids and course.scheduled_at > timezone.now():
+    elif action == 'cancel':
         buttons.append(
             [
                 {
                     'action': {
                         'type': 'text',
-                        'payload': {'entry': course.pk, 'cancel': 1},
+                        'payload': {'entry': course_pk, 'cancel': 1},
                         'label': 'ОТМЕНИТЬ ЗАПИСЬ'
                     },
                     'color': 'secondary'
@@ -6,10 +6,11 @@ import redis
 import random
 
 from bots.abs_api import AbstractAPI
+from bots.rate_limit import RetryAfter
 from more_itertools import chunked
 from asgiref.sync import sync_to_async
 from django.utils import timezone
-from courses.models import Course, Office, Timer, Client
+from courses.models import Course, Office, Timer
 from typing import Dict, Union
 from textwrap import dedent
 from .buttons import get_menu_button
@@ -18,6 +19,15 @@ from typing import Dict, Union, Tuple, List
 
 class VkApi(AbstractAPI):
     """Класс API методов Vk"""
+
+    user_id_field = 'vk_id'
+    platform = 'vk'
+    api_url = 'https://api.vk.com'
+    version = '5.131'
+    rate_limits = {'rate': 20}
+    # Коды ошибок ограничения частоты: код -> (пауза в секундах, область ограничения)
+    retry_errors = {6: (1, 'global'), 9: (5, 'chat')}
+
     def __init__(
             self,
             vk_group_token: str = None,
@@ -25,12 +35,41 @@ class VkApi(AbstractAPI):
             vk_group_id: int = None,
             redis_db: redis.Redis = None,
             session: aiohttp.ClientSession = None,
-            loop=None
+            loop=None,
+            api_url: str = None,
     ):
         super().__init__(redis_db, session, loop)
         self.token = vk_group_token
         self.user_token = vk_user_token
         self.vk_group_id = vk_group_id
+        if api_url:
+            self.api_url = api_url.rstrip('/')
+
+    def get_method_url(self, method: str) -> str:
+        return f'{self.api_url}/method/{method}'
+
+    async def request(self, method: str, params: dict):
+        """
+        Вызов метода API VK: POST с параметрами в теле формы, параметры со значением None не передаются.
+        Сообщения проходят через ограничитель частоты: 20 запросов в секунду на ключ сообщества
+        """
+
+        data = {'access_token': self.token, 'v': self.version}
+        data.update({param: value for param, value in params.items() if value is not None})
+        chat_id = data.get('peer_id') or data.get('user_id') if method.startswith('messages.') else None
+        if chat_id is None:
+            return await self.post(method, data)
+        return await self.limited_request(lambda: self.post(method, data), chat_id)
+
+    async def post(self, method: str, data: dict):
+        async with self.session.post(self.get_method_url(method), data=data) as res:
+            res.raise_for_status()
+            response = await res.json(content_type=None)
+        error = response.get('error')
+        if error and error.get('error_code') in self.retry_errors:
+            retry_after, scope = self.retry_errors[error['error_code']]
+            raise RetryAfter(retry_after, scope, error.get('error_msg', ''))
+        return response
 
     async def send_message(
             self,
@@ -44,9 +83,7 @@ class VkApi(AbstractAPI):
             lat: str = None,
             long: str = None,
     ):
-        send_message_url = 'https://api.vk.com/method/messages.send'
         params = {
-            'access_token': self.token, 'v': '5.131',
             'user_id': user_id,
             'user_ids': user_ids,
             'random_id': random.randint(0, 1000),
@@ -58,12 +95,19 @@ class VkApi(AbstractAPI):
             'lat': lat,
             'long': long
         }
-        for param, value in params.copy().items():
-            if value is None:
-                del params[param]
-        async with self.session.post(send_message_url, params=params) as res:
-            res.raise_for_status()
-            return json.loads(await res.text())
+        return await self.request('messages.send', params)
+
+    async def send_message_event_answer(self, event_id: str, user_id: int, peer_id: int, event_data: dict = None):
+        """Ответ на нажатие callback-кнопки"""
+
+        params = {
+            'event_id': event_id,
+            'user_id': user_id,
+            'peer_id': peer_id,
+        }
+        if event_data:
+            params['event_data'] = json.dumps(event_data, ensure_ascii=False)
+        return await self.request('messages.sendMessageEventAnswer', params)
 
     async def loop_send_message(self, user_id: int, message: str, *, keyboard: str = None, interval: int):
 
@@ -78,7 +122,6 @@ class VkApi(AbstractAPI):
             timers: Union[List[int], Tuple[int]],
             keyboards: Union[List[Union[str, None]], Tuple[Union[str, None]]] = None,
     ) -> None:
-        send_message_url = 'https://api.vk.com/method/messages.send'
         iterate_data = zip(
             messages,
             timers,
@@ -86,18 +129,13 @@ class VkApi(AbstractAPI):
         )
         for msg, timer, keyboard in iterate_data:
             params = {
-                'access_token': self.token, 'v': '5.131',
                 'user_id': user_id,
                 'random_id': random.randint(0, 1000),
                 'message': msg,
                 'keyboard': keyboard,
             }
-            for param, value in params.copy().items():
-                if value is None:
-                    del params[param]
             await asyncio.sleep(timer)
-            async with self.session.get(send_message_url, params=params) as res:
-                res.raise_for_status()
+            await self.request('messages.send', params)
 
     @staticmethod
     async def create_reminder_text(name: str, course: Course, office: Office) -> str:
@@ -129,92 +167,30 @@ class VkApi(AbstractAPI):
             sticker_id: int = None,
             lat: str = None,
             long: str = None,
-    ) -> Union[asyncio.Task, None]:
-        """Отложенная отправка сообщения"""
+    ) -> Union[str, None]:
+        """Отложенная отправка сообщения через планировщик sending_tasks"""
 
         timer = interval if interval else time_to_start - time_offset - remind_before
         if timer < 0:
             return
+        params = {
+            'user_ids': user_ids,
+            'keyboard': keyboard,
+            'attachment': attachment,
+            'payload': payload,
+            'sticker_id': sticker_id,
+            'lat': lat,
+            'long': long
+        }
+        for param, value in params.copy().items():
+            if value is None:
+                del params[param]
+        self.sending_tasks.add(task_name, timer, 'send_message', user_id, message, **params)
+        return task_name
 
-        async def coro():
-            await asyncio.sleep(timer)
-            await self.send_message(
-                user_id,
-                message,
-                user_ids,
-                keyboard,
-                attachment,
-                payload,
-                sticker_id,
-                lat,
-                long,
-            )
-            del self.sending_tasks[task_name]
-        return asyncio.ensure_future(coro(), loop=self.loop)
-
-    async def update_message_single_sending_task(
-            self,
-            course: Course,
-            client: Client,
-            office: Office,
-            interval: int,
-            remind_before: Timer
-    ):
-        if not client.vk_id:
-            return
-        task_name = await self.create_key_task(client.vk_id, course.pk, remind_before)
-        text = await self.create_reminder_text(client.first_name, course, office)
-        task = await self.send_message_later(
-            client.vk_id,
-            dedent(text),
-            interval=interval,
-            keyboard=await get_menu_button(color='secondary', inline=True),
-            task_name=task_name
-        )
-        if self.sending_tasks.get(task_name):
-            self.sending_tasks[task_name].cancel()
-            del self.sending_tasks[task_name]
-        self.sending_tasks.update({task_name: task})
-
-    async def update_message_sending_tasks(
-            self,
-            time_offset: int = 5 * 3600,
-            reminder_text: str = None
-    ) -> Dict[str, asyncio.Task]:
-
-        """Создание отложенных задач по отправке сообщений пользователям по данным базы данных"""
-
-        future_courses = await Course.objects.async_filter(scheduled_at__gt=timezone.now(), published_in_bot=True)
-        future_courses_prefetch = await sync_to_async(future_courses.prefetch_related)('clients', 'reminder_intervals')
-        office = await Office.objects.async_first()
-        if self.sending_tasks:
-            self.sending_tasks.clear()
-        self.sending_tasks = {}
-        for course in future_courses_prefetch:
-            reminder_intervals = await sync_to_async(course.reminder_intervals.all)()
-            time_to_start = (course.scheduled_at - timezone.now()).total_seconds()
-            clients = await sync_to_async(course.clients.all)()
-            if not clients:
-                return self.sending_tasks
-            for remind_before in reminder_intervals:
-                interval = time_to_start - time_offset - remind_before.reminder_interval * 3600
-                if interval < 0:
-                    continue
-                for client in clients:
-                    if not client.vk_id:
-                        continue
-                    text = await self.create_reminder_text(client.first_name, course, office)
-                    msg = reminder_text if reminder_text else text
-                    task_name = await self.create_key_task(client.vk_id, course.pk, remind_before)
-                    task = await self.send_message_later(
-                        client.vk_id,
-                        dedent(msg),
-                        interval=interval,
-                        keyboard=await get_menu_button(color='secondary', inline=True),
-                        task_name=task_name
-                    )
-                    self.sending_tasks.update({task_name: task})
-        return self.sending_tasks
+    async def get_reminder_message_kwargs(self) -> Dict[str, str]:
+        """Дополнительные параметры send_message для напоминаний о курсе"""
+        return {'keyboard': await get_menu_button(color='secondary', inline=True)}
 
     async def delete_message_sending_tasks(self, course_pk, user_id):
         """Удаляет отложенные задачи оповещения для заданного course_pk и chat_id"""
@@ -224,9 +200,7 @@ class VkApi(AbstractAPI):
         reminder_intervals = await sync_to_async(course_of_deletion_tasks.reminder_intervals.all)()
         for remind_before in reminder_intervals:
             task_name = await self.create_key_task(user_id, course_pk, remind_before)
-            if self.sending_tasks.get(task_name):
-                self.sending_tasks[task_name].cancel()
-                del self.sending_tasks[task_name]
+            self.sending_tasks.cancel(task_name)
 
     async def create_message_sending_tasks(self, course_pk, user_id, *, reminder_text: str):
         """Создает отложенные задачи оповещения для заданного course_pk и chat_id"""
@@ -241,15 +215,12 @@ class VkApi(AbstractAPI):
             if interval < 0:
                 continue
             task_name = await self.create_key_task(user_id, course_pk, remind_before)
-            task = await self.send_message_later(
+            await self.send_message_later(
                 user_id,
                 dedent(reminder_text),
                 interval=interval,
                 task_name=task_name
             )
-            if self.sending_tasks.get(task_name):
-                self.sending_tasks[task_name].cancel()
-            self.sending_tasks[task_name] = task
 
     @staticmethod
     async def create_key_task(user_id, course_pk, remind_before: Timer | int) -> str:
@@ -260,16 +231,8 @@ class VkApi(AbstractAPI):
         return f'remind_record_vk_{user_id}_{course_pk}_{remind_before_reminder_interval}'
 
     async def get_user(self, user_ids: str):
-        get_users_url = 'https://api.vk.com/method/users.get'
-        params = {
-            'access_token': self.token,
-            'v': '5.131',
-            'user_ids': user_ids
-        }
-        async with self.session.get(get_users_url, params=params) as res:
-            res.raise_for_status()
-            response = json.loads(await res.text())
-            return response.get('response')
+        response = await self.request('users.get', {'user_ids': user_ids})
+        return response.get('response')
 
     def upload_photos_in_album(self, photo_instances, vk_album_id, /):
         """Загрузка фотографий в альбом группы ВК"""
@@ -36,24 +36,31 @@ async def handle_event(api: VkApi, event: Message):
         if user_data:
             api.redis_db.set(f'{user_id}_first_name', user_data[0].get('first_name'))
             api.redis_db.set(f'{user_id}_last_name', user_data[0].get('last_name'))
-    user, create = await Client.objects.async_get_or_create(
-        vk_id=user_id,
-        defaults={
-            'first_name': api.redis_db.get(f'{user_id}_first_name').decode('utf-8'),
-            'last_name': api.redis_db.get(f'{user_id}_last_name').decode('utf-8'),
-            'vk_profile': f'https://vk.com/id{user_id}',
-            'registered_at': timezone.now() + timezone.timedelta(hours=api.hour_offset)
-        }
-    )
-    if create:
-        with open(os.path.join(os.getcwd(), 'bots', 'step_messages.json')) as file:
-            msg_steps = json.load(file)
-        task_name_start = f'vk_register_{user_id}'
-        await api.create_single_step_task(user, task_name_start, msg_steps['register'])
+    # состояние диалога хранится в Redis, запись Client читается только для нового пользователя
+    if user_id in api.registrations:
+        # обработчикам следующих событий нужна сохраненная запись Client
+        await api.registrations.flush()
+    state = api.user_states.get(user_id)
+    if 'bot_state' not in state:
+        user, create = await api.registrations.get_or_create(
+            user_id,
+            defaults={
+                'first_name': api.redis_db.get(f'{user_id}_first_name').decode('utf-8'),
+                'last_name': api.redis_db.get(f'{user_id}_last_name').decode('utf-8'),
+                'vk_profile': f'https://vk.com/id{user_id}',
+                'registered_at': timezone.now() + timezone.timedelta(hours=api.hour_offset)
+            }
+        )
+        if create:
+            with open(os.path.join(os.getcwd(), 'bots', 'step_messages.json')) as file:
+                msg_steps = json.load(file)
+            task_name_start = f'vk_register_{user_id}'
+            await api.create_single_step_task(user, task_name_start, msg_steps['register'])
+        state = api.user_states.load(user_id, user)
     if text in start_buttons or payload.get('button') == 'start':
         user_state = 'START'
     else:
-        user_state = user.bot_state
+        user_state = state['bot_state']
 
     states_functions = {
         'START': start,
@@ -62,10 +69,9 @@ async def handle_event(api: VkApi, event: Message):
         'PHONE': enter_phone,
     }
     state_handler = states_functions[user_state]
-    user.bot_state = await state_handler(api, event)
-    exist_phone = api.redis_db.get(f'{user_id}_phone')
-    user.phone_number = exist_phone.decode('utf-8') if exist_phone else user.phone_number
-    await sync_to_async(user.save)()
+    bot_state = await state_handler(api, event)
+    if bot_state != state['bot_state']:
+        api.user_states.update(user_id, bot_state=bot_state)
 
 
 async def start(api: VkApi, event: Message):
@@ -123,7 +129,9 @@ async def handle_course_info(api: VkApi, event: Message):
     payload = event.payload
     if payload and payload.get('course_pk'):
         course_pk = payload['course_pk']
-        course = await Course.objects.async_get(pk=course_pk)
+        course = await (
+            Course.objects.select_related('program', 'lecture').prefetch_related('images').aget(pk=course_pk)
+        )
         course_date = await sync_to_async(course.scheduled_at.strftime)("%d.%m.%Y")
         course_time = await sync_to_async(course.scheduled_at.strftime)("%H:%M")
         course_images = await sync_to_async(course.images.all)()
@@ -183,8 +191,8 @@ async def handle_course_info(api: VkApi, event: Message):
 async def enter_phone(api: VkApi, event: Message):
     user_id = event.from_id
     payload = event.payload
-    user_instance = await Client.objects.async_get(vk_id=user_id)
-    course_pk = api.redis_db.get(f'{user_id}_current_course')
+    user_instance = await api.registrations.get(user_id)
+    course_pk = api.user_states.get_field(user_id, 'current_course')
     course = await Course.objects.async_get(pk=course_pk)
     user_info = {
         'first_name': api.redis_db.get(f'{user_id}_first_name').decode('utf-8'),
@@ -194,7 +202,7 @@ async def enter_phone(api: VkApi, event: Message):
     if payload and payload.get('check_phone'):
         if payload['check_phone'] == 'true':
             await entry_user_to_course(api, user_id, user_info, user_instance, course)
-            api.redis_db.delete(f'{user_id}_current_course')
+            api.user_states.update(user_id, current_course=None)
             return 'MAIN_MENU'
         # если клиент захотел указать другой номер
         else:
@@ -219,9 +227,11 @@ async def enter_phone(api: VkApi, event: Message):
         phone = event.text
         pattern = re.compile(r'^(\+7|7|8)?[\s\-]?\(?[489][0-9]{2}\)?[\s\-]?[0-9]{3}[\s\-]?[0-9]{2}[\s\-]?[0-9]{2}$')
         if pattern.findall(phone):
-            api.redis_db.delete(f'{user_id}_current_course')
             norm_phone = ''.join(['+7'] + [i for i in phone if i.isdigit()][-10:])
-            api.redis_db.set(f'{user_id}_phone', norm_phone)
+            api.user_states.update(user_id, current_course=None, phone=norm_phone)
+            if str(user_instance.phone_number) != norm_phone:
+                user_instance.phone_number = norm_phone
+                await sync_to_async(Client.objects.filter(pk=user_instance.pk).update)(phone_number=norm_phone)
             await entry_user_to_course(api, user_id, user_info, user_instance, course)
             return 'MAIN_MENU'
         else:
@@ -245,7 +255,7 @@ async def enter_phone(api: VkApi, event: Message):
 async def send_main_menu_answer(api: VkApi, event: Message):
     user_id = event.from_id
     payload = event.payload
-    user_instance = await Client.objects.async_get(vk_id=user_id)
+    user_instance = await api.registrations.get(user_id)
     user_info = {
         'first_name': api.redis_db.get(f'{user_id}_first_name').decode('utf-8'),
         'last_name': api.redis_db.get(f'{user_id}_last_name').decode('utf-8')
@@ -315,7 +325,7 @@ async def send_main_menu_answer(api: VkApi, event: Message):
             await sync_to_async(course.save)()
             logger.warning(f'Клиент https://vk.com/id{user_id} отменил запись на курс **{course.name.upper()}**')
         else:
-            api.redis_db.set(f'{user_id}_current_course', course_pk)
+            api.user_states.update(user_id, current_course=course_pk)
             if user_instance.phone_number:
                 text = f'''
                     Чтобы записаться проверьте ваш номер телефона:
@@ -341,7 +351,7 @@ async def send_main_menu_answer(api: VkApi, event: Message):
 
 async def answer_arbitrary_text(api: VkApi, event: Message):
     user_id = event.from_id
-    user_instance = await Client.objects.async_get(vk_id=user_id)
+    user_instance = await api.registrations.get(user_id)
     vk_profile = user_instance.vk_profile
     admin_msg = f'''
             Сообщение от {vk_profile}
@@ -410,6 +420,5 @@ async def entry_user_to_course(api: VkApi, user_id, user_info, user_instance, co
     await sync_to_async(course.clients.add)(user_instance)
     await sync_to_async(course.save)()
     client_vk = f'https://vk.com/id{user_id}'
-    redis_phone = api.redis_db.get(f'{user_id}_phone')
-    phone = redis_phone.decode('utf-8') if redis_phone else user_instance.phone_number
+    phone = api.user_states.get_field(user_id, 'phone') or user_instance.phone_number
     logger.warning(f'Клиент {name}\n{client_vk}:\nТел: {phone}\nзаписался на курс **{course.name.upper()}**')
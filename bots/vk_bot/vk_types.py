@@ -1,5 +1,7 @@
 from __future__ import annotations
 
+import json
+
 from typing import Union, Any
 from enum import Enum
 from pydantic import BaseModel, Field, Json
@@ -68,6 +70,10 @@ class Message(BaseModel):
     keyboard: dict | None = None
     reply_message: dict | None = None
     action: dict | None = None
+    event_id: str | None = Field(
+        default=None,
+        description='Идентификатор события message_event, если сообщение создано нажатием callback-кнопки',
+    )
 
     class Config:
         use_enum_values = True
@@ -94,6 +100,39 @@ class ReplyMessageUpdate(BaseModel):
     object: Message
 
 
+class MessageEvent(BaseModel):
+    """Нажатие callback-кнопки.
+
+    See here: https://dev.vk.com/ru/api/community-events/json-schema#message_event
+    """
+
+    user_id: int
+    peer_id: int
+    event_id: str
+    payload: dict[str, Any] = Field(default={})
+    conversation_message_id: int | None = None
+
+    def to_message(self) -> Message:
+        """Представление нажатия в виде сообщения для общего обработчика событий"""
+
+        return Message(
+            from_id=self.user_id,
+            peer_id=self.peer_id,
+            conversation_message_id=self.conversation_message_id,
+            text='',
+            payload=json.dumps(self.payload),
+            event_id=self.event_id,
+        )
+
+
+class MessageEventUpdate(BaseModel):
+    type: str
+    v: str
+    event_id: str
+    group_id: int
+    object: MessageEvent
+
+
 class Update(BaseModel):
     type: str
     v: str
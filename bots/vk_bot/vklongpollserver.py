@@ -12,32 +12,51 @@ logger = logging.getLogger('telegram')
 class VkLongPollServer(LongPollServer):
     """Класс для получения событий от сервера Vk и отправки их в главный обработчик событий handle_event"""
 
-    url = 'https://api.vk.com/method/groups.getLongPollServer'
-
     def __init__(
             self,
             api: VkApi,
             group_id: int,
-            handle_event: Callable[[VkApi, vk_types.Message], Awaitable[None]]
+            handle_event: Callable[[VkApi, vk_types.Message], Awaitable[None]],
+            **kwargs
     ):
-        super().__init__(api, handle_event)
-        self.vk_api_params = vk_types.VkApiParams(access_token=api.token, group_id=group_id).dict()
+        super().__init__(api, handle_event, **kwargs)
+        self.group_id = group_id
         self.longpoll_server_params = None
 
     async def get_params(self):
-        async with self.api.session.get(self.url, params=self.vk_api_params) as res:
-            res.raise_for_status()
-            response = vk_types.ServerResponse.parse_raw(await res.text())
-        return response.response
+        response = await self.api.request('groups.getLongPollServer', {'group_id': self.group_id})
+        return vk_types.ServerResponse.parse_obj(response).response
 
     async def init_tasks(self):
         await self.api.create_tasks_from_db(hour_interval=2, minute_offset=10)
 
     async def update_tasks(self):
-        await self.api.update_course_tasks_triggered_admin('update_vk_tasks')
+        await self.api.apply_admin_events()
+        await self.api.flush_user_states()
         await self.api.create_message_tasks('vk_create_message')
 
-    async def get_event(self) -> Awaitable[vk_types.NewMessageUpdate | None]:
+    async def dispatch_event(self, event: vk_types.Message) -> Awaitable[None]:
+        if event.event_id:
+            # Без ответа на message_event у пользователя продолжает крутиться индикатор на кнопке
+            await self.api.send_message_event_answer(event.event_id, event.from_id, event.peer_id)
+        await super().dispatch_event(event)
+
+    def get_chat_id(self, event: vk_types.Message) -> int:
+        return event.peer_id or event.from_id
+
+    @staticmethod
+    def parse_update(event: vk_types.Update | dict) -> list[vk_types.Message]:
+        """Сообщения из события Long Poll или Callback API"""
+
+        if isinstance(event, dict):
+            event = vk_types.Update.parse_obj(event)
+        if event.type == 'message_new':
+            return [vk_types.NewMessageUpdate.parse_obj(event).object.message]
+        if event.type == 'message_event':
+            return [vk_types.MessageEventUpdate.parse_obj(event).object.to_message()]
+        return []
+
+    async def get_events(self) -> Awaitable[list[vk_types.Message]]:
         if self.start:
             self.longpoll_server_params = await self.get_params()
             self.start = False
@@ -58,9 +77,6 @@ class VkLongPollServer(LongPollServer):
             elif update.failed == 3:
                 res = await self.get_params()
                 self.longpoll_server_params.key, self.longpoll_server_params.ts = res.key, res.ts
-            return
+            return []
         self.longpoll_server_params.ts = update.ts
-        for event in update.updates:
-            if event.type != 'message_new':
-                continue
-            return vk_types.NewMessageUpdate.parse_obj(event).object.message
+        return [message for event in update.updates for message in self.parse_update(event)]
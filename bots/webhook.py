@@ -0,0 +1,131 @@
+import asyncio
+import hmac
+import json
+import logging
+
+from aiohttp import web
+from contextlib import AsyncExitStack
+from pydantic import ValidationError
+from typing import Awaitable
+from .general import LongPollServer, AsyncSession, UpdateEvent
+from .tg_bot.tglongpollserver import TgLongPollServer
+from .vk_bot.vklongpollserver import VkLongPollServer
+
+logger = logging.getLogger('telegram')
+
+
+class WebhookServer:
+    """
+    Приём событий Telegram (webhook) и VK (Callback API) по HTTP.
+
+    События разбираются теми же моделями tg_types/vk_types, что и в режиме
+    Long Poll, и передаются в диспетчер соответствующего сервера.
+    Повторные доставки отсекаются по идентификатору события в Redis,
+    поэтому несколько процессов можно держать за балансировщиком.
+    """
+
+    tg_path = '/tg/webhook'
+    vk_path = '/vk/callback'
+
+    def __init__(
+            self,
+            tg_connect: TgLongPollServer = None,
+            vk_connect: VkLongPollServer = None,
+            tg_secret: str = None,
+            vk_secret: str = None,
+            vk_confirmation_code: str = None,
+            update_interval: int = 5,
+            dedup_ttl: int = 3600,
+    ):
+        self.tg_connect = tg_connect
+        self.vk_connect = vk_connect
+        self.tg_secret = tg_secret
+        self.vk_secret = vk_secret
+        self.vk_confirmation_code = vk_confirmation_code
+        self.update_interval = update_interval
+        self.dedup_ttl = dedup_ttl
+        self.app = web.Application()
+        if tg_connect:
+            self.app.router.add_post(self.tg_path, self.handle_tg)
+        if vk_connect:
+            self.app.router.add_post(self.vk_path, self.handle_vk)
+
+    @property
+    def connects(self) -> list[LongPollServer]:
+        return [connect for connect in (self.tg_connect, self.vk_connect) if connect]
+
+    @staticmethod
+    def check_secret(expected: str | None, received: str | None) -> bool:
+        if not expected:
+            return True
+        return bool(received) and hmac.compare_digest(expected, received)
+
+    def is_new_event(self, connect: LongPollServer, event_id) -> bool:
+        """Отметка о получении события. False - событие уже было получено другим запросом"""
+
+        if event_id is None or not connect.api.redis_db:
+            return True
+        key = f'webhook_{connect.api.platform}_{event_id}'
+        return bool(connect.api.redis_db.set(key, 1, nx=True, ex=self.dedup_ttl))
+
+    async def feed(self, connect: LongPollServer, events: list) -> None:
+        for event in events:
+            await connect.dispatcher.put(event)
+
+    async def handle_tg(self, request: web.Request) -> web.Response:
+        if not self.check_secret(self.tg_secret, request.headers.get('X-Telegram-Bot-Api-Secret-Token')):
+            return web.Response(status=403)
+        try:
+            update_data = await request.json()
+            events = self.tg_connect.parse_update(update_data)
+        except (json.JSONDecodeError, ValidationError) as exc:
+            logger.warning(f'Некорректное обновление TG: {exc}')
+            return web.Response(status=400)
+        if self.is_new_event(self.tg_connect, update_data.get('update_id')):
+            await self.feed(self.tg_connect, events)
+        return web.Response(text='ok')
+
+    async def handle_vk(self, request: web.Request) -> web.Response:
+        try:
+            event_data = await request.json()
+        except json.JSONDecodeError:
+            return web.Response(status=400)
+        if not self.check_secret(self.vk_secret, event_data.get('secret')):
+            return web.Response(status=403)
+        if event_data.get('type') == 'confirmation':
+            return web.Response(text=self.vk_confirmation_code or '')
+        try:
+            events = self.vk_connect.parse_update(event_data)
+        except ValidationError as exc:
+            logger.warning(f'Некорректное событие VK: {exc}')
+            # VK повторяет доставку при любом ответе, кроме "ok"
+            return web.Response(text='ok')
+        if self.is_new_event(self.vk_connect, event_data.get('event_id')):
+            await self.feed(self.vk_connect, events)
+        return web.Response(text='ok')
+
+    async def update_tasks(self, connect: LongPollServer) -> Awaitable[None]:
+        """Периодическое обновление отложенных задач, которое в режиме Long Poll идет после каждого запроса"""
+
+        while True:
+            async with UpdateEvent(connect):
+                await connect.update_tasks()
+            await asyncio.sleep(self.update_interval)
+
+    async def serve(self, host: str = '0.0.0.0', port: int = 8080) -> Awaitable[None]:
+        async with AsyncExitStack() as stack:
+            for connect in self.connects:
+                await stack.enter_async_context(AsyncSession(connect))
+            update_loops = [asyncio.ensure_future(self.update_tasks(connect)) for connect in self.connects]
+            runner = web.AppRunner(self.app)
+            await runner.setup()
+            site = web.TCPSite(runner, host, port)
+            await site.start()
+            try:
+                await asyncio.Event().wait()
+            finally:
+                for update_loop in update_loops:
+                    update_loop.cancel()
+                for connect in self.connects:
+                    await connect.dispatcher.stop()
+                await runner.cleanup()
@@ -1,8 +1,5 @@
-import pickle
 import random
-import json
 
-from django.utils import timezone
 from django.conf import settings
 from django.contrib import admin
 from django import forms
@@ -13,13 +10,13 @@ from courses.models import (
 )
 from adminsortable2.admin import SortableAdminMixin, SortableTabularInline, SortableAdminBase
 from django.forms import CheckboxSelectMultiple
-from django.db import models
+from django.db import models, transaction
 from django.db.models import Count, Value
 from import_export import resources
 from import_export.fields import Field
 from import_export.admin import ExportMixin
-from bots import VkApi
-from courses.management.commands._get_preview import get_preview
+from bots import VkApi, change_feed
+from courses.derivatives import update_previews
 # from .tasks import course_admin_save_formset, upgrade_courses_images, upgrade_course_image
 
 
@@ -146,19 +143,6 @@ class ProgramAdmin(SortableAdminMixin, admin.ModelAdmin, PreviewMixin):
     prepopulated_fields = {'slug': ('title',)}
     list_display = ['title', 'get_image_preview', 'short_description', 'position']
     readonly_fields = ['get_image_preview']
-    redis = settings.REDIS_DB
-
-    def save_model(self, request, obj, form, change):
-        super().save_model(request, obj, form, change)
-        self.redis.set('programs', pickle.dumps(0))
-
-    def delete_queryset(self, request, queryset):
-        super().delete_queryset(request, queryset)
-        self.redis.set('programs', pickle.dumps(0))
-
-    def delete_model(self, request, obj):
-        super().delete_model(request, obj)
-        self.redis.set('programs', pickle.dumps(0))
 
 
 @admin.register(Office)
@@ -219,49 +203,40 @@ class CourseAdmin(SortableAdminBase, admin.ModelAdmin):
             .prefetch_related('clients', 'images')
         )
 
-    def __update_bot_trigger_keys(
-            self,
-            course: Course = None,
-            delete_course: bool = False,
-            deleted_tasks: list = None
-    ):
-        """Тригер обновления отложенных задач отправки сообщений"""
-
-        if self.redis.get('update_vk_tasks') is None:
-            self.redis.set('update_vk_tasks', json.dumps({'course_pks': [], 'deleted_tasks': []}))
-        if self.redis.get('update_tg_tasks') is None:
-            self.redis.set('update_tg_tasks', json.dumps({'course_pks': [], 'deleted_tasks': []}))
-        vk_tasks_courses = json.loads(self.redis.get('update_vk_tasks'))['course_pks']
-        tg_tasks_courses = json.loads(self.redis.get('update_tg_tasks'))['course_pks']
-        all_deleted_tasks = json.loads(self.redis.get('update_vk_tasks'))['deleted_tasks']
-        if deleted_tasks:
-            all_deleted_tasks.extend(deleted_tasks)
-        if delete_course:
-            time_offset = 5 * 3600
-            for client in course.clients.all():
-                prefix = 'remind_record_vk' if client.vk_id else 'remind_record_tg'
-                user_id = client.vk_id or client.telegram_id
-                time_to_start = (course.scheduled_at - timezone.now()).total_seconds()
-                for remind_before in course.reminder_intervals.all():
-                    interval = time_to_start - time_offset - remind_before.reminder_interval * 3600
-                    if interval < 0:
-                        continue
-                    all_deleted_tasks.append(
-                        f'{prefix}_{user_id}_{course.pk}_{remind_before.reminder_interval}'
-                    )
-        if course:
-            vk_tasks_courses.append(course.pk)
-            tg_tasks_courses.append(course.pk)
-        updated_vk_tasks = {'course_pks': vk_tasks_courses, 'deleted_tasks': all_deleted_tasks}
-        updated_tg_tasks = {'course_pks': tg_tasks_courses, 'deleted_tasks': all_deleted_tasks}
-        self.redis.set('update_vk_tasks', json.dumps(updated_vk_tasks))
-        self.redis.set('update_tg_tasks', json.dumps(updated_tg_tasks))
+    def __get_remind_task_names(self, course: Course, course_clients=None, reminder_intervals=None):
+        """Имена отложенных задач напоминаний о курсе по платформам"""
+
+        task_names = {platform: [] for platform in change_feed.PLATFORMS}
+        if course_clients is None:
+            course_clients = [position.client for position in course.positions.select_related('client')]
+        if reminder_intervals is None:
+            reminder_intervals = [timer.reminder_interval for timer in course.reminder_intervals.all()]
+        for client in course_clients:
+            client_platform = change_feed.get_client_platform(client)
+            if not client_platform:
+                continue
+            platform, user_id = client_platform
+            task_names[platform].extend(
+                change_feed.get_remind_task_name(platform, user_id, course.pk, reminder_interval)
+                for reminder_interval in reminder_intervals
+            )
+        return task_names
+
+    def __publish_admin_event(self, event_type: str, course_pk: int, client_pk: int = None, task_names=None):
+        """Событие для ботов об изменении отложенных задач, отправляется после фиксации транзакции"""
+
+        transaction.on_commit(
+            lambda: change_feed.publish_admin_event(self.redis, event_type, course_pk, client_pk, task_names)
+        )
 
     def save_model(self, request, obj, form, change):
+        # Таймеры курса сохраняются позже в save_related, поэтому здесь в базе еще старые значения
+        if change and set(form.changed_data).intersection({'reminder_intervals', 'scheduled_at'}):
+            event_type = (
+                change_feed.COURSE_RESCHEDULED if 'scheduled_at' in form.changed_data else change_feed.TIMER_CHANGED
+            )
+            self.__publish_admin_event(event_type, obj.pk, task_names=self.__get_remind_task_names(obj))
         super().save_model(request, obj, form, change)
-        self.redis.set('all_courses', pickle.dumps(0))
-        if set(form.changed_data).intersection({'reminder_intervals', 'scheduled_at'}):
-            self.__update_bot_trigger_keys(obj)
         if not obj.vk_album_id:
             album = self.vk_api.create_vk_album(obj)
             obj.vk_album_id = album['response']['id']
@@ -271,9 +246,7 @@ class CourseAdmin(SortableAdminBase, admin.ModelAdmin):
         # upgrade_courses_images.delay(obj)
         images = obj.images.all()
         if images:
-            for preview in images:
-                get_preview(preview)
-                get_preview(preview, preview_attr='big_preview', width=370, height=320)
+            update_previews(images)
             vk_album_id = obj.vk_album_id
             upload_photos = get_upload_photos(images)
             if upload_photos:
@@ -281,56 +254,47 @@ class CourseAdmin(SortableAdminBase, admin.ModelAdmin):
 
     def save_related(self, request, form, formsets, change):
         super().save_related(request, form, formsets, change)
-        # Обновляем отложенные задачи, если добавлен клиент через админ-панель
-        breaker = False
+        # Обновляем отложенные задачи, если добавлены клиенты через админ-панель
         for formset in formsets:
             for cleaned_data in formset.cleaned_data:
                 if not cleaned_data.get('client'):
                     break
-                if cleaned_data['id'] is None:
-                    course = cleaned_data['course']
-                    self.__update_bot_trigger_keys(course)
-                    breaker = True
-                    break
-            if breaker:
-                break
+                if cleaned_data['id'] is None and not cleaned_data.get('DELETE'):
+                    self.__publish_admin_event(
+                        change_feed.CLIENT_ENROLLED, cleaned_data['course'].pk, cleaned_data['client'].pk
+                    )
 
     def delete_model(self, request, obj):
-        self.__update_bot_trigger_keys(obj, delete_course=True)
+        self.__publish_admin_event(change_feed.COURSE_DELETED, obj.pk, task_names=self.__get_remind_task_names(obj))
         super().delete_model(request, obj)
-        self.redis.set('all_courses', pickle.dumps(0))
 
     def delete_queryset(self, request, queryset):
         for course in queryset:
-            self.__update_bot_trigger_keys(course, delete_course=True)
+            self.__publish_admin_event(
+                change_feed.COURSE_DELETED, course.pk, task_names=self.__get_remind_task_names(course)
+            )
         super().delete_queryset(request, queryset)
-        self.redis.set('all_courses', pickle.dumps(0))
 
     def save_formset(self, request, form, formset, change):
         super().save_formset(request, form, formset, change)
         if formset.deleted_objects:
-            update_bot_trigger_keys = True
             for deleted_object in formset.deleted_objects:
                 if hasattr(deleted_object, 'image_vk_id') and deleted_object.image_vk_id:
                     self.vk_api.delete_photos(deleted_object)
                 # Обновляем отложенные задачи, если клиенты удалены с курса
-                if isinstance(deleted_object, CourseClient) and update_bot_trigger_keys:
-                    deleted_tasks = []
-                    for remind_before in deleted_object.course.reminder_intervals.all():
-                        prefix = 'remind_record_vk' if deleted_object.client.vk_id else 'remind_record_tg'
-                        user_id = deleted_object.client.vk_id or deleted_object.client.telegram_id
-                        deleted_tasks.append(
-                            f'{prefix}_{user_id}_{deleted_object.course.pk}_{remind_before.reminder_interval}'
-                        )
-                    update_bot_trigger_keys = False
-                    self.__update_bot_trigger_keys(deleted_tasks=deleted_tasks)
+                if isinstance(deleted_object, CourseClient):
+                    course = deleted_object.course
+                    self.__publish_admin_event(
+                        change_feed.CLIENT_REMOVED,
+                        course.pk,
+                        deleted_object.client.pk,
+                        task_names=self.__get_remind_task_names(course, course_clients=[deleted_object.client])
+                    )
         instances = formset.save(commit=False)
         # course_admin_save_formset.delay(instances)
         images = [image for image in instances if isinstance(image, CourseImage)]
         if images:
-            for preview in images:
-                get_preview(preview)
-                get_preview(preview, preview_attr='big_preview', width=370, height=320)
+            update_previews(images)
             course_obj = images[0].course
             vk_album_id = course_obj.vk_album_id
             upload_photos = get_upload_photos(images)
@@ -372,8 +336,7 @@ class ImageAdmin(SortableAdminMixin, admin.ModelAdmin, PreviewMixin):
     def save_model(self, request, obj, form, change):
         super().save_model(request, obj, form, change)
         # upgrade_course_image.delay(obj)
-        get_preview(obj)
-        get_preview(obj, preview_attr='big_preview', width=370, height=320)
+        update_previews([obj])
         vk_album_id = obj.course.vk_album_id
 
         if not obj.image_vk_id and obj.upload_vk:
@@ -431,19 +394,6 @@ class GraduatePhotoAdmin(admin.ModelAdmin, PreviewMixin):
     list_display = ['id', 'title', 'get_image_preview']
     readonly_fields = ['get_image_preview']
     list_editable = ['title']
-    redis = settings.REDIS_DB
-
-    def save_model(self, request, obj, form, change):
-        super().save_model(request, obj, form, change)
-        self.redis.set('graduate_photos', pickle.dumps(0))
-
-    def delete_model(self, request, obj):
-        super().delete_model(request, obj)
-        self.redis.set('graduate_photos', pickle.dumps(0))
-
-    def delete_queryset(self, request, queryset):
-        super().delete_queryset(request, queryset)
-        self.redis.set('graduate_photos', pickle.dumps(0))
 
 
 @admin.register(Timer)
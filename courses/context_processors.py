@@ -1,17 +1,10 @@
-import smtplib
-import pickle
-
-from django.db.models import Window
-from django.db.models.functions import DenseRank, Random
 from django.conf import settings
 from courses.forms import SubscribeForm
-from courses.models import CourseImage, Program
-from django.core.mail import send_mail, BadHeaderError
+from courses.models import Program
 from django.contrib import messages
-from django.shortcuts import HttpResponse
-from eyelash_courses.logger import send_message as send_tg_msg
 from textwrap import dedent
-from .general_functions import set_random_images, get_redis_or_get_db
+from .general_functions import get_random_images, get_redis_or_get_db
+from .outbox import enqueue_form_submission
 
 
 # from .tasks import send_message_task
@@ -29,27 +22,8 @@ def get_footer_variables(request):
                 Email: {from_email.replace('@', '_собака_')}
                 '''
             # send_message_task.delay(text=text)
-            try:
-                send_tg_msg(
-                    token=settings.TG_LOGGER_BOT,
-                    chat_id=settings.TG_LOGGER_CHAT,
-                    msg=dedent(text)
-                )
-                messages.success(request, 'Отправлено!')
-                send_mail(
-                    f'Подписка на новости',
-                    dedent(text),
-                    settings.EMAIL_HOST_USER,
-                    settings.RECIPIENTS_EMAIL
-                )
-            except BadHeaderError:
-                return HttpResponse('Ошибка в теме письма.')
-            except smtplib.SMTPDataError as err:
-                send_tg_msg(
-                    token=settings.TG_LOGGER_BOT,
-                    chat_id=settings.TG_LOGGER_CHAT,
-                    msg=str(err)
-                )
+            enqueue_form_submission('Подписка на новости', dedent(text))
+            messages.success(request, 'Отправлено!')
         else:
             error_msg = {'email': 'Введите правильный email'}
             messages.error(request, error_msg)
@@ -57,14 +31,7 @@ def get_footer_variables(request):
     else:
         subscribe_form = SubscribeForm()
 
-    redis = settings.REDIS_DB
-    part_random_images = redis.get('random_images')
-    height = redis.get('height_images')
-    if part_random_images and height:
-        part_random_images = pickle.loads(part_random_images)
-        height = int(height)
-    else:
-        part_random_images, height = set_random_images(13)
+    part_random_images, height = get_random_images(13)
 
     base_data = {
         'random_images': part_random_images,
@@ -0,0 +1,400 @@
+import hashlib
+import os
+import time
+
+from collections import defaultdict
+from concurrent.futures import ProcessPoolExecutor
+from datetime import timedelta
+from io import BytesIO
+from django.apps import apps
+from django.core.files.storage import default_storage
+from django.db import models
+from django.utils import timezone
+from PIL import Image
+from typing import Dict, Iterable, List, Set, Tuple
+from courses.models import ImageDerivative
+
+# Превью изображений курса: поле модели -> максимальные ширина и высота
+PREVIEW_SIZES = {
+    'image_preview': (231, 130),
+    'big_preview': (370, 320),
+}
+# Качество JPEG по умолчанию в Pillow
+DEFAULT_QUALITY = 75
+DERIVATIVES_DIR = 'derivatives'
+# Формат -> (расширение файла, MIME-тип, качество адаптивных вариантов)
+FORMATS = {
+    'AVIF': ('avif', 'image/avif', 50),
+    'WEBP': ('webp', 'image/webp', 70),
+    'JPEG': ('jpg', 'image/jpeg', DEFAULT_QUALITY),
+}
+# Адаптивные варианты: группа -> рамки (ширина, высота) для srcset.
+# Превью - в 1x и 2x, фото галереи курса - по ширине экрана
+RESPONSIVE_GROUPS = {
+    **{
+        attr: [(width * scale, height * scale) for scale in (1, 2)]
+        for attr, (width, height) in PREVIEW_SIZES.items()
+    },
+    'image': [(width, width) for width in (480, 960, 1440)],
+}
+
+# Параметры производного изображения: (ширина, высота, качество, формат)
+Size = Tuple[int, int, int, str]
+
+
+def get_file_hash(path: str) -> str:
+    digest = hashlib.sha1()
+    with open(path, 'rb') as file:
+        for chunk in iter(lambda: file.read(1 << 20), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def get_derivative_name(file_hash: str, size: Size) -> str:
+    """
+    Имя файла в MEDIA_ROOT определяется только содержимым исходника и размером:
+    одинаковые фото разных курсов используют один файл превью
+    """
+
+    width, height, quality, image_format = size
+    return f'{DERIVATIVES_DIR}/{file_hash[:2]}/{file_hash}_{width}x{height}_q{quality}.{FORMATS[image_format][0]}'
+
+
+def get_source_hash(name: str) -> str | None:
+    """Хэш исходника по имени производного изображения, None - файл не из хранилища производных"""
+
+    if not name or not name.startswith(f'{DERIVATIVES_DIR}/'):
+        return None
+    return os.path.basename(name).split('_', 1)[0]
+
+
+def get_available_formats() -> List[str]:
+    """
+    Форматы, которые умеет записывать установленный Pillow, от более компактного к JPEG.
+    AVIF появляется, когда его поддерживает Pillow (или подключен плагин pillow-avif)
+    """
+
+    Image.init()
+    return [image_format for image_format in FORMATS if image_format in Image.SAVE]
+
+
+def get_responsive_sizes() -> Set[Size]:
+    return {
+        (width, height, FORMATS[image_format][2], image_format)
+        for boxes in RESPONSIVE_GROUPS.values()
+        for width, height in boxes
+        for image_format in get_available_formats()
+    }
+
+
+def render_derivatives(source_path: str, sizes: Iterable[Size]) -> Dict[Size, Tuple[bytes, int, int]]:
+    """
+    Все превью одного исходника за одно декодирование.
+    JPEG декодируется сразу в уменьшенном масштабе (draft) не меньше самого большого превью,
+    каждое превью затем уменьшается thumbnail, который использует reduce для крупных шагов
+    """
+
+    sizes = list(sizes)
+    max_width = max(size[0] for size in sizes)
+    max_height = max(size[1] for size in sizes)
+    with Image.open(source_path) as img:
+        if img.format == 'JPEG':
+            img.draft('RGB', (max_width, max_height))
+        img.load()
+        if img.mode not in ('RGB', 'L'):
+            img = img.convert('RGB')
+        rendered = {}
+        resized = {}
+        for width, height, quality, image_format in sizes:
+            # одна рамка в разных форматах уменьшается один раз
+            if (width, height) not in resized:
+                resized[(width, height)] = img.copy()
+                resized[(width, height)].thumbnail((width, height))
+            preview = resized[(width, height)]
+            buffer = BytesIO()
+            if image_format == 'JPEG':
+                preview.save(buffer, format=image_format, quality=quality, optimize=True)
+            else:
+                preview.save(buffer, format=image_format, quality=quality)
+            rendered[(width, height, quality, image_format)] = (buffer.getvalue(), *preview.size)
+    return rendered
+
+
+def write_derivatives(source_path: str, targets: Dict[Size, str]) -> Dict[Size, Tuple[int, int, int]]:
+    """
+    Создание файлов превью. targets: параметры -> путь файла.
+    Выполняется в процессе пула, возвращает размер файла, ширину и высоту изображения
+    """
+
+    written = {}
+    for size, (content, width, height) in render_derivatives(source_path, targets).items():
+        path = targets[size]
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        tmp_path = f'{path}.{os.getpid()}.tmp'
+        with open(tmp_path, 'wb') as file:
+            file.write(content)
+        os.replace(tmp_path, path)
+        written[size] = (len(content), width, height)
+    return written
+
+
+class DerivativeStats:
+
+    def __init__(self):
+        self.total = 0
+        self.skipped = 0
+        self.reused = 0
+        self.built = 0
+        self.failed = 0
+        self.written_bytes = 0
+        self.started_at = time.monotonic()
+
+    def as_dict(self) -> dict:
+        elapsed = time.monotonic() - self.started_at
+        return {
+            'total': self.total,
+            'skipped': self.skipped,
+            'reused': self.reused,
+            'built': self.built,
+            'failed': self.failed,
+            'written_bytes': self.written_bytes,
+            'seconds': round(elapsed, 3),
+            'images_per_second': round(self.built / elapsed, 2) if elapsed else 0,
+        }
+
+
+def get_manifest(file_hashes: Iterable[str]) -> Dict[Tuple[str, Size], str]:
+    """Уже созданные производные изображения исходников одним запросом"""
+
+    rows = ImageDerivative.objects.filter(
+        source_hash__in=set(file_hashes),
+    ).values_list('source_hash', 'width', 'height', 'quality', 'format', 'path')
+    return {
+        (file_hash, (width, height, quality, image_format)): path
+        for file_hash, width, height, quality, image_format, path in rows
+    }
+
+
+def build_derivatives(
+        sources: Dict[str, Set[Size]],
+        workers: int = None,
+        force: bool = False,
+        stats: DerivativeStats = None,
+        progress=None,
+) -> Dict[Tuple[str, Size], str]:
+    """
+    Производные изображения исходников. sources: путь исходника -> размеры.
+    Возвращает имена файлов в MEDIA_ROOT по ключу (путь исходника, размер).
+
+    Изображение, которое есть в манифесте и на диске, не пересоздается.
+    Новые файлы создаются в процессах пула (workers=1 - в текущем процессе),
+    каждый исходник декодируется один раз, записи манифеста добавляются одним bulk_create
+    """
+
+    stats = stats or DerivativeStats()
+    hashes = {source_path: get_file_hash(source_path) for source_path in sources}
+    created = {} if force else {
+        key: path for key, path in get_manifest(hashes.values()).items() if default_storage.exists(path)
+    }
+
+    # исходники с одинаковым содержимым декодируются один раз
+    jobs: Dict[str, Tuple[str, Dict[Size, str]]] = {}
+    for source_path, sizes in sources.items():
+        file_hash = hashes[source_path]
+        for size in sizes:
+            if (file_hash, size) in created:
+                stats.reused += 1
+                continue
+            targets = jobs.setdefault(file_hash, (source_path, {}))[1]
+            targets[size] = default_storage.path(get_derivative_name(file_hash, size))
+
+    rows = []
+
+    def collect(file_hash, written):
+        for size, (file_size, image_width, image_height) in written.items():
+            created[(file_hash, size)] = get_derivative_name(file_hash, size)
+            width, height, quality, image_format = size
+            rows.append(ImageDerivative(
+                source_hash=file_hash,
+                width=width,
+                height=height,
+                quality=quality,
+                format=image_format,
+                path=created[(file_hash, size)],
+                size=file_size,
+                image_width=image_width,
+                image_height=image_height,
+            ))
+        stats.built += 1
+        stats.written_bytes += sum(file_size for file_size, image_width, image_height in written.values())
+
+    if workers is None:
+        workers = min(len(jobs), os.cpu_count() or 1)
+    if workers <= 1 or len(jobs) <= 1:
+        for processed, (file_hash, (source_path, targets)) in enumerate(jobs.items(), start=1):
+            try:
+                collect(file_hash, write_derivatives(source_path, targets))
+            except OSError:
+                stats.failed += 1
+            if progress:
+                progress(processed, len(jobs), stats)
+    else:
+        with ProcessPoolExecutor(max_workers=workers) as executor:
+            futures = [
+                (file_hash, executor.submit(write_derivatives, source_path, targets))
+                for file_hash, (source_path, targets) in jobs.items()
+            ]
+            # записи манифеста делает текущий процесс: соединение с базой в процессы пула не передается
+            for processed, (file_hash, future) in enumerate(futures, start=1):
+                try:
+                    collect(file_hash, future.result())
+                except OSError:
+                    stats.failed += 1
+                if progress:
+                    progress(processed, len(jobs), stats)
+    if rows:
+        if force:
+            ImageDerivative.objects.filter(path__in=[row.path for row in rows]).delete()
+        ImageDerivative.objects.bulk_create(rows, ignore_conflicts=True)
+    return {
+        (source_path, size): created[(hashes[source_path], size)]
+        for source_path, sizes in sources.items()
+        for size in sizes
+        if (hashes[source_path], size) in created
+    }
+
+
+def update_previews(
+        objs: Iterable,
+        sizes: Dict[str, Tuple[int, int]] = None,
+        image_attr: str = 'image',
+        quality: int = DEFAULT_QUALITY,
+        workers: int = None,
+        force: bool = False,
+        responsive: bool = None,
+        progress=None,
+) -> DerivativeStats:
+    """
+    Создание превью для экземпляров модели и запись их в поля модели.
+
+    sizes - поле превью -> (ширина, высота), по умолчанию PREVIEW_SIZES;
+    responsive - создать также адаптивные варианты для srcset (get_responsive_sizes),
+    по умолчанию - только для превью по умолчанию (фото курсов);
+    image_attr - поле исходного изображения;
+    workers - число процессов, при workers=1 или одном исходнике превью создаются в текущем процессе;
+    force - пересоздать превью, даже если исходник не изменился;
+    progress - функция (обработано, всего, DerivativeStats), вызывается после каждого созданного исходника.
+
+    Экземпляр сохраняется только с изменившимися полями. Прежние файлы превью не удаляются:
+    их могут использовать другие записи, неиспользуемые файлы удаляет collect_garbage
+    """
+
+    if responsive is None:
+        responsive = sizes is None
+    sizes = sizes or PREVIEW_SIZES
+    required = {(width, height, quality, 'JPEG') for width, height in sizes.values()}
+    if responsive:
+        required |= get_responsive_sizes()
+    stats = DerivativeStats()
+    sources: Dict[str, Set[Size]] = {}
+    pending: List = []
+    for obj in objs:
+        stats.total += 1
+        source = getattr(obj, image_attr, None)
+        if not (source and os.path.isfile(source.path)):
+            stats.skipped += 1
+            continue
+        sources.setdefault(source.path, set()).update(required)
+        pending.append((obj, source.path))
+    if not sources:
+        return stats
+
+    names = build_derivatives(sources, workers=workers, force=force, stats=stats, progress=progress)
+    for obj, source_path in pending:
+        changed = []
+        for attr, (width, height) in sizes.items():
+            name = names.get((source_path, (width, height, quality, 'JPEG')))
+            if name and getattr(obj, attr).name != name:
+                getattr(obj, attr).name = name
+                changed.append(attr)
+        if changed:
+            obj.save(update_fields=changed)
+    return stats
+
+
+def get_referenced_names() -> Set[str]:
+    """Имена файлов во всех полях ImageField приложения courses"""
+
+    referenced = set()
+    for model in apps.get_app_config('courses').get_models():
+        for field in model._meta.get_fields():
+            if isinstance(field, models.ImageField):
+                referenced.update(
+                    model.objects.exclude(**{field.name: ''}).exclude(**{f'{field.name}__isnull': True})
+                    .values_list(field.name, flat=True)
+                )
+    return referenced
+
+
+def collect_garbage(grace: timedelta = timedelta(hours=1), dry_run: bool = False) -> Dict[str, int]:
+    """
+    Удаление производных изображений, на которые не ссылается ни одно поле модели.
+    Адаптивные варианты хранятся, пока используется превью того же исходника.
+    Записи моложе grace не трогаются: их превью могут еще не быть записаны в поля модели
+    """
+
+    referenced = get_referenced_names()
+    referenced_hashes = {get_source_hash(name) for name in referenced} - {None}
+    unused = [
+        (pk, path, size)
+        for pk, path, size, source_hash in ImageDerivative.objects
+        .filter(created_at__lt=timezone.now() - grace)
+        .values_list('pk', 'path', 'size', 'source_hash')
+        .iterator(chunk_size=2000)
+        if path not in referenced and source_hash not in referenced_hashes
+    ]
+    if not dry_run:
+        for pk, path, size in unused:
+            default_storage.delete(path)
+        pks = [pk for pk, path, size in unused]
+        for start in range(0, len(pks), 1000):
+            ImageDerivative.objects.filter(pk__in=pks[start:start + 1000]).delete()
+    return {'deleted': len(unused), 'freed_bytes': sum(size for pk, path, size in unused)}
+
+
+def get_srcsets(source_hashes: Iterable[str]) -> Dict[str, Dict[str, dict]]:
+    """
+    Данные для <picture> по хэшам исходников одним запросом:
+    хэш -> группа RESPONSIVE_GROUPS -> {'sources': [{'type', 'srcset'}, ...], 'srcset': srcset JPEG}.
+    Варианты с одинаковой фактической шириной (исходник меньше рамки) входят в srcset один раз
+    """
+
+    source_hashes = set(source_hashes) - {None}
+    if not source_hashes:
+        return {}
+    groups = {box: group for group, boxes in RESPONSIVE_GROUPS.items() for box in boxes}
+    candidates = defaultdict(dict)
+    rows = ImageDerivative.objects.filter(source_hash__in=source_hashes).order_by('width').values_list(
+        'source_hash', 'width', 'height', 'quality', 'format', 'path', 'image_width'
+    )
+    for source_hash, width, height, quality, image_format, path, image_width in rows:
+        group = groups.get((width, height))
+        if group is None or quality != FORMATS[image_format][2] or not image_width:
+            continue
+        candidates[(source_hash, group, image_format)].setdefault(image_width, path)
+
+    srcsets = defaultdict(dict)
+    # более компактные форматы идут первыми: браузер берет первый поддерживаемый <source>
+    format_order = list(FORMATS)
+    for (source_hash, group, image_format), paths in sorted(
+            candidates.items(), key=lambda item: format_order.index(item[0][2])
+    ):
+        srcset = ', '.join(
+            f'{default_storage.url(path)} {image_width}w' for image_width, path in sorted(paths.items())
+        )
+        data = srcsets[source_hash].setdefault(group, {'sources': [], 'srcset': ''})
+        if image_format == 'JPEG':
+            data['srcset'] = srcset
+        else:
+            data['sources'].append({'type': FORMATS[image_format][1], 'srcset': srcset})
+    return srcsets
@@ -1,95 +1,259 @@
-import pickle
+import bisect
+import json
 import logging
+import math
+import random
+import time
 
 from django.db.models import Window
 from django.db.models.functions import DenseRank, Random
 from django.conf import settings
-from courses.models import CourseImage, Course
+from courses.models import CourseImage, Course, Office, GraduatePhoto, Program
 from django.utils import timezone
-from django.core.mail import send_mail
-from eyelash_courses.logger import send_message as send_tg_msg
 from textwrap import dedent
 from django.db.models import Q
+from redis.exceptions import LockError
+from operator import itemgetter
+from typing import Any, Callable, Tuple
+from .derivatives import get_source_hash, get_srcsets
+from .outbox import enqueue_form_submission
+from .page_cache import mark_stale_page
 
 logger = logging.getLogger('telegram')
 
+# Версия формата данных страниц в Redis: при изменении структуры словарей
+# увеличивается, и старые записи просто перестают читаться
+PAGE_DATA_VERSION = 3
+RANDOM_IMAGES_TTL = 1800
+MONTHS = {
+    1: 'Январь', 2: 'Февраль', 3: 'Март', 4: 'Апрель',
+    5: 'Май', 6: 'Июнь', 7: 'Июль', 8: 'Август',
+    9: 'Сентябрь', 10: 'Октябрь', 11: 'Ноябрь', 12: 'Декабрь'
+}
 
-def set_random_images(number):
-    redis = settings.REDIS_DB
-    random_images = CourseImage.objects.annotate(number=Window(expression=DenseRank(), order_by=[Random()]))
-    end_index = min(len(random_images), number)
-    part_random_images = random_images[:end_index]
+
+def get_page_data_key(key: str) -> str:
+    return f'page_data:v{PAGE_DATA_VERSION}:{key}'
+
+
+def get_page_data(key: str) -> Tuple[dict | None, int]:
+    """Запись данных страницы и текущее поколение ключа"""
+
+    data, generation = settings.REDIS_DB.mget(get_page_data_key(key), f'{get_page_data_key(key)}:generation')
+    return json.loads(data) if data else None, int(generation or 0)
+
+
+def get_page_data_generation(key: str) -> int:
+    """Поколение ключа: увеличивается при каждом изменении данных (см. courses.signals)"""
+
+    return int(settings.REDIS_DB.get(f'{get_page_data_key(key)}:generation') or 0)
+
+
+def set_page_data(key: str, data, generation: int, ttl: int = None, delta: float = 0) -> None:
+    """
+    Сохранение данных страницы вместе со служебными полями:
+    generation - поколение ключа на момент начала сборки,
+    expires_at - логический срок годности (сама запись в Redis не удаляется,
+    чтобы ее можно было отдавать, пока идет пересборка),
+    delta - время сборки для вероятностного досрочного обновления
+    """
+
+    envelope = {
+        'data': data,
+        'generation': generation,
+        'expires_at': time.time() + ttl if ttl else None,
+        'delta': delta,
+    }
+    settings.REDIS_DB.set(get_page_data_key(key), json.dumps(envelope, ensure_ascii=False, separators=(',', ':')))
+
+
+def invalidate_page_data(*keys: str) -> None:
+    """Сброс данных: записи остаются в Redis, но становятся устаревшими"""
+
+    pipe = settings.REDIS_DB.pipeline()
+    for key in keys:
+        pipe.incr(f'{get_page_data_key(key)}:generation')
+    pipe.execute()
+
+
+def is_fresh(envelope: dict, generation: int, beta: float = 1.0) -> bool:
+    """
+    Проверка актуальности записи. Незадолго до срока годности запись случайно
+    считается устаревшей (XFetch): чем дольше сборка, тем раньше начинается
+    досрочное обновление, и до истечения срока его успевает выполнить один запрос
+    """
+
+    if envelope['generation'] != generation:
+        return False
+    if not envelope['expires_at']:
+        return True
+    early = envelope['delta'] * beta * -math.log(1 - random.random())
+    return time.time() + early < envelope['expires_at']
+
+
+def get_or_build_page_data(
+        key: str,
+        build: Callable[[], Any],
+        ttl: int = None,
+        beta: float = 1.0,
+        lock_timeout: int = 30,
+        wait_timeout: float = 5,
+):
+    """
+    Данные страницы из Redis или сборка из базы данных.
+    Пересборку выполняет только процесс, получивший блокировку,
+    остальные в это время отдают устаревшие данные, а если данных еще нет - ждут сборки.
+    Страница с устаревшими данными отмечается, чтобы она не попала в кэш страниц
+    """
+
+    envelope, generation = get_page_data(key)
+    if envelope and is_fresh(envelope, generation, beta):
+        return envelope['data']
+    lock = settings.REDIS_DB.lock(f'{get_page_data_key(key)}:lock', timeout=lock_timeout, blocking=False)
+    if lock.acquire():
+        try:
+            return build_page_data(key, build, generation, ttl)
+        finally:
+            try:
+                lock.release()
+            except LockError:
+                pass
+    if envelope:
+        expires_at = envelope['expires_at']
+        if envelope['generation'] != generation or expires_at and expires_at <= time.time():
+            mark_stale_page()
+        return envelope['data']
+    deadline = time.monotonic() + wait_timeout
+    while time.monotonic() < deadline:
+        time.sleep(0.05)
+        envelope, __ = get_page_data(key)
+        if envelope:
+            return envelope['data']
+    return build()
+
+
+def build_page_data(key: str, build: Callable[[], Any], generation: int = None, ttl: int = None):
+    if generation is None:
+        __, generation = get_page_data(key)
+    started_at = time.monotonic()
+    data = build()
+    set_page_data(key, data, generation, ttl, delta=time.monotonic() - started_at)
+    return data
+
+
+def get_file_url(file) -> str:
+    return file.url if file else ''
+
+
+def serialize_course(instance: Course, srcsets: dict = None) -> dict:
+    """
+    Данные курса, которые используются в шаблонах списков курсов.
+    srcsets - результат get_srcsets для первых фото курсов, без него адаптивные варианты не подставляются
+    """
+
+    images = list(instance.images.all())
+    image = images[0] if images else None
+    scheduled_at = instance.scheduled_at
+    return {
+        'instance': {
+            'pk': instance.pk,
+            'slug': instance.slug,
+            'name': instance.name,
+            'program': str(instance.program) if instance.program else '',
+            'program_pk': instance.program_id,
+            'lecture': str(instance.lecture) if instance.lecture else '',
+            'duration': instance.duration,
+        },
+        'image_url': get_file_url(image.image) if image else '',
+        'image_preview_url': get_file_url(image.image_preview) if image else '',
+        'big_preview_url': get_file_url(image.big_preview) if image else '',
+        'image_srcsets': (srcsets or {}).get(get_source_hash(image.image_preview.name), {}) if image else {},
+        'date': scheduled_at.strftime("%d.%m.%Y"),
+        'date_slug': scheduled_at.strftime("%d-%m-%Y"),
+        'readable_date': {
+            'day': scheduled_at.day,
+            'month': MONTHS[scheduled_at.month],
+            'year': scheduled_at.year
+        },
+        'lecturer': instance.lecture.slug if instance.lecture else '',
+        'scheduled_at': instance.scheduled_at.timestamp(),
+    }
+
+
+def serialize_office(office: Office) -> dict:
+    return {'title': office.title, 'address': office.address, 'description': office.description}
+
+
+def serialize_graduate_photo(photo: GraduatePhoto) -> dict:
+    return {'title': photo.title, 'image': {'url': get_file_url(photo.image)}}
+
+
+def serialize_program(program: Program) -> dict:
+    return {'pk': program.pk, 'slug': program.slug, 'title': program.title, 'image': {'url': get_file_url(program.image)}}
+
+
+SERIALIZERS = {
+    Office: serialize_office,
+    GraduatePhoto: serialize_graduate_photo,
+    Program: serialize_program,
+}
+
+
+def get_random_images_data(number):
+    random_images = list(
+        CourseImage.objects.annotate(number=Window(expression=DenseRank(), order_by=[Random()]))[:number]
+    )
+    srcsets = get_srcsets(get_source_hash(image.image_preview.name) for image in random_images)
+    part_random_images = [
+        {
+            'image': {'url': get_file_url(image.image)},
+            'image_preview': {
+                'url': get_file_url(image.image_preview),
+                'srcsets': srcsets.get(get_source_hash(image.image_preview.name), {}).get('image_preview', {}),
+            },
+        }
+        for image in random_images
+    ]
+    end_index = len(part_random_images)
     height = 80
     index_height = {(0, 4): 130, (5, 8): 100, (9, 13): 80, (14, 20): 60}
     for i, px in index_height.items():
         if i[0] <= end_index <= i[1]:
             height = px
             break
-    io_random_images = pickle.dumps(part_random_images)
-    redis.set('random_images', io_random_images)
-    redis.set('height_images', height)
-    return part_random_images, height
+    return {'images': part_random_images, 'height': height}
 
 
-def get_courses(all_courses: Course, past=False, future=False):
-    months = {
-        1: 'Январь', 2: 'Февраль', 3: 'Март', 4: 'Апрель',
-        5: 'Май', 6: 'Июнь', 7: 'Июль', 8: 'Август',
-        9: 'Сентябрь', 10: 'Октябрь', 11: 'Ноябрь', 12: 'Декабрь'
-    }
-    redis = settings.REDIS_DB
-    if past and not future:
-        courses = redis.get('past_courses')
-        if courses:
-            courses = pickle.loads(courses)
-        else:
-            courses = all_courses.filter(scheduled_at__lte=timezone.now())
-            io_courses = pickle.dumps(courses)
-            redis.set('past_courses', io_courses)
-            redis.expire('past_courses', 1800)
-    elif not past and future:
-        courses = redis.get('future_courses')
-        if courses:
-            courses = pickle.loads(courses)
-        else:
-            courses = all_courses.filter(scheduled_at__gt=timezone.now())
-            io_courses = pickle.dumps(courses)
-            redis.set('future_courses', io_courses)
-            redis.expire('future_courses', 1800)
+def set_random_images(number):
+    random_images = build_page_data('random_images', lambda: get_random_images_data(number), ttl=RANDOM_IMAGES_TTL)
+    return random_images['images'], random_images['height']
+
+
+def get_random_images(number):
+    random_images = get_or_build_page_data(
+        'random_images', lambda: get_random_images_data(number), ttl=RANDOM_IMAGES_TTL
+    )
+    return random_images['images'], random_images['height']
+
+
+def get_courses(all_courses: list, past=False, future=False):
+    """
+    Курсы для шаблона: прошедшие, предстоящие или все.
+    all_courses отсортирован по времени начала, поэтому граница между прошедшими
+    и предстоящими курсами находится бинарным поиском на момент запроса
+    """
+
+    if past != future:
+        border = bisect.bisect_right(all_courses, timezone.now().timestamp(), key=itemgetter('scheduled_at'))
+        courses = all_courses[:border] if past else all_courses[border:]
     else:
         courses = all_courses
-
-    return [
-        {
-            'instance': instance,
-            'number': number,
-            'image_url': instance.images.first().image.url,
-            'image_preview_url': instance.images.first().image_preview.url,
-            'big_preview_url': instance.images.first().big_preview.url,
-            'date': instance.scheduled_at.strftime("%d.%m.%Y"),
-            'date_slug': instance.scheduled_at.strftime("%d-%m-%Y"),
-            'readable_date': {
-                'day': instance.scheduled_at.day,
-                'month': months[instance.scheduled_at.month],
-                'year': instance.scheduled_at.year
-            },
-            'lecturer': instance.lecture.slug,
-        } for number, instance in enumerate(courses, start=1)
-    ]
+    return [{**course, 'number': number} for number, course in enumerate(courses, start=1)]
 
 
 def submit_course_form_data(name, phone, text):
-    send_tg_msg(
-        token=settings.TG_LOGGER_BOT,
-        chat_id=settings.TG_LOGGER_CHAT,
-        msg=dedent(text)
-    )
-    send_mail(
-        f'Заявка от {name}: {phone}',
-        dedent(text),
-        settings.EMAIL_HOST_USER,
-        settings.RECIPIENTS_EMAIL
-    )
+    """Заявка ставится в очередь отправки, в Telegram и на почту ее доставляет команда send_form_outbox"""
+    enqueue_form_submission(f'Заявка от {name}: {phone}', dedent(text))
 
 
 def get_error_data(form):
@@ -103,41 +267,28 @@ def get_error_data(form):
 
 
 def get_redis_or_get_db(key: str, obj_class):
-    redis = settings.REDIS_DB
-    io_items = redis.get(key)
-    if io_items:
-        items = pickle.loads(io_items)
-        if items:
-            return items
-    items = obj_class.objects.all()
-    io_items = pickle.dumps(items)
-    redis.set(key, io_items)
-    return items
-
-
-def get_redis_or_get_db_all_courses(key: str):
-    redis = settings.REDIS_DB
-    all_courses = redis.get(key)
-    if all_courses:
-        all_courses = pickle.loads(all_courses)
-    return all_courses or set_courses_redis()
+    return get_or_build_page_data(key, lambda: [SERIALIZERS[obj_class](item) for item in obj_class.objects.all()])
 
 
-def set_courses_redis():
-    redis = settings.REDIS_DB
+def get_all_courses_data():
     all_courses = (
         Course.objects.filter(~Q(name='Фотогалерея'), published_in_bot=True)
         .select_related('program', 'lecture').prefetch_related('images')
+        .order_by('scheduled_at', 'pk')
     )
-    io_all_courses = pickle.dumps(all_courses)
-    settings.REDIS_DB.set('all_courses', io_all_courses)
-    past_courses = all_courses.filter(scheduled_at__lte=timezone.now())
-    future_courses = all_courses.filter(scheduled_at__gt=timezone.now())
-    io_past_courses = pickle.dumps(past_courses)
-    io_future_courses = pickle.dumps(future_courses)
-    redis.set('past_courses', io_past_courses)
-    redis.set('future_courses', io_future_courses)
-    redis.expire('past_courses', 1800)
-    redis.expire('future_courses', 1800)
+    # адаптивные варианты первых фото всех курсов одним запросом
+    srcsets = get_srcsets(
+        get_source_hash(images[0].image_preview.name)
+        for images in (list(course.images.all()) for course in all_courses) if images
+    )
+    return [serialize_course(course, srcsets) for course in all_courses]
+
+
+def get_redis_or_get_db_all_courses(key: str = 'all_courses'):
+    return get_or_build_page_data(key, get_all_courses_data)
+
+
+def set_courses_redis():
+    all_courses = build_page_data('all_courses', get_all_courses_data)
     set_random_images(13)
     return all_courses
@@ -1,5 +1,9 @@
 import os
+import shutil
+
+from django.core.files.storage import default_storage
 from PIL import Image
+from courses.derivatives import build_derivatives
 
 
 def get_size_format(b, factor=1024, suffix="B"):
@@ -17,6 +21,8 @@ def get_size_format(b, factor=1024, suffix="B"):
 
 
 def compress_img(image_name, new_size_ratio=1.0, quality=90, suffix='_compressed', width=1920, height=980, to_jpg=True):
+    if new_size_ratio >= 1.0 and width and height and to_jpg:
+        return get_compressed_copy(image_name, quality, suffix, width, height)
     img = Image.open(image_name)
     print("[*] Image shape:", img.size)
     image_size = os.path.getsize(image_name)
@@ -54,6 +60,26 @@ def compress_img(image_name, new_size_ratio=1.0, quality=90, suffix='_compressed
     return img, new_filename
 
 
+def get_compressed_copy(image_name, quality, suffix, width, height):
+    """
+    Уменьшение до размеров width x height через манифест производных изображений:
+    файл с такими параметрами для того же содержимого создается один раз, затем только копируется
+    """
+    size = (width, height, quality, 'JPEG')
+    derivative_path = default_storage.path(build_derivatives({image_name: {size}}, workers=1)[(image_name, size)])
+    new_filename = f'{os.path.splitext(image_name)[0]}{suffix}.jpg'
+    if os.path.abspath(new_filename) != os.path.abspath(derivative_path):
+        shutil.copyfile(derivative_path, new_filename)
+    img = Image.open(new_filename)
+    print("[+] New Image shape:", img.size)
+    print("[+] New file saved:", new_filename)
+    image_size = os.path.getsize(image_name)
+    new_image_size = os.path.getsize(new_filename)
+    print("[+] Size after compression:", get_size_format(new_image_size))
+    print(f"[+] Image size change: {(new_image_size - image_size)/image_size*100:.2f}% of the original image size.")
+    return img, new_filename
+
+
 if __name__ == '__main__':
     file_name = '/home/sergryap/Изображения/20140126_130613_1.jpg'
     compress_img(file_name, new_size_ratio=1, suffix='_2', quality=80, width=100, height=100)
@@ -1,4 +1,3 @@
-import pickle
 import time
 
 import requests
@@ -6,13 +5,12 @@ from bots.vkvawe_bot.vk_lib import get_group_albums, get_album_photos
 from django.conf import settings
 from asgiref.sync import async_to_sync
 
-from courses.management.commands._get_preview import get_preview
+from courses.derivatives import update_previews
 from courses.models import Course, CourseImage
 from django.utils import timezone
 from django.core.files.base import ContentFile
 from django.utils.crypto import md5
-from courses.context_processors import set_random_images
-from django.db.models import Q
+from courses.general_functions import set_courses_redis
 
 
 def get_albums(options: dict, albums_ids: str = None):
@@ -65,27 +63,9 @@ def get_albums(options: dict, albums_ids: str = None):
             time.sleep(2)
         images = course.images.all()
         if images:
-            for preview in images:
-                print(f'Создаю превью фото: {preview.image.path}')
-                get_preview(preview)
-                get_preview(preview, preview_attr='big_preview', width=370, height=320)
+            update_previews(images)
 
 
 def update_redis_courses():
-    redis = settings.REDIS_DB
-    all_courses = (
-        Course.objects.filter(~Q(name='Фотогалерея'), published_in_bot=True)
-        .select_related('program', 'lecture').prefetch_related('images')
-    )
-    io_all_courses = pickle.dumps(all_courses)
-    settings.REDIS_DB.set('all_courses', io_all_courses)
-    past_courses = all_courses.filter(scheduled_at__lte=timezone.now())
-    future_courses = all_courses.filter(scheduled_at__gt=timezone.now())
-    io_past_courses = pickle.dumps(past_courses)
-    io_future_courses = pickle.dumps(future_courses)
-    redis.set('past_courses', io_past_courses)
-    redis.set('future_courses', io_future_courses)
-    redis.expire('past_courses', 1800)
-    redis.expire('future_courses', 1800)
-    set_random_images(13)
+    set_courses_redis()
 
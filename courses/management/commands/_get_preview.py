@@ -1,8 +1,4 @@
-import os
-from django.core.files.base import ContentFile
-from PIL import Image
-from io import BytesIO
-from django.core.files.uploadedfile import InMemoryUploadedFile
+from courses.derivatives import update_previews
 
 
 def get_preview(
@@ -19,44 +15,18 @@ def get_preview(
     obj - экземпляр модели;
     image_attr - атрибут модели, в котором находится исходное изображение;
     preview_attr - атрибут модели, в который будет записано превью, должен быть типа ImageField;
-    suffix - для имени файла превью;
+    suffix - не используется: имя файла превью определяется хэшем исходника и размером;
     width - максимальная ширина превью;
     height - максимальная высота превью.
+
+    Превью ищется в манифесте ImageDerivative и создается, только если его там нет (см. courses.derivatives).
+    Для нескольких размеров сразу используйте update_previews: исходник декодируется один раз.
     """
 
     if not (hasattr(obj, preview_attr) and hasattr(obj, image_attr)):
         return
-    if not (getattr(obj, image_attr) and os.path.isfile(getattr(obj, image_attr).path)):
-        return
-    file_path = getattr(obj, image_attr).path
-    suffix = suffix if suffix is not None else f'_{preview_attr}'
-    new_filename_exclude_ext = f'{os.path.split(os.path.splitext(file_path)[0])[1]}{suffix}'
-    new_filename = f'{new_filename_exclude_ext}.jpg'
-    img = Image.open(file_path)
-    remove_files = [file for file in os.listdir(os.path.split(file_path)[0]) if new_filename_exclude_ext in file]
-    if hasattr(obj, preview_attr) and getattr(obj, preview_attr) and os.path.isfile(getattr(obj, preview_attr).path):
-        for file in remove_files:
-            print(f'Deleted: {file}')
-            os.remove(os.path.join(os.path.split(file_path)[0], file))
-    print(f'Created: {new_filename}')
-    buffer = BytesIO()
-    try:
-        img.thumbnail((width, height))
-        img.save(fp=buffer, format='JPEG')
-    except OSError:
-        img = img.convert("RGB")
-        img.thumbnail((width, height))
-        img.save(fp=buffer, format='JPEG')
-    file_content = ContentFile(buffer.getvalue())
-    preview = getattr(obj, preview_attr)
-    preview.save(
-        new_filename,
-        InMemoryUploadedFile(
-            file=file_content,
-            field_name=None,
-            name=new_filename,
-            content_type='image/jpeg',
-            size=file_content.tell,
-            charset=None
-        )
+    update_previews(
+        [obj],
+        sizes={preview_attr: (width, height)},
+        image_attr=image_attr,
     )
@@ -0,0 +1,147 @@
+import asyncio
+import json
+import logging
+import random
+
+from django.conf import settings
+from django.core.management import BaseCommand, CommandError
+from django.db import connection
+from django.test import override_settings
+from django.test.utils import setup_databases, teardown_databases
+from django.utils import timezone
+
+from bots import TgLongPollServer, VkLongPollServer, TgApi, VkApi, tg_event_handler, vk_event_handler
+from bots.benchmark import (
+    BotBenchmark,
+    MockTgServer,
+    MockVkServer,
+    TG_STEPS,
+    VK_STEPS,
+    get_tg_user_updates,
+    get_vk_user_updates,
+    mix_traffic,
+)
+from bots.rate_limit import RateLimiter
+from courses.models import Course, CourseImage, Lecturer, Office, Program, Timer
+
+try:
+    import fakeredis
+except ImportError:
+    fakeredis = None
+
+
+class Command(BaseCommand):
+    help = (
+        'Нагрузочный прогон обработчиков ботов TG и VK на синтетическом трафике через локальные '
+        'заглушки API. Работает на отдельной тестовой базе и fakeredis (для скриптов очереди нужен lupa)'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--platform', choices=['all', 'tg', 'vk'], default='all')
+        parser.add_argument('--users', type=int, default=1000, help='Число виртуальных пользователей')
+        parser.add_argument('--courses', type=int, default=8, help='Число предстоящих курсов')
+        parser.add_argument('--workers', type=int, default=16, help='Обработчики диспетчера событий')
+        parser.add_argument('--max-pending', type=int, default=1000)
+        parser.add_argument(
+            '--rate-limits',
+            action='store_true',
+            help='Оставить лимиты частоты платформ: без флага замеряются только обработчики'
+        )
+        parser.add_argument('--seed', type=int, default=0, help='Зерно генератора трафика')
+        parser.add_argument('--output', help='Файл для отчета в JSON, по умолчанию stdout')
+
+    def handle(self, *args, **options):
+        if fakeredis is None:
+            raise CommandError('Для замеров нужен пакет fakeredis')
+        random.seed(options['seed'])
+        old_config = setup_databases(verbosity=0, interactive=False)
+        telegram_logger = logging.getLogger('telegram')
+        # логгер бота пересылает сообщения в настоящий Telegram
+        telegram_logger.disabled = True
+        try:
+            with override_settings(REDIS_DB=fakeredis.FakeRedis()):
+                report = run_benchmarks(**options)
+        finally:
+            telegram_logger.disabled = False
+            teardown_databases(old_config, verbosity=0)
+        output = json.dumps(report, ensure_ascii=False, indent=2)
+        if options['output']:
+            with open(options['output'], 'w') as file:
+                file.write(output)
+        else:
+            self.stdout.write(output)
+
+
+def seed_courses(courses: int) -> list[int]:
+    now = timezone.now()
+    program = Program.objects.create(title='Классика', slug='klassika', short_description='Описание программы')
+    lecturer = Lecturer.objects.create(first_name='Лектор', last_name='Тестовый', slug='lecturer')
+    Office.objects.create(title='Офис', address='Адрес', description='Описание', image='office.jpg', long=0, lat=0)
+    timers = [Timer.objects.create(reminder_interval=hours) for hours in (24, 72)]
+    created_courses = []
+    for number in range(courses):
+        course = Course.objects.create(
+            name=f'Курс {number}',
+            slug=f'course-{number}',
+            program=program,
+            lecture=lecturer,
+            scheduled_at=now + timezone.timedelta(days=7 + number),
+            duration=2,
+            price=10000,
+        )
+        course.reminder_intervals.set(timers)
+        CourseImage.objects.bulk_create(
+            CourseImage(course=course, image=f'courses/{number}_{position}.jpg', image_vk_id=f'photo-1_{position}')
+            for position in range(5)
+        )
+        created_courses.append(course.pk)
+    return created_courses
+
+
+def create_connects(platform: str, redis_db, loop, workers: int, max_pending: int, rate_limits: bool):
+    connects = []
+    if platform in ('all', 'tg'):
+        tg_api = TgApi(tg_token='benchmark', redis_db=redis_db, loop=loop)
+        tg_connect = TgLongPollServer(api=tg_api, handle_event=tg_event_handler, workers=workers, max_pending=max_pending)
+        connects.append((tg_connect, MockTgServer(), TG_STEPS, get_tg_user_updates, 10 ** 6))
+    if platform in ('all', 'vk'):
+        vk_api = VkApi(vk_group_token='benchmark', redis_db=redis_db, loop=loop)
+        vk_connect = VkLongPollServer(
+            api=vk_api, group_id=1, handle_event=vk_event_handler, workers=workers, max_pending=max_pending
+        )
+        connects.append((vk_connect, MockVkServer(), VK_STEPS, get_vk_user_updates, 2 * 10 ** 6))
+    for connect, *__ in connects:
+        if not rate_limits:
+            connect.api.rate_limiter = RateLimiter(rate=10 ** 6)
+    return connects
+
+
+def run_benchmarks(platform: str, users: int, courses: int, workers: int, max_pending: int, rate_limits: bool, **options):
+    course_pks = seed_courses(courses)
+    loop = asyncio.new_event_loop()
+    asyncio.set_event_loop(loop)
+    results = []
+    try:
+        connects = create_connects(platform, settings.REDIS_DB, loop, workers, max_pending, rate_limits)
+        for connect, mock, steps, get_user_updates, first_user_id in connects:
+            traffic = mix_traffic([
+                get_user_updates(first_user_id + number, random.choice(course_pks))
+                for number in range(users)
+            ])
+            benchmark = BotBenchmark(connect, mock, steps)
+            results.append(loop.run_until_complete(benchmark.run(traffic)))
+    finally:
+        # отложенные задачи рассылок, созданные обработчиками, в замер не входят
+        pending = asyncio.all_tasks(loop)
+        for task in pending:
+            task.cancel()
+        loop.run_until_complete(asyncio.gather(*pending, return_exceptions=True))
+        loop.close()
+    return {
+        'database': connection.vendor,
+        'users': users,
+        'workers': workers,
+        'rate_limits': rate_limits,
+        'created_at': timezone.now().isoformat(),
+        'results': results,
+    }
@@ -0,0 +1,234 @@
+import json
+import random
+import statistics
+import time
+import tracemalloc
+
+from django.conf import settings
+from django.contrib.auth.models import AnonymousUser
+from django.core.management import BaseCommand, CommandError, call_command
+from django.db import connection
+from django.test import RequestFactory, override_settings
+from django.test.utils import setup_databases, teardown_databases
+from django.utils import timezone
+from courses import views
+from courses.models import Client, Course, CourseClient, CourseImage, GraduatePhoto, Lecturer, Office, Program
+from courses.query_counter import QueryCounter
+
+try:
+    import fakeredis
+except ImportError:
+    fakeredis = None
+
+
+class Command(BaseCommand):
+    help = (
+        'Замер числа SQL-запросов, времени отрисовки и выделений памяти для страниц сайта '
+        'на тестовых данных разного объема. Для каждого объема данные создаются в отдельной '
+        'тестовой базе, Redis подменяется на fakeredis'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--sizes',
+            default='10,100,1000',
+            help='Число курсов для каждого прогона через запятую'
+        )
+        parser.add_argument('--repeat', type=int, default=50, help='Число замеров времени для каждой страницы')
+        parser.add_argument('--images', type=int, default=5, help='Фото на курс')
+        parser.add_argument('--clients', type=int, default=10, help='Участников на курс')
+        parser.add_argument('--programs', type=int, default=10, help='Число программ')
+        parser.add_argument('--seed', type=int, default=0, help='Зерно генератора случайных данных')
+        parser.add_argument('--output', help='Файл для результатов в JSON, по умолчанию stdout')
+
+    def handle(self, *args, **options):
+        if fakeredis is None:
+            raise CommandError('Для замеров нужен пакет fakeredis')
+        try:
+            sizes = [int(size) for size in options['sizes'].split(',')]
+        except ValueError:
+            raise CommandError('--sizes: ожидаются целые числа через запятую')
+        random.seed(options['seed'])
+        # данные фиксируются, иначе их не увидят соединения потоков django_async_orm
+        old_config = setup_databases(verbosity=0, interactive=False)
+        try:
+            report = {
+                'database': connection.vendor,
+                'repeat': options['repeat'],
+                'created_at': timezone.now().isoformat(),
+                'results': [
+                    run_benchmark(
+                        courses=size,
+                        programs=options['programs'],
+                        images=options['images'],
+                        clients=options['clients'],
+                        repeat=options['repeat'],
+                    ) for size in sizes
+                ],
+            }
+        finally:
+            teardown_databases(old_config, verbosity=0)
+        output = json.dumps(report, ensure_ascii=False, indent=2)
+        if options['output']:
+            with open(options['output'], 'w') as file:
+                file.write(output)
+        else:
+            self.stdout.write(output)
+
+
+def seed(courses: int, programs: int, images: int, clients: int) -> dict:
+    now = timezone.now()
+    created_programs = Program.objects.bulk_create(
+        Program(
+            title=f'Программа {number}',
+            slug=f'bench-program-{number}',
+            image=f'program/bench_{number}.jpg',
+            position=number,
+        )
+        for number in range(programs)
+    )
+    lecturers = Lecturer.objects.bulk_create(
+        Lecturer(first_name='Лектор', last_name=str(number), slug=f'bench-lecturer-{number}')
+        for number in range(max(courses // 20, 1))
+    )
+    created_courses = Course.objects.bulk_create(
+        Course(
+            name=f'Курс {number}',
+            slug=f'bench-course-{number}',
+            program=random.choice(created_programs),
+            lecture=random.choice(lecturers),
+            # половина курсов в прошлом, половина в будущем
+            scheduled_at=now + timezone.timedelta(days=random.randint(-365, 365), hours=random.randint(0, 23)),
+            duration=random.randint(1, 5),
+            price=random.randint(5, 50) * 1000,
+            short_description='Описание курса',
+        ) for number in range(courses)
+    )
+    CourseImage.objects.bulk_create(
+        CourseImage(
+            course=course,
+            image=f'courses/bench_{course.pk}_{position}.jpg',
+            image_preview=f'courses/bench_{course.pk}_{position}_preview.jpg',
+            big_preview=f'courses/bench_{course.pk}_{position}_big.jpg',
+            position=position,
+        ) for course in created_courses for position in range(images)
+    )
+    created_clients = Client.objects.bulk_create(
+        Client(first_name=f'Клиент {number}', telegram_id=10 ** 9 + number)
+        for number in range(courses * clients)
+    )
+    CourseClient.objects.bulk_create(
+        CourseClient(course=course, client=client)
+        for number, course in enumerate(created_courses)
+        for client in created_clients[number * clients:(number + 1) * clients]
+    )
+    Office.objects.create(title='Офис', address='Адрес', image='office/bench.jpg', long=0, lat=0)
+    GraduatePhoto.objects.bulk_create(
+        GraduatePhoto(image=f'graduate_photos/bench_{number}.jpg') for number in range(12)
+    )
+    return {
+        'courses': courses,
+        'programs': programs,
+        'images': courses * images,
+        'clients': courses * clients,
+        'course': random.choice(created_courses),
+        'program': random.choice(created_programs),
+    }
+
+
+def get_pages(data: dict) -> dict:
+    course = data['course']
+    return {
+        'home': (views.home, '/', {}),
+        'course': (views.course, '/courses/', {}),
+        'course_details': (
+            views.course_details,
+            f'/course/{course.slug}/{course.lecture.slug}/{course.scheduled_at:%d-%m-%Y}/',
+            {
+                'slug': course.slug,
+                'lecturer': course.lecture.slug,
+                'date': course.scheduled_at.strftime('%d-%m-%Y'),
+            },
+        ),
+        'program_details': (
+            views.program_details,
+            f'/program/{data["program"].slug}/',
+            {'slug': data['program'].slug},
+        ),
+    }
+
+
+def percentile(values: list[float], percent: float) -> float:
+    values = sorted(values)
+    return values[min(int(len(values) * percent / 100), len(values) - 1)]
+
+
+def measure_page(view, path: str, kwargs: dict, repeat: int) -> dict:
+    """
+    Замер страницы: cold - первый вызов с пустыми данными страниц в Redis,
+    warm - отрисовка с готовыми данными, cached - выдача готовой страницы из кэша
+    """
+
+    factory = RequestFactory(SERVER_NAME=settings.ALLOWED_HOSTS[0])
+
+    def call(page_view):
+        request = factory.get(path)
+        request.user = AnonymousUser()
+        response = page_view(request, **kwargs)
+        if response.status_code != 200:
+            raise CommandError(f'{path}: ответ {response.status_code}')
+        return response
+
+    settings.REDIS_DB.flushdb()
+    # выборки django_async_orm идут через соединения других потоков
+    with QueryCounter() as cold_queries:
+        call(view.__wrapped__)
+    with QueryCounter() as warm_queries:
+        call(view.__wrapped__)
+
+    timings = []
+    for _ in range(repeat):
+        started_at = time.perf_counter()
+        call(view.__wrapped__)
+        timings.append((time.perf_counter() - started_at) * 1000)
+
+    tracemalloc.start()
+    call(view.__wrapped__)
+    allocated, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    call(view)
+    cached_timings = []
+    with QueryCounter() as cached_queries:
+        for _ in range(repeat):
+            started_at = time.perf_counter()
+            call(view)
+            cached_timings.append((time.perf_counter() - started_at) * 1000)
+
+    return {
+        'cold_queries': cold_queries.count,
+        'queries': warm_queries.count,
+        'p50_ms': round(statistics.median(timings), 3),
+        'p99_ms': round(percentile(timings, 99), 3),
+        'mean_ms': round(statistics.mean(timings), 3),
+        'allocated_kb': round(allocated / 1024, 1),
+        'peak_kb': round(peak / 1024, 1),
+        'cached_queries': cached_queries.count // max(repeat, 1),
+        'cached_p50_ms': round(statistics.median(cached_timings), 3),
+        'cached_p99_ms': round(percentile(cached_timings, 99), 3),
+    }
+
+
+def run_benchmark(courses: int, programs: int, images: int, clients: int, repeat: int) -> dict:
+    """Прогон на тестовой базе, очищенной от данных предыдущего прогона"""
+
+    call_command('flush', verbosity=0, interactive=False)
+    with override_settings(REDIS_DB=fakeredis.FakeRedis()):
+        data = seed(courses, programs, images, clients)
+        pages = get_pages(data)
+        result = {key: value for key, value in data.items() if isinstance(value, int)}
+        result['pages'] = {
+            name: measure_page(view, path, kwargs, repeat)
+            for name, (view, path, kwargs) in pages.items()
+        }
+    return result
@@ -0,0 +1,32 @@
+import json
+
+from django.core.management import BaseCommand
+from courses.models import CourseImage
+from courses.derivatives import update_previews
+from courses.general_functions import set_courses_redis
+
+
+class Command(BaseCommand):
+    help = 'Массовое создание превью фото курсов в несколько процессов'
+
+    def add_arguments(self, parser):
+        parser.add_argument('-w', '--workers', type=int, default=None, help='Число процессов, по умолчанию по числу ядер')
+        parser.add_argument('-c', '--course', type=int, default=None, help='Только фото курса с этим id')
+        parser.add_argument('--force', action='store_true', help='Пересоздать превью неизменившихся изображений')
+
+    def handle(self, *args, **options):
+        images = CourseImage.objects.order_by('pk')
+        if options['course']:
+            images = images.filter(course_id=options['course'])
+
+        def progress(processed, total, stats):
+            if processed == total or not processed % 50:
+                self.stdout.write(
+                    f'{processed}/{total}: создано {stats.built}, ошибок {stats.failed}, '
+                    f'{stats.as_dict()["images_per_second"]} фото/с'
+                )
+
+        stats = update_previews(images, workers=options['workers'], force=options['force'], progress=progress)
+        if stats.built:
+            set_courses_redis()
+        self.stdout.write(json.dumps(stats.as_dict()))
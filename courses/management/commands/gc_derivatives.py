@@ -0,0 +1,17 @@
+import json
+
+from datetime import timedelta
+from django.core.management import BaseCommand
+from courses.derivatives import collect_garbage
+
+
+class Command(BaseCommand):
+    help = 'Удаление производных изображений, на которые не ссылается ни одна запись'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--grace-minutes', type=int, default=60, help='Не удалять записи моложе, мин.')
+        parser.add_argument('--dry-run', action='store_true', help='Только посчитать неиспользуемые файлы')
+
+    def handle(self, *args, **options):
+        result = collect_garbage(grace=timedelta(minutes=options['grace_minutes']), dry_run=options['dry_run'])
+        self.stdout.write(json.dumps(result))
@@ -1,6 +1,6 @@
 from django.core.management import BaseCommand
 from courses.models import CourseImage
-from ._get_preview import get_preview
+from courses.derivatives import update_previews
 from courses.general_functions import set_courses_redis
 
 
@@ -8,8 +8,5 @@ class Command(BaseCommand):
     help = 'Создание превью для галереи'
 
     def handle(self, *args, **options):
-        courses = CourseImage.objects.all()
-        for course in courses:
-            get_preview(course)
-            get_preview(course, preview_attr='big_preview', width=370, height=320)
+        update_previews(CourseImage.objects.all())
         set_courses_redis()
@@ -0,0 +1,25 @@
+import json
+
+from django.core.management import BaseCommand
+from django.conf import settings
+from courses.outbox import OutboxWorker
+
+
+class Command(BaseCommand):
+    help = 'Доставка заявок и подписок из очереди Redis в Telegram и на почту'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--once', action='store_true', help='Разобрать текущую очередь и завершить работу')
+        parser.add_argument('--batch-size', type=int, default=20)
+        parser.add_argument('--max-attempts', type=int, default=5)
+        parser.add_argument('--retry-delay', type=int, default=30, help='Пауза перед первым повтором, сек.')
+
+    def handle(self, *args, **options):
+        worker = OutboxWorker(
+            settings.REDIS_DB,
+            batch_size=options['batch_size'],
+            max_attempts=options['max_attempts'],
+            retry_delay=options['retry_delay'],
+        )
+        stats = worker.run(once=options['once'])
+        self.stdout.write(json.dumps(stats))
@@ -31,11 +31,13 @@ def start_all_bots():
 
     vk_api = VkApi(
         vk_group_token=settings.VK_TOKEN,
+        api_url=settings.VK_API_URL,
         redis_db=settings.REDIS_DB,
         loop=loop,
     )
     tg_api = TgApi(
         tg_token=settings.TG_TOKEN,
+        api_url=settings.TG_API_URL,
         redis_db=settings.REDIS_DB,
         loop=loop,
     )
@@ -21,6 +21,7 @@ def start_tg_bot():
 
     api = TgApi(
         tg_token=settings.TG_TOKEN,
+        api_url=settings.TG_API_URL,
         redis_db=settings.REDIS_DB,
     )
     connect = TgLongPollServer(
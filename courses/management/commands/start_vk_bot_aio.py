@@ -21,6 +21,7 @@ def start_vk_bot():
 
     api = VkApi(
         vk_group_token=settings.VK_TOKEN,
+        api_url=settings.VK_API_URL,
         redis_db=settings.REDIS_DB,
     )
 
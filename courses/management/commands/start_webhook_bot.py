@@ -0,0 +1,75 @@
+import logging
+import asyncio
+
+from django.conf import settings
+from django.core.management import BaseCommand
+
+from bots import TgLongPollServer, VkLongPollServer, TgApi, VkApi, tg_event_handler, vk_event_handler
+from bots.transport import transport
+from bots.webhook import WebhookServer
+
+
+class Command(BaseCommand):
+    help = 'Приём событий ботов VK и TG через webhook вместо Long Poll'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--host', default='0.0.0.0')
+        parser.add_argument('--port', type=int, default=8080)
+        parser.add_argument('--platform', choices=['all', 'tg', 'vk'], default='all')
+        parser.add_argument(
+            '--tg-webhook-url',
+            help='Публичный адрес {url}/tg/webhook: при указании webhook регистрируется в Telegram при запуске'
+        )
+
+    def handle(self, *args, **options):
+        try:
+            start_webhook_bot(**options)
+        except Exception as exc:
+            print(exc)
+            raise
+
+
+async def register_tg_webhook(tg_api: TgApi, webhook_url: str):
+    tg_api.session = await transport.acquire()
+    try:
+        return await tg_api.set_webhook(webhook_url, secret_token=settings.TG_WEBHOOK_SECRET)
+    finally:
+        await transport.release()
+        tg_api.session = None
+
+
+def start_webhook_bot(host='0.0.0.0', port=8080, platform='all', tg_webhook_url=None, **options):
+    logger = logging.getLogger('telegram')
+    logger.warning(f'Боты "eyelash-courses" запущены в режиме webhook ({platform})')
+
+    loop = asyncio.new_event_loop()
+    asyncio.set_event_loop(loop)
+
+    tg_connect, vk_connect = None, None
+    if platform in ('all', 'tg'):
+        tg_api = TgApi(
+            tg_token=settings.TG_TOKEN,
+            api_url=settings.TG_API_URL,
+            redis_db=settings.REDIS_DB,
+            loop=loop,
+        )
+        tg_connect = TgLongPollServer(api=tg_api, handle_event=tg_event_handler)
+        if tg_webhook_url:
+            loop.run_until_complete(register_tg_webhook(tg_api, tg_webhook_url))
+    if platform in ('all', 'vk'):
+        vk_api = VkApi(
+            vk_group_token=settings.VK_TOKEN,
+            api_url=settings.VK_API_URL,
+            redis_db=settings.REDIS_DB,
+            loop=loop,
+        )
+        vk_connect = VkLongPollServer(api=vk_api, group_id=settings.VK_GROUP_ID, handle_event=vk_event_handler)
+
+    server = WebhookServer(
+        tg_connect=tg_connect,
+        vk_connect=vk_connect,
+        tg_secret=settings.TG_WEBHOOK_SECRET,
+        vk_secret=settings.VK_CALLBACK_SECRET,
+        vk_confirmation_code=settings.VK_CONFIRMATION_CODE,
+    )
+    loop.run_until_complete(server.serve(host, port))
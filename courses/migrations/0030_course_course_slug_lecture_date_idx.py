@@ -0,0 +1,17 @@
+# Generated by Django 4.1.7 on 2026-10-18 12:00
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('courses', '0029_alter_scheduledmessage_options'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='course',
+            index=models.Index(fields=['slug', 'lecture', 'scheduled_at'], name='course_slug_lecture_date_idx'),
+        ),
+    ]
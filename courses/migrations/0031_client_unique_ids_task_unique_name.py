@@ -0,0 +1,89 @@
+# Generated by Django 4.1.7 on 2026-10-18 12:00
+
+from django.db import migrations, models
+from django.db.models import Count
+
+
+def merge_duplicate_clients(apps, schema_editor):
+    """
+    Объединение клиентов с одинаковым telegram_id или vk_id перед добавлением ограничений уникальности.
+    Остается запись с наименьшим pk: к ней переносятся записи на курсы, сообщения
+    и незаполненные поля, дубликаты удаляются
+    """
+
+    Client = apps.get_model('courses', 'Client')
+    CourseClient = apps.get_model('courses', 'CourseClient')
+    ScheduledMessage = apps.get_model('courses', 'ScheduledMessage')
+    for field in ('telegram_id', 'vk_id'):
+        duplicate_ids = (
+            Client.objects.filter(**{f'{field}__isnull': False})
+            .values(field).annotate(count=Count('pk')).filter(count__gt=1)
+            .values_list(field, flat=True)
+        )
+        for user_id in list(duplicate_ids):
+            client, *duplicates = Client.objects.filter(**{field: user_id}).order_by('pk')
+            duplicate_pks = [duplicate.pk for duplicate in duplicates]
+            for duplicate in duplicates:
+                for name in ('last_name', 'phone_number', 'vk_profile', 'comment'):
+                    if not getattr(client, name) and getattr(duplicate, name):
+                        setattr(client, name, getattr(duplicate, name))
+                client.completed_tasks = list(dict.fromkeys(
+                    (client.completed_tasks or []) + (duplicate.completed_tasks or [])
+                ))
+            client.save()
+            course_ids = set(CourseClient.objects.filter(client=client).values_list('course_id', flat=True))
+            for position in CourseClient.objects.filter(client_id__in=duplicate_pks).order_by('pk'):
+                if position.course_id in course_ids:
+                    position.delete()
+                    continue
+                position.client = client
+                position.save()
+                course_ids.add(position.course_id)
+            ScheduledMessage.objects.filter(client_id__in=duplicate_pks).update(client=client)
+            Client.objects.filter(pk__in=duplicate_pks).delete()
+
+
+def merge_duplicate_tasks(apps, schema_editor):
+    """Удаление задач с повторяющимся task_name, выполненные таймеры переносятся в оставшуюся задачу"""
+
+    Task = apps.get_model('courses', 'Task')
+    duplicate_names = (
+        Task.objects.values('task_name').annotate(count=Count('pk')).filter(count__gt=1)
+        .values_list('task_name', flat=True)
+    )
+    for task_name in list(duplicate_names):
+        task, *duplicates = Task.objects.filter(task_name=task_name).order_by('pk')
+        for duplicate in duplicates:
+            task.completed_timers = list(dict.fromkeys(
+                (task.completed_timers or []) + (duplicate.completed_timers or [])
+            ))
+        task.save()
+        Task.objects.filter(pk__in=[duplicate.pk for duplicate in duplicates]).delete()
+
+
+class Migration(migrations.Migration):
+    # Объединение дубликатов фиксируется отдельными транзакциями до добавления ограничений:
+    # в PostgreSQL ALTER TABLE в одной транзакции с изменением строк, на которые ссылаются
+    # внешние ключи, завершается ошибкой "pending trigger events"
+    atomic = False
+
+    dependencies = [
+        ('courses', '0030_course_course_slug_lecture_date_idx'),
+    ]
+
+    operations = [
+        migrations.RunPython(merge_duplicate_clients, migrations.RunPython.noop, atomic=True),
+        migrations.RunPython(merge_duplicate_tasks, migrations.RunPython.noop, atomic=True),
+        migrations.AddConstraint(
+            model_name='client',
+            constraint=models.UniqueConstraint(fields=('telegram_id',), name='unique_client_telegram_id'),
+        ),
+        migrations.AddConstraint(
+            model_name='client',
+            constraint=models.UniqueConstraint(fields=('vk_id',), name='unique_client_vk_id'),
+        ),
+        migrations.AddConstraint(
+            model_name='task',
+            constraint=models.UniqueConstraint(fields=('task_name',), name='unique_task_name'),
+        ),
+    ]
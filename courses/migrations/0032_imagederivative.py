@@ -0,0 +1,38 @@
+# Generated by Django 4.1.7 on 2026-10-18 12:00
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('courses', '0031_client_unique_ids_task_unique_name'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ImageDerivative',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('source_hash', models.CharField(max_length=40)),
+                ('width', models.PositiveIntegerField()),
+                ('height', models.PositiveIntegerField()),
+                ('quality', models.PositiveSmallIntegerField()),
+                ('format', models.CharField(default='JPEG', max_length=10)),
+                ('path', models.CharField(max_length=255, unique=True)),
+                ('size', models.PositiveIntegerField(default=0)),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+            ],
+            options={
+                'verbose_name': 'Производное изображение',
+                'verbose_name_plural': 'Производные изображения',
+            },
+        ),
+        migrations.AddConstraint(
+            model_name='imagederivative',
+            constraint=models.UniqueConstraint(
+                fields=('source_hash', 'width', 'height', 'quality', 'format'),
+                name='unique_image_derivative_spec',
+            ),
+        ),
+    ]
@@ -0,0 +1,23 @@
+# Generated by Django 4.1.7 on 2026-10-18 12:00
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('courses', '0032_imagederivative'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='imagederivative',
+            name='image_width',
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='imagederivative',
+            name='image_height',
+            field=models.PositiveIntegerField(default=0),
+        ),
+    ]
@@ -172,6 +172,10 @@ class Client(models.Model):
     class Meta:
         verbose_name = 'клиента'
         verbose_name_plural = 'клиенты'
+        constraints = [
+            UniqueConstraint(fields=['telegram_id'], name='unique_client_telegram_id'),
+            UniqueConstraint(fields=['vk_id'], name='unique_client_vk_id'),
+        ]
 
 
 class Timer(models.Model):
@@ -239,6 +243,9 @@ class Task(models.Model):
         verbose_name = 'задача'
         verbose_name_plural = 'задачи'
         ordering = ['task_name']
+        constraints = [
+            UniqueConstraint(fields=['task_name'], name='unique_task_name'),
+        ]
 
 
 class ScheduledMessage(models.Model):
@@ -371,6 +378,9 @@ class Course(models.Model):
         verbose_name_plural = 'курсы'
         get_latest_by = 'scheduled_at'
         ordering = ['scheduled_at']
+        indexes = [
+            models.Index(fields=['slug', 'lecture', 'scheduled_at'], name='course_slug_lecture_date_idx'),
+        ]
 
 
 class GraduatePhoto(models.Model):
@@ -456,3 +466,34 @@ class CourseClient(models.Model):
 
     def __str__(self):
         return f'{self.course}: {self.client.first_name} {self.client.last_name}'
+
+
+class ImageDerivative(models.Model):
+    """
+    Манифест производных изображений: хэш исходника и параметры -> файл в MEDIA_ROOT.
+    width, height - рамка, image_width, image_height - фактический размер изображения
+    """
+
+    source_hash = models.CharField(max_length=40)
+    width = models.PositiveIntegerField()
+    height = models.PositiveIntegerField()
+    quality = models.PositiveSmallIntegerField()
+    format = models.CharField(max_length=10, default='JPEG')
+    path = models.CharField(max_length=255, unique=True)
+    size = models.PositiveIntegerField(default=0)
+    image_width = models.PositiveIntegerField(default=0)
+    image_height = models.PositiveIntegerField(default=0)
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        constraints = [
+            UniqueConstraint(
+                fields=['source_hash', 'width', 'height', 'quality', 'format'],
+                name='unique_image_derivative_spec',
+            )
+        ]
+        verbose_name = 'Производное изображение'
+        verbose_name_plural = 'Производные изображения'
+
+    def __str__(self):
+        return self.path
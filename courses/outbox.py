@@ -0,0 +1,207 @@
+import json
+import logging
+import os
+import socket
+import time
+
+from django.conf import settings
+from django.core.mail import BadHeaderError, EmailMessage, get_connection
+from typing import Dict, List
+from eyelash_courses.logger import send_message as send_tg_msg
+
+logger = logging.getLogger('telegram')
+
+OUTBOX_KEY = 'form_outbox'
+PROCESSING_KEY = f'{OUTBOX_KEY}:processing'
+RETRY_KEY = f'{OUTBOX_KEY}:retry'
+DEAD_LETTER_KEY = f'{OUTBOX_KEY}:dead'
+HEARTBEAT_KEY = f'{OUTBOX_KEY}:worker'
+TG_MESSAGE_LIMIT = 4096
+
+
+def enqueue_form_submission(subject: str, text: str) -> None:
+    """
+    Постановка данных формы в очередь отправки.
+    Запрос посетителя не ждет Telegram и SMTP: доставкой занимается команда send_form_outbox
+    """
+
+    if '\n' in subject or '\r' in subject:
+        # та же проверка, что в django.core.mail: ошибка видна посетителю, а не воркеру
+        raise BadHeaderError(f'Header values can\'t contain newlines (got {subject!r})')
+    entry = {'subject': subject, 'text': text, 'created_at': time.time(), 'attempts': 0, 'delivered': []}
+    settings.REDIS_DB.lpush(OUTBOX_KEY, json.dumps(entry, ensure_ascii=False))
+
+
+class OutboxWorker:
+    """
+    Доставка форм из очереди Redis в чат Telegram и на почту.
+
+    Записи забираются пачками в собственный список воркера PROCESSING_KEY:{host}:{pid}.
+    Пока воркер работает, он продлевает ключ HEARTBEAT_KEY:{host}:{pid}; списки воркеров,
+    чей ключ истек, возвращаются в очередь (recover). Сообщения пачки
+    объединяются в одно сообщение Telegram и отправляются через одно соединение SMTP.
+    Канал, в который запись уже доставлена, при повторе не используется.
+    Неудачные записи повторяются с растущей паузой, после max_attempts попыток
+    или при неисправимой ошибке попадают в DEAD_LETTER_KEY
+    """
+
+    def __init__(
+            self,
+            redis_db,
+            batch_size: int = 20,
+            max_attempts: int = 5,
+            retry_delay: int = 30,
+            poll_timeout: int = 5,
+            smtp_timeout: int = 10,
+            heartbeat_ttl: int = 120,
+            recover_interval: int = 60,
+    ):
+        self.redis_db = redis_db
+        self.batch_size = batch_size
+        self.max_attempts = max_attempts
+        self.retry_delay = retry_delay
+        self.poll_timeout = poll_timeout
+        self.smtp_timeout = smtp_timeout
+        self.heartbeat_ttl = heartbeat_ttl
+        self.recover_interval = recover_interval
+        self.worker_name = f'{socket.gethostname()}:{os.getpid()}'
+        self.processing_key = f'{PROCESSING_KEY}:{self.worker_name}'
+        self.stats = {'delivered': 0, 'retried': 0, 'dead': 0}
+
+    def heartbeat(self) -> None:
+        self.redis_db.set(f'{HEARTBEAT_KEY}:{self.worker_name}', 1, ex=self.heartbeat_ttl)
+
+    def recover(self) -> int:
+        """Возврат в очередь записей, которые обрабатывали остановленные воркеры"""
+
+        # PROCESSING_KEY - общий список воркеров предыдущей версии
+        processing_keys = [PROCESSING_KEY.encode(), *self.redis_db.scan_iter(match=f'{PROCESSING_KEY}:*')]
+        recovered = 0
+        for processing_key in processing_keys:
+            processing_key = processing_key.decode('utf-8')
+            worker_name = processing_key[len(PROCESSING_KEY) + 1:]
+            # собственный список при запуске остался от прошлого процесса с тем же pid
+            if worker_name != self.worker_name and self.redis_db.exists(f'{HEARTBEAT_KEY}:{worker_name}'):
+                continue
+            while self.redis_db.rpoplpush(processing_key, OUTBOX_KEY):
+                recovered += 1
+        if recovered:
+            logger.warning(f'Возвращено в очередь форм после остановки воркеров: {recovered}')
+        return recovered
+
+    def requeue_due(self, now: float = None) -> int:
+        requeued = 0
+        for raw in self.redis_db.zrangebyscore(RETRY_KEY, '-inf', now or time.time()):
+            # запись переносит тот воркер, который успел удалить ее из RETRY_KEY
+            if self.redis_db.zrem(RETRY_KEY, raw):
+                self.redis_db.lpush(OUTBOX_KEY, raw)
+                requeued += 1
+        return requeued
+
+    def take_batch(self, block: bool = True) -> List[bytes]:
+        if block:
+            raw = self.redis_db.brpoplpush(OUTBOX_KEY, self.processing_key, timeout=self.poll_timeout)
+        else:
+            raw = self.redis_db.rpoplpush(OUTBOX_KEY, self.processing_key)
+        if raw is None:
+            return []
+        batch = [raw]
+        while len(batch) < self.batch_size:
+            raw = self.redis_db.rpoplpush(OUTBOX_KEY, self.processing_key)
+            if raw is None:
+                break
+            batch.append(raw)
+        return batch
+
+    @staticmethod
+    def get_tg_chunks(entries: List[Dict]) -> List[List[Dict]]:
+        """Записи пачки, сгруппированные в сообщения не длиннее лимита Telegram"""
+
+        chunks, chunk, length = [], [], 0
+        for entry in entries:
+            entry_length = min(len(entry['text']), TG_MESSAGE_LIMIT) + 2
+            if chunk and length + entry_length > TG_MESSAGE_LIMIT:
+                chunks.append(chunk)
+                chunk, length = [], 0
+            chunk.append(entry)
+            length += entry_length
+        if chunk:
+            chunks.append(chunk)
+        return chunks
+
+    def deliver_telegram(self, entries: List[Dict]) -> None:
+        for chunk in self.get_tg_chunks(entries):
+            msg = '\n\n'.join(entry['text'][:TG_MESSAGE_LIMIT] for entry in chunk)[:TG_MESSAGE_LIMIT]
+            # повторы выполняет очередь, поэтому отправка делается за одну попытку
+            if not send_tg_msg(settings.TG_LOGGER_BOT, settings.TG_LOGGER_CHAT, msg, attempts=1):
+                for entry in chunk:
+                    entry['error'] = 'telegram: сообщение не доставлено'
+                return
+            for entry in chunk:
+                entry['delivered'].append('telegram')
+
+    def deliver_email(self, entries: List[Dict]) -> None:
+        try:
+            with get_connection(timeout=self.smtp_timeout) as connection:
+                for entry in entries:
+                    message = EmailMessage(
+                        entry['subject'],
+                        entry['text'],
+                        settings.EMAIL_HOST_USER,
+                        settings.RECIPIENTS_EMAIL,
+                        connection=connection,
+                    )
+                    try:
+                        message.send()
+                    except BadHeaderError as err:
+                        entry['error'] = f'email: {err}'
+                        entry['dead'] = True
+                        continue
+                    entry['delivered'].append('email')
+        except Exception as err:
+            for entry in entries:
+                if 'email' not in entry['delivered'] and not entry.get('dead'):
+                    entry['error'] = f'email: {err}'
+
+    def deliver(self, batch: List[bytes]) -> None:
+        entries = [json.loads(raw) for raw in batch]
+        for channel, deliver in (('telegram', self.deliver_telegram), ('email', self.deliver_email)):
+            pending = [entry for entry in entries if channel not in entry['delivered'] and not entry.get('dead')]
+            if pending:
+                deliver(pending)
+                self.heartbeat()
+        now = time.time()
+        pipe = self.redis_db.pipeline()
+        for raw, entry in zip(batch, entries):
+            pipe.lrem(self.processing_key, 1, raw)
+            if len(entry['delivered']) == 2:
+                self.stats['delivered'] += 1
+                continue
+            entry['attempts'] += 1
+            if entry.get('dead') or entry['attempts'] >= self.max_attempts:
+                self.stats['dead'] += 1
+                logger.error(f'Форма не доставлена: {entry["subject"]}: {entry.get("error")}')
+                pipe.lpush(DEAD_LETTER_KEY, json.dumps(entry, ensure_ascii=False))
+            else:
+                self.stats['retried'] += 1
+                retry_at = now + self.retry_delay * 2 ** (entry['attempts'] - 1)
+                pipe.zadd(RETRY_KEY, {json.dumps(entry, ensure_ascii=False): retry_at})
+        pipe.execute()
+
+    def run(self, once: bool = False) -> Dict[str, int]:
+        """Обработка очереди. once=True - разобрать текущую очередь и завершить работу"""
+
+        self.recover()
+        recovered_at = time.monotonic()
+        while True:
+            self.heartbeat()
+            if time.monotonic() - recovered_at > self.recover_interval:
+                # список воркера, остановленного на другом сервере, иначе ждал бы его перезапуска
+                self.recover()
+                recovered_at = time.monotonic()
+            self.requeue_due()
+            batch = self.take_batch(block=not once)
+            if batch:
+                self.deliver(batch)
+            elif once:
+                return self.stats
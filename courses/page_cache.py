@@ -0,0 +1,184 @@
+import bisect
+import contextvars
+import hashlib
+import re
+import time
+
+from functools import wraps
+from operator import itemgetter
+from typing import Callable, Iterable
+from urllib.parse import urlencode
+from django.conf import settings
+from django.contrib import messages
+from django.http import HttpResponse
+from django.middleware.csrf import get_token
+from redis.exceptions import WatchError
+
+PAGE_CACHE_VERSION = 1
+PAGE_CACHE_TTL = 3600
+CSRF_PLACEHOLDER = b'__csrf_token__'
+CSRF_INPUT_RE = re.compile(rb'(name="csrfmiddlewaretoken" value=")[^"]*(")')
+
+# Страница отрисована по устаревшим данным (см. get_or_build_page_data) и в кэш не сохраняется
+stale_page = contextvars.ContextVar('stale_page', default=False)
+
+
+def mark_stale_page() -> None:
+    stale_page.set(True)
+
+
+def get_page_cache_key(request, query_params: Iterable[str] = ()) -> str:
+    """
+    Ключ страницы: хост, путь и параметры запроса из query_params в порядке сортировки.
+    Остальные параметры (utm-метки и т.п.) в ключ не попадают, иначе каждая новая метка
+    добавляла бы в кэш еще одну копию страницы
+    """
+
+    query = sorted((name, sorted(values)) for name, values in request.GET.lists() if name in query_params)
+    url = f'{request.get_host()}{request.path}?{urlencode(query, doseq=True)}'
+    return f'page_cache:v{PAGE_CACHE_VERSION}:{hashlib.sha1(url.encode()).hexdigest()}'
+
+
+def get_tag_key(tag: str) -> str:
+    return f'page_cache:v{PAGE_CACHE_VERSION}:tag:{tag}'
+
+
+def get_tag_generation_key(tag: str) -> str:
+    return f'{get_tag_key(tag)}:generation'
+
+
+def get_tag_generations(tags: list) -> list:
+    """Поколения тегов: увеличиваются при каждом сбросе страниц тега"""
+
+    return settings.REDIS_DB.mget([get_tag_generation_key(tag) for tag in tags]) if tags else []
+
+
+def is_cacheable_request(request) -> bool:
+    """В кэш попадают только GET-запросы анонимных посетителей без flash-сообщений"""
+
+    return (
+        request.method in ('GET', 'HEAD')
+        and not request.user.is_authenticated
+        and not len(messages.get_messages(request))
+    )
+
+
+def is_cacheable_response(request, response: HttpResponse) -> bool:
+    """
+    Страница сохраняется, только если она одинакова для всех анонимных посетителей:
+    без заголовка Vary и cookie, без записи в сессию и без новых flash-сообщений
+    """
+
+    session = getattr(request, 'session', None)
+    return (
+        response.status_code == 200
+        and not response.streaming
+        and not response.has_header('Vary')
+        and not response.cookies
+        and not (session is not None and session.modified)
+        and not getattr(messages.get_messages(request), '_queued_messages', None)
+    )
+
+
+def store_page(key: str, response: HttpResponse, tags: list, ttl: int, generations: list) -> bool:
+    """
+    Сохранение страницы и привязка ее к тегам.
+    generations - поколения тегов до отрисовки: если за время отрисовки страницы тега
+    сбрасывались, страница собрана из старых данных и не сохраняется.
+    CSRF-токен формы заменяется меткой, при выдаче из кэша подставляется токен посетителя
+    """
+
+    content = CSRF_INPUT_RE.sub(rb'\1' + CSRF_PLACEHOLDER + rb'\2', response.content)
+    generation_keys = [get_tag_generation_key(tag) for tag in tags]
+    with settings.REDIS_DB.pipeline() as pipe:
+        try:
+            if generation_keys:
+                pipe.watch(*generation_keys)
+                if pipe.mget(generation_keys) != generations:
+                    return False
+            pipe.multi()
+            pipe.hset(key, mapping={'content': content, 'content_type': response['Content-Type']})
+            pipe.expire(key, ttl)
+            for tag in tags:
+                pipe.sadd(get_tag_key(tag), key)
+                pipe.expire(get_tag_key(tag), PAGE_CACHE_TTL)
+            pipe.execute()
+        except WatchError:
+            return False
+    return True
+
+
+def get_cached_response(request, key: str) -> HttpResponse | None:
+    cached = settings.REDIS_DB.hgetall(key)
+    if not cached:
+        return
+    content = cached[b'content'].replace(CSRF_PLACEHOLDER, get_token(request).encode())
+    response = HttpResponse(content, content_type=cached[b'content_type'].decode())
+    response['X-Page-Cache'] = 'hit'
+    return response
+
+
+def invalidate_page_cache(*tags: str) -> None:
+    """Удаление из кэша всех страниц, привязанных к тегам"""
+
+    redis = settings.REDIS_DB
+    tag_keys = [get_tag_key(tag) for tag in tags]
+    pipe = redis.pipeline()
+    for tag in tags:
+        # страницы, которые отрисовываются прямо сейчас, не сохранятся (см. store_page)
+        pipe.incr(get_tag_generation_key(tag))
+    for tag_key in tag_keys:
+        pipe.smembers(tag_key)
+    page_keys = set().union(*pipe.execute()[len(tags):])
+    if page_keys:
+        redis.delete(*page_keys)
+    redis.delete(*tag_keys)
+
+
+def cache_page(
+        get_tags: Callable[..., Iterable[str]],
+        get_ttl: Callable[..., int] = None,
+        query_params: Iterable[str] = (),
+):
+    """
+    Кэширование готовой страницы в Redis.
+    get_tags(request, *args, **kwargs) - теги объектов, показанных на странице:
+    по ним страница удаляется из кэша при изменении этих объектов (см. courses.signals).
+    get_ttl - срок хранения страницы, по умолчанию PAGE_CACHE_TTL.
+    query_params - параметры запроса, от которых зависит содержимое страницы
+    """
+
+    def decorator(view):
+        @wraps(view)
+        def wrapper(request, *args, **kwargs):
+            if not is_cacheable_request(request):
+                return view(request, *args, **kwargs)
+            key = get_page_cache_key(request, query_params)
+            response = get_cached_response(request, key)
+            if response:
+                return response
+            tags = list(get_tags(request, *args, **kwargs))
+            generations = get_tag_generations(tags)
+            token = stale_page.set(False)
+            try:
+                response = view(request, *args, **kwargs)
+                stale = stale_page.get()
+            finally:
+                stale_page.reset(token)
+            if not stale and is_cacheable_response(request, response):
+                ttl = get_ttl(request, *args, **kwargs) if get_ttl else PAGE_CACHE_TTL
+                if ttl > 0:
+                    store_page(key, response, tags, ttl, generations)
+            return response
+        return wrapper
+    return decorator
+
+
+def get_course_list_ttl(all_courses: list) -> int:
+    """Срок хранения страницы со списками курсов: до начала ближайшего курса"""
+
+    now = time.time()
+    border = bisect.bisect_right(all_courses, now, key=itemgetter('scheduled_at'))
+    if border == len(all_courses):
+        return PAGE_CACHE_TTL
+    return min(int(all_courses[border]['scheduled_at'] - now) + 1, PAGE_CACHE_TTL)
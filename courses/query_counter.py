@@ -0,0 +1,39 @@
+from django.db import connections
+from django.db.backends.signals import connection_created
+
+
+class QueryCounter:
+    """
+    Число SQL-запросов во всех потоках.
+    django_async_orm выполняет выборки QuerySet в отдельном потоке со своим соединением,
+    поэтому assertNumQueries и CaptureQueriesContext, которые смотрят только соединение
+    текущего потока, их не видят. По той же причине данные для подсчета должны быть
+    зафиксированы, чтобы их увидело соединение другого потока
+    """
+
+    def __init__(self):
+        self.count = 0
+        self.connections = []
+
+    def count_query(self, execute, sql, params, many, context):
+        self.count += 1
+        return execute(sql, params, many, context)
+
+    def add_query_counter(self, sender, connection, **kwargs):
+        if self.count_query not in connection.execute_wrappers:
+            connection.execute_wrappers.append(self.count_query)
+            self.connections.append(connection)
+
+    def __enter__(self):
+        for connection in connections.all():
+            self.add_query_counter(None, connection)
+        connection_created.connect(self.add_query_counter, weak=False)
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        connection_created.disconnect(self.add_query_counter)
+        # счетчик снимается и с соединений других потоков
+        for connection in self.connections:
+            if self.count_query in connection.execute_wrappers:
+                connection.execute_wrappers.remove(self.count_query)
+        self.connections.clear()
@@ -0,0 +1,129 @@
+from django.conf import settings
+from django.db import transaction
+from django.db.models.signals import m2m_changed, pre_save, pre_delete, post_save, post_delete
+from django.dispatch import receiver
+from bots.state_store import UserStateStore
+from courses.models import Client, Course, CourseImage, CourseClient, Program, Lecturer, Office, GraduatePhoto
+from .general_functions import invalidate_page_data
+from .page_cache import invalidate_page_cache
+
+
+def invalidate_after_commit(page_data_keys=(), tags=()):
+    """Сброс данных страниц и кэша страниц после фиксации транзакции, чтобы кэш не собрался из старых данных"""
+
+    def invalidate():
+        if page_data_keys:
+            invalidate_page_data(*page_data_keys)
+        if tags:
+            invalidate_page_cache(*tags)
+    transaction.on_commit(invalidate)
+
+
+def get_course_page_tag(slug: str, date_slug: str) -> str:
+    return f'course:{slug}:{date_slug}'
+
+
+def get_program_page_tag(slug: str) -> str:
+    return f'program:{slug}'
+
+
+def get_course_tags(course_values) -> set:
+    """Теги страниц курса по значениям (slug, scheduled_at, program_id)"""
+
+    tags = set()
+    program_ids = set()
+    for slug, scheduled_at, program_id in course_values:
+        tags.add(get_course_page_tag(slug, scheduled_at.strftime('%d-%m-%Y')))
+        if program_id:
+            program_ids.add(program_id)
+    if program_ids:
+        tags.update(
+            get_program_page_tag(slug)
+            for slug in Program.objects.filter(pk__in=program_ids).values_list('slug', flat=True)
+        )
+    return tags
+
+
+@receiver(pre_save, sender=Course)
+def remember_course_pages(sender, instance, **kwargs):
+    # при переносе курса или смене программы нужно сбросить и страницы со старыми значениями
+    instance._previous_page_values = list(
+        Course.objects.filter(pk=instance.pk).values_list('slug', 'scheduled_at', 'program_id')
+    ) if instance.pk else []
+
+
+@receiver(post_save, sender=Course)
+@receiver(post_delete, sender=Course)
+def invalidate_course_pages(sender, instance, **kwargs):
+    course_values = [(instance.slug, instance.scheduled_at, instance.program_id)]
+    course_values.extend(getattr(instance, '_previous_page_values', []))
+    invalidate_after_commit(['all_courses'], {'courses', *get_course_tags(course_values)})
+
+
+@receiver(post_save, sender=CourseImage)
+@receiver(post_delete, sender=CourseImage)
+def invalidate_course_image_pages(sender, instance, **kwargs):
+    course_values = Course.objects.filter(pk=instance.course_id).values_list('slug', 'scheduled_at', 'program_id')
+    invalidate_after_commit(['all_courses', 'random_images'], {'courses', 'footer', *get_course_tags(course_values)})
+
+
+def invalidate_participants_pages(course_ids) -> None:
+    # на странице курса выводится число участников
+    course_values = Course.objects.filter(pk__in=course_ids).values_list('slug', 'scheduled_at')
+    invalidate_after_commit(tags=[
+        get_course_page_tag(slug, scheduled_at.strftime('%d-%m-%Y')) for slug, scheduled_at in course_values
+    ])
+
+
+@receiver(post_save, sender=CourseClient)
+@receiver(post_delete, sender=CourseClient)
+def invalidate_course_participants_pages(sender, instance, **kwargs):
+    invalidate_participants_pages([instance.course_id])
+
+
+@receiver(m2m_changed, sender=Course.clients.through)
+def invalidate_course_clients_pages(sender, instance, action, reverse, pk_set, **kwargs):
+    # боты записывают клиентов через course.clients.add()/remove(), а они не вызывают post_save/post_delete
+    if action not in ('post_add', 'post_remove', 'pre_clear'):
+        return
+    if not reverse:
+        course_ids = [instance.pk]
+    elif action == 'pre_clear':
+        course_ids = list(CourseClient.objects.filter(client=instance).values_list('course_id', flat=True))
+    else:
+        course_ids = pk_set
+    invalidate_participants_pages(course_ids)
+
+
+@receiver(post_save, sender=Program)
+@receiver(post_delete, sender=Program)
+def invalidate_program_pages(sender, instance, **kwargs):
+    invalidate_after_commit(['programs', 'all_courses'], ['footer', get_program_page_tag(instance.slug)])
+
+
+@receiver(post_save, sender=Lecturer)
+@receiver(pre_delete, sender=Lecturer)
+def invalidate_lecturer_pages(sender, instance, **kwargs):
+    # pre_delete: после удаления лектора его курсы уже отвязаны (SET_NULL)
+    course_values = Course.objects.filter(lecture=instance).values_list('slug', 'scheduled_at', 'program_id')
+    invalidate_after_commit(['all_courses'], {'courses', *get_course_tags(course_values)})
+
+
+@receiver(post_save, sender=Office)
+@receiver(post_delete, sender=Office)
+def invalidate_office_pages(sender, instance, **kwargs):
+    invalidate_after_commit(['office'], ['office'])
+
+
+@receiver(post_save, sender=GraduatePhoto)
+@receiver(post_delete, sender=GraduatePhoto)
+def invalidate_graduate_photo_pages(sender, instance, **kwargs):
+    invalidate_after_commit(['graduate_photos'], ['graduate_photos'])
+
+
+@receiver(post_delete, sender=Client)
+def delete_client_bot_states(sender, instance, **kwargs):
+    # иначе бот продолжит работать с удаленной записью Client из сохраненного состояния диалога
+    for platform, user_id in (('tg', instance.telegram_id), ('vk', instance.vk_id)):
+        if user_id:
+            UserStateStore(settings.REDIS_DB, platform).delete(user_id)
@@ -12,7 +12,7 @@ from vk_bot.vk_lib import (
     edit_vk_album,
     make_main_album_photo
 )
-from courses.management.commands._get_preview import get_preview
+from courses.derivatives import update_previews
 from courses.models import Course, CourseImage
 # celery -A eyelash_courses worker -c 3
 
@@ -72,9 +72,7 @@ def upload_photos_in_album_task(upload_photos, vk_album_id):
 def course_admin_save_formset(instances):
     images = [image for image in instances if isinstance(image, CourseImage)]
     if images:
-        for preview in images:
-            get_preview(preview)
-            get_preview(preview, preview_attr='big_preview', width=370, height=320)
+        update_previews(images)
         course_obj = images[0].course
         vk_album_id = course_obj.vk_album_id
         upload_photos = [image for image in images if not image.image_vk_id and image.upload_vk]
@@ -105,9 +103,7 @@ def course_admin_save_formset(instances):
 def upgrade_courses_images(obj):
     images = obj.images.all()
     if images:
-        for preview in images:
-            get_preview(preview)
-            get_preview(preview, preview_attr='big_preview', width=370, height=320)
+        update_previews(images)
         vk_album_id = obj.vk_album_id
         upload_photos = [image for image in images if not image.image_vk_id and image.upload_vk]
         if upload_photos:
@@ -116,8 +112,7 @@ def upgrade_courses_images(obj):
 
 @celery_app.task
 def upgrade_course_image(obj):
-    get_preview(obj)
-    get_preview(obj, preview_attr='big_preview', width=370, height=320)
+    update_previews([obj])
     vk_album_id = obj.course.vk_album_id
     if not obj.image_vk_id and obj.upload_vk:
         async_to_sync(upload_photos_in_album)([obj], vk_album_id)
@@ -1,3 +1,214 @@
-from django.test import TestCase
+import shutil
+import tempfile
 
-# Create your tests here.
+from datetime import timedelta
+from io import BytesIO
+from unittest import skipIf
+
+from django.contrib.auth.models import AnonymousUser
+from django.core.files.base import ContentFile
+from django.core.files.storage import default_storage
+from django.http import HttpResponse
+from django.test import SimpleTestCase, TransactionTestCase, RequestFactory, override_settings
+from django.utils import timezone
+from PIL import Image
+
+from courses import views
+from courses.derivatives import get_derivative_name, get_source_hash, get_srcsets
+from courses.models import Client, Course, CourseClient, CourseImage, ImageDerivative, Lecturer, Program
+from courses.page_cache import cache_page, invalidate_page_cache, mark_stale_page
+from courses.query_counter import QueryCounter
+
+try:
+    import fakeredis
+except ImportError:
+    fakeredis = None
+
+
+class QueryCountMixin:
+    """Тесты ниже - TransactionTestCase: выборки django_async_orm идут через соединение другого потока"""
+
+    def assertQueryCount(self, expected, func, *args, **kwargs):
+        with QueryCounter() as counter:
+            result = func(*args, **kwargs)
+        self.assertEqual(counter.count, expected, f'выполнено {counter.count} запросов вместо {expected}')
+        return result
+
+
+def get_jpeg(width=40, height=20) -> ContentFile:
+    buffer = BytesIO()
+    Image.new('RGB', (width, height), 'white').save(buffer, format='JPEG')
+    return ContentFile(buffer.getvalue())
+
+
+@skipIf(fakeredis is None, 'для тестов страниц нужен fakeredis')
+class DetailPagesQueryCountTest(QueryCountMixin, TransactionTestCase):
+    """Число SQL-запросов страниц курса и программы"""
+
+    def setUp(self):
+        media_root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, media_root, ignore_errors=True)
+        redis = fakeredis.FakeRedis()
+        # настройки подменяются до создания записей: сигналы сбрасывают кэш в Redis после фиксации
+        settings_override = override_settings(REDIS_DB=redis, BANNER_IMAGES=['banner.jpg'], MEDIA_ROOT=media_root)
+        settings_override.enable()
+        self.addCleanup(settings_override.disable)
+        self.factory = RequestFactory()
+
+        self.program = Program(title='Классика', slug='klassika')
+        self.program.image.save('klassika.jpg', get_jpeg(), save=False)
+        self.program.save()
+        self.lecturer = Lecturer.objects.create(first_name='Анна', last_name='Иванова', slug='anna')
+        self.course = Course.objects.create(
+            name='Наращивание',
+            slug='narashivanie',
+            program=self.program,
+            lecture=self.lecturer,
+            scheduled_at=timezone.now() + timedelta(days=10),
+            duration=2,
+            price=10000,
+        )
+        for position in range(3):
+            CourseImage.objects.create(
+                course=self.course,
+                image=f'courses/{position}.jpg',
+                image_preview=f'courses/{position}_preview.jpg',
+                big_preview=f'courses/{position}_big.jpg',
+                position=position,
+            )
+        for number in range(5):
+            client = Client.objects.create(first_name=f'Клиент {number}', telegram_id=number + 1)
+            CourseClient.objects.create(client=client, course=self.course)
+
+    def get(self, view, path, **kwargs):
+        request = self.factory.get(path)
+        request.user = AnonymousUser()
+        return view(request, **kwargs)
+
+    def course_url_kwargs(self):
+        return {
+            'slug': self.course.slug,
+            'lecturer': self.lecturer.slug,
+            'date': self.course.scheduled_at.strftime('%d-%m-%Y'),
+        }
+
+    def get_course_details(self):
+        return self.get(views.course_details.__wrapped__, '/course/', **self.course_url_kwargs())
+
+    def test_course_details_queries(self):
+        # первый запрос заполняет данные подвала в Redis
+        self.get_course_details()
+        response = self.assertQueryCount(2, self.get_course_details)
+        self.assertEqual(response.status_code, 200)
+
+    def test_program_details_queries(self):
+        self.get(views.program_details.__wrapped__, '/program/', slug=self.program.slug)
+        response = self.assertQueryCount(
+            1, self.get, views.program_details.__wrapped__, '/program/', slug=self.program.slug
+        )
+        self.assertEqual(response.status_code, 200)
+        self.assertIn(self.course.name, response.content.decode())
+
+    def test_cached_page_without_queries(self):
+        self.get(views.course_details, '/course/', **self.course_url_kwargs())
+        response = self.assertQueryCount(0, self.get, views.course_details, '/course/', **self.course_url_kwargs())
+        self.assertEqual(response['X-Page-Cache'], 'hit')
+
+    def test_cached_page_ignores_query_params(self):
+        self.get(views.course_details, '/course/', **self.course_url_kwargs())
+        response = self.get(views.course_details, '/course/?utm_source=vk', **self.course_url_kwargs())
+        self.assertEqual(response['X-Page-Cache'], 'hit')
+
+    def test_clients_add_invalidates_course_page(self):
+        self.get(views.course_details, '/course/', **self.course_url_kwargs())
+        client = Client.objects.create(first_name='Новый клиент', telegram_id=100)
+        self.course.clients.add(client)
+        response = self.get(views.course_details, '/course/', **self.course_url_kwargs())
+        self.assertFalse(response.has_header('X-Page-Cache'))
+
+
+@skipIf(fakeredis is None, 'для тестов кэша страниц нужен fakeredis')
+@override_settings(ALLOWED_HOSTS=['testserver'])
+class PageCacheTest(SimpleTestCase):
+    """Страницы, отрисованные по устаревшим данным, в кэш не попадают"""
+
+    def setUp(self):
+        settings_override = override_settings(REDIS_DB=fakeredis.FakeRedis())
+        settings_override.enable()
+        self.addCleanup(settings_override.disable)
+        self.factory = RequestFactory()
+
+    def get(self, view):
+        request = self.factory.get('/page/')
+        request.user = AnonymousUser()
+        return view(request)
+
+    def test_stale_page_not_stored(self):
+        stale = True
+
+        @cache_page(lambda request: ['footer'])
+        def view(request):
+            if stale:
+                mark_stale_page()
+            return HttpResponse('page')
+
+        self.get(view)
+        self.assertFalse(self.get(view).has_header('X-Page-Cache'))
+        stale = False
+        self.get(view)
+        self.assertEqual(self.get(view)['X-Page-Cache'], 'hit')
+
+    def test_page_invalidated_during_render_not_stored(self):
+        @cache_page(lambda request: ['footer'])
+        def view(request):
+            invalidate_page_cache('footer')
+            return HttpResponse('page')
+
+        self.get(view)
+        self.assertFalse(self.get(view).has_header('X-Page-Cache'))
+
+
+class SrcsetTest(QueryCountMixin, TransactionTestCase):
+    """Адаптивные варианты фото из манифеста производных изображений"""
+
+    source_hash = 'ab' * 20
+
+    def create_derivative(self, width, height, quality, image_format, image_width):
+        return ImageDerivative.objects.create(
+            source_hash=self.source_hash,
+            width=width,
+            height=height,
+            quality=quality,
+            format=image_format,
+            path=get_derivative_name(self.source_hash, (width, height, quality, image_format)),
+            image_width=image_width,
+            image_height=image_width // 2,
+        )
+
+    def test_srcsets_by_format(self):
+        jpeg = [self.create_derivative(231, 130, 75, 'JPEG', 231), self.create_derivative(462, 260, 75, 'JPEG', 462)]
+        webp = [self.create_derivative(231, 130, 70, 'WEBP', 231), self.create_derivative(462, 260, 70, 'WEBP', 462)]
+        # вариант с чужим качеством в srcset не попадает
+        self.create_derivative(231, 130, 90, 'JPEG', 231)
+        preview_name = get_derivative_name(self.source_hash, (231, 130, 75, 'JPEG'))
+        self.assertEqual(get_source_hash(preview_name), self.source_hash)
+
+        srcsets = self.assertQueryCount(1, get_srcsets, [get_source_hash(preview_name)])
+        preview = srcsets[self.source_hash]['image_preview']
+        self.assertEqual(
+            preview['srcset'],
+            f'{default_storage.url(jpeg[0].path)} 231w, {default_storage.url(jpeg[1].path)} 462w',
+        )
+        self.assertEqual(preview['sources'], [{
+            'type': 'image/webp',
+            'srcset': f'{default_storage.url(webp[0].path)} 231w, {default_storage.url(webp[1].path)} 462w',
+        }])
+
+    def test_small_source_listed_once(self):
+        small = self.create_derivative(480, 480, 75, 'JPEG', 300)
+        self.create_derivative(960, 960, 75, 'JPEG', 300)
+        srcsets = get_srcsets([self.source_hash])
+        self.assertEqual(srcsets[self.source_hash]['image']['srcset'], f'{default_storage.url(small.path)} 300w')
+
+    def test_legacy_previews_without_queries(self):
+        self.assertEqual(self.assertQueryCount(0, get_srcsets, [get_source_hash('courses/1_preview.jpg')]), {})
@@ -1,14 +1,14 @@
-import smtplib
 import random
 from django.shortcuts import render, HttpResponse, get_object_or_404
 from django.conf import settings
-from django.core.mail import send_mail, BadHeaderError
+from django.core.mail import BadHeaderError
 from courses.forms import ContactForm, CourseForm
 from django.contrib import messages
-from courses.models import Course, Program, Office, GraduatePhoto
+from django.db.models import Count, Prefetch
+from django.http import Http404
+from courses.models import Course, CourseImage, Program, Office, GraduatePhoto
 from django.utils import timezone
-from datetime import datetime
-from eyelash_courses.logger import send_message as send_tg_msg
+from datetime import datetime, timedelta
 from .general_functions import (
     get_courses,
     submit_course_form_data,
@@ -16,10 +16,18 @@ from .general_functions import (
     get_redis_or_get_db_all_courses,
     get_redis_or_get_db
 )
+from .derivatives import get_source_hash, get_srcsets
+from .page_cache import cache_page, get_course_list_ttl
+from .signals import get_course_page_tag, get_program_page_tag
 
 # from .tasks import send_message_task
 
 
+def get_course_list_page_ttl(request, *args, **kwargs) -> int:
+    return get_course_list_ttl(get_redis_or_get_db_all_courses('all_courses'))
+
+
+@cache_page(lambda request: ['courses', 'office', 'graduate_photos', 'footer'], get_course_list_page_ttl)
 def home(request):
     template = 'courses/index.html'
     if request.method == 'POST' and request.POST['type_form'] == 'registration':
@@ -47,12 +55,6 @@ def home(request):
                 messages.success(request, 'Отправлено!')
             except BadHeaderError:
                 return HttpResponse('Ошибка в теме письма.')
-            except smtplib.SMTPDataError as err:
-                send_tg_msg(
-                    token=settings.TG_LOGGER_BOT,
-                    chat_id=settings.TG_LOGGER_CHAT,
-                    msg=str(err)
-                )
         else:
             data, msg = get_error_data(form)
             messages.error(request, msg)
@@ -61,17 +63,19 @@ def home(request):
         form = ContactForm()
 
     all_courses = get_redis_or_get_db_all_courses('all_courses')
+    offices = get_redis_or_get_db('office', Office)
     context = {
         'src_map': settings.SRC_MAP,
         'courses': get_courses(all_courses, future=True),
         'past_courses': get_courses(all_courses, past=True),
-        'office': get_redis_or_get_db('office', Office).first(),
+        'office': offices[0] if offices else None,
         'graduate_photos': get_redis_or_get_db('graduate_photos', GraduatePhoto),
         'form': form
     }
     return render(request, template, context)
 
 
+@cache_page(lambda request: ['courses', 'footer'], get_course_list_page_ttl)
 def course(request):
     template = 'courses/course.html'
     all_courses = get_redis_or_get_db_all_courses('all_courses')
@@ -83,15 +87,29 @@ def course(request):
     return render(request, template, context)
 
 
+@cache_page(lambda request, slug, lecturer, date: [get_course_page_tag(slug, date), 'footer'])
 def course_details(request, slug: str, lecturer: str, date: str):
     template = 'courses/course-details.html'
-    scheduled_at = datetime.strptime(date, '%d-%m-%Y')
+    try:
+        day_start = timezone.make_aware(datetime.strptime(date, '%d-%m-%Y'))
+    except ValueError:
+        raise Http404
+    # Диапазон вместо scheduled_at__date, чтобы работал индекс (slug, lecture, scheduled_at)
     course_instance = (
         Course.objects
-        .filter(scheduled_at__date=scheduled_at, slug=slug, lecture__slug=lecturer)
-        .select_related('lecture')
-        .prefetch_related('images')[0]
+        .filter(
+            slug=slug,
+            lecture__slug=lecturer,
+            scheduled_at__gte=day_start,
+            scheduled_at__lt=day_start + timedelta(days=1)
+        )
+        .select_related('lecture', 'program')
+        .annotate(participants_count=Count('clients'))
+        .prefetch_related(Prefetch('images', queryset=CourseImage.objects.order_by('position')))
+        .first()
     )
+    if not course_instance:
+        raise Http404
     if request.method == 'POST' and request.POST['type_form'] == 'registration':
         form = CourseForm(request.POST)
         if form.is_valid():
@@ -112,38 +130,35 @@ def course_details(request, slug: str, lecturer: str, date: str):
                 messages.success(request, 'Отправлено!')
             except BadHeaderError:
                 return HttpResponse('Ошибка в теме письма.')
-            except smtplib.SMTPDataError as err:
-                send_tg_msg(
-                    token=settings.TG_LOGGER_BOT,
-                    chat_id=settings.TG_LOGGER_CHAT,
-                    msg=str(err)
-                )
         else:
             data, msg = get_error_data(form)
             messages.error(request, msg)
             form = CourseForm(form.cleaned_data | data)
     else:
         form = CourseForm()
+    srcsets = get_srcsets(get_source_hash(image.image_preview.name) for image in course_instance.images.all())
     context = {
         'form': form,
         'banner': random.choice(settings.BANNER_IMAGES),
-        'participants': max(course_instance.get_count_participants(), 2),
+        'participants': max(course_instance.participants_count, 2),
         'course': course_instance,
         'date': course_instance.scheduled_at.strftime("%d.%m.%Y"),
         'start_time': course_instance.scheduled_at.strftime("%H:%M"),
         'images': [
             {
-                'url': image.image.url, 'number': number
+                'url': image.image.url,
+                'number': number,
+                'srcsets': srcsets.get(get_source_hash(image.image_preview.name), {}).get('image', {}),
             } for number, image in enumerate(course_instance.images.all(), start=1)
         ]
     }
     return render(request, template, context)
 
 
+@cache_page(lambda request, slug: [get_program_page_tag(slug), 'footer'], get_course_list_page_ttl)
 def program_details(request, slug: str):
     template = 'courses/program-details.html'
-    program = Program.objects.prefetch_related('courses').get(slug=slug)
-    courses = program.courses.select_related('lecture').prefetch_related('images')
+    program = get_object_or_404(Program, slug=slug)
 
     if request.method == 'POST' and request.POST['type_form'] == 'registration':
         form = CourseForm(request.POST)
@@ -165,12 +180,6 @@ def program_details(request, slug: str):
                 messages.success(request, 'Отправлено!')
             except BadHeaderError:
                 return HttpResponse('Ошибка в теме письма.')
-            except smtplib.SMTPDataError as err:
-                send_tg_msg(
-                    token=settings.TG_LOGGER_BOT,
-                    chat_id=settings.TG_LOGGER_CHAT,
-                    msg=str(err)
-                )
         else:
             data, msg = get_error_data(form)
             messages.error(request, msg)
@@ -183,17 +192,8 @@ def program_details(request, slug: str):
         'program': program,
         'banner': random.choice(settings.BANNER_IMAGES),
         'courses': [
-            {
-                'instance': course_ins,
-                'date': course_ins.scheduled_at.strftime("%d.%m.%Y"),
-                'image_url': course_ins.images.first().image.url,
-                'image_preview_url': course_ins.images.first().image_preview.url,
-                'date_slug': course_ins.scheduled_at.strftime("%d-%m-%Y"),
-                'lecturer': course_ins.lecture.slug,
-            } for course_ins in courses if (
-                    course_ins.scheduled_at > timezone.now()
-                    and course_ins.published_in_bot
-            )
+            course for course in get_courses(get_redis_or_get_db_all_courses('all_courses'), future=True)
+            if course['instance']['program_pk'] == program.pk
         ]
     }
 
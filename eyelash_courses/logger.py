@@ -1,33 +1,152 @@
 import logging
+import os
 import requests
-from time import sleep
+import threading
+
+from collections import deque
+from time import monotonic, sleep
 logger = logging.getLogger('telegram')
 
 
-def send_message(token, chat_id, msg: str):
-    """Отправка сообщения через api TG"""
+def send_message(token, chat_id, msg: str, attempts: int = 3, timeout: int = 10) -> bool:
+    """
+    Отправка сообщения через api TG.
+    Не более attempts попыток, каждая ограничена timeout секундами. False - сообщение не доставлено.
+    Ошибки не логируются: логгер telegram сам отправляет записи через эту функцию
+    """
     url = f"https://api.telegram.org/bot{token}/sendmessage"
     payload = {'chat_id': chat_id, 'text': msg}
-    while True:
+    for attempt in range(attempts):
         try:
-            response = requests.get(url, params=payload)
+            response = requests.post(url, data=payload, timeout=timeout)
             response.raise_for_status()
-            return
-        except (requests.exceptions.ReadTimeout, ConnectionError) as er:
-            sleep(2)
-            logger.warning(f'Ошибка на стороне Tg: {er}', stack_info=True)
-            continue
-        except Exception as err:
-            logger.exception(err)
+            return True
+        except requests.exceptions.RequestException:
+            if attempt < attempts - 1:
+                sleep(2)
+    return False
 
 
 class MyLogsHandler(logging.Handler):
+    """
+    Отправка записей лога в чат TG из фонового потока.
+
+    emit только кладет отформатированную запись в ограниченный буфер, поэтому
+    logger.warning внутри асинхронных обработчиков ботов не ждет сеть.
+    Поток-отправитель раз в flush_interval секунд склеивает накопленные записи
+    в сообщения до лимита TG, одинаковые записи отправляются один раз с числом повторов.
+    При переполнении буфера вытесняются самые старые записи, их число сообщается
+    в следующем сообщении. Оставшиеся записи отправляются в close, который вызывает
+    logging.shutdown при завершении процесса
+    """
+
+    message_limit = 4096
 
-    def __init__(self, token, chat_id):
+    def __init__(self, token, chat_id, capacity: int = 1000, flush_interval: float = 2, timeout: int = 10):
         super().__init__()
         self.token = token
         self.chat_id = chat_id
+        self.flush_interval = flush_interval
+        self.timeout = timeout
+        self.records = deque(maxlen=capacity)
+        self.dropped = 0
+        self.sending = False
+        self.flush_requested = False
+        self.closed = False
+        self.condition = threading.Condition()
+        self.thread = None
+        self.pid = None
+
+    def start_thread(self) -> None:
+        # после fork (gunicorn, celery) поток родителя в дочернем процессе не существует
+        if self.thread is None or self.pid != os.getpid():
+            self.pid = os.getpid()
+            self.thread = threading.Thread(target=self.run, name='tg-log-sender', daemon=True)
+            self.thread.start()
 
     def emit(self, record: logging.LogRecord) -> None:
-        log_entry = self.format(record)
-        send_message(token=self.token, chat_id=self.chat_id, msg=log_entry)
\ No newline at end of file
+        try:
+            log_entry = self.format(record)
+        except Exception:
+            self.handleError(record)
+            return
+        with self.condition:
+            if self.closed:
+                return
+            if len(self.records) == self.records.maxlen:
+                self.dropped += 1
+            self.records.append(log_entry)
+            self.start_thread()
+
+    def take_records(self) -> tuple[list[str], int]:
+        records, dropped = list(self.records), self.dropped
+        self.records.clear()
+        self.dropped = 0
+        self.sending = bool(records or dropped)
+        return records, dropped
+
+    def get_messages(self, records: list[str], dropped: int) -> list[str]:
+        counts = {}
+        for record in records:
+            counts[record] = counts.get(record, 0) + 1
+        entries = [
+            f'{record}\n(повторено {count} раз)' if count > 1 else record
+            for record, count in counts.items()
+        ]
+        if dropped:
+            entries.insert(0, f'Пропущено записей лога при переполнении буфера: {dropped}')
+        messages, message = [], ''
+        for entry in entries:
+            entry = entry[:self.message_limit]
+            if message and len(message) + len(entry) + 2 > self.message_limit:
+                messages.append(message)
+                message = ''
+            message = f'{message}\n\n{entry}' if message else entry
+        if message:
+            messages.append(message)
+        return messages
+
+    def send(self, records: list[str], dropped: int) -> None:
+        for message in self.get_messages(records, dropped):
+            send_message(token=self.token, chat_id=self.chat_id, msg=message, timeout=self.timeout)
+
+    def run(self) -> None:
+        while True:
+            with self.condition:
+                if not self.closed and not self.flush_requested:
+                    self.condition.wait(self.flush_interval)
+                self.flush_requested = False
+                records, dropped = self.take_records()
+                closed = self.closed
+            try:
+                self.send(records, dropped)
+            finally:
+                with self.condition:
+                    self.sending = False
+                    self.condition.notify_all()
+            if closed and not records and not dropped:
+                return
+
+    def flush(self, timeout: float = 30) -> None:
+        """Ожидание отправки накопленных записей, не дольше timeout секунд"""
+
+        deadline = monotonic() + timeout
+        with self.condition:
+            if self.thread is None or not self.thread.is_alive():
+                return
+            self.flush_requested = True
+            self.condition.notify_all()
+            while self.records or self.dropped or self.sending:
+                remaining = deadline - monotonic()
+                if remaining <= 0:
+                    return
+                self.condition.wait(remaining)
+
+    def close(self) -> None:
+        with self.condition:
+            self.closed = True
+            self.condition.notify_all()
+        thread = self.thread
+        if thread is not None and thread.is_alive() and thread is not threading.current_thread():
+            thread.join(30)
+        super().close()
@@ -29,6 +29,11 @@ TG_LOGGER_CHAT = env.str('TG_LOGGER_CHAT')
 TG_BOT_NAME = env.str('TG_BOT_NAME')
 YOUTUBE_CHANEL_ID = env.str('YOUTUBE_CHANEL_ID')
 VK_GROUP_ID = env.int('VK_GROUP')
+TG_WEBHOOK_SECRET = env.str('TG_WEBHOOK_SECRET', None)
+VK_CALLBACK_SECRET = env.str('VK_CALLBACK_SECRET', None)
+VK_CONFIRMATION_CODE = env.str('VK_CONFIRMATION_CODE', None)
+TG_API_URL = env.str('TG_API_URL', None)
+VK_API_URL = env.str('VK_API_URL', None)
 ADMIN_IDS = env.list('ADMIN_IDS')
 TG_ADMIN_IDS = env.list('TG_ADMIN_IDS')
 ADMIN_URL = env.str('ADMIN_URL')